@@ -0,0 +1,29 @@
+"""response audio content hash
+
+Revision ID: 0012_response_audio_sha256
+Revises: 0011_add_encrypted_columns
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0012_response_audio_sha256"
+down_revision = "0011_add_encrypted_columns"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("response") as batch_op:
+        batch_op.add_column(sa.Column("audio_sha256", sa.String(length=64), nullable=True))
+        batch_op.create_index("ix_response_audio_sha256", ["audio_sha256"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("response") as batch_op:
+        batch_op.drop_index("ix_response_audio_sha256")
+        batch_op.drop_column("audio_sha256")
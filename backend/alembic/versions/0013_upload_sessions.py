@@ -0,0 +1,40 @@
+"""resumable upload sessions
+
+Revision ID: 0013_upload_sessions
+Revises: 0012_response_audio_sha256
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0013_upload_sessions"
+down_revision = "0012_response_audio_sha256"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "uploadsession",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("filename", sa.String(), nullable=False),
+        sa.Column("total_size", sa.Integer(), nullable=False),
+        sa.Column("offset", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("parts", sa.JSON(), nullable=True),
+        sa.Column("parent_id", sa.String(), nullable=True),
+        sa.Column("child_id", sa.String(), nullable=True),
+        sa.Column("text", sa.String(), nullable=True),
+        sa.Column("selected_emoji", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_uploadsession_expires_at", "uploadsession", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_uploadsession_expires_at", table_name="uploadsession")
+    op.drop_table("uploadsession")
@@ -0,0 +1,37 @@
+"""acoustic fingerprints per child
+
+Revision ID: 0014_audio_fingerprints
+Revises: 0013_upload_sessions
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0014_audio_fingerprints"
+down_revision = "0013_upload_sessions"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "audiofingerprint",
+        sa.Column("response_id", sa.Integer(), sa.ForeignKey("response.id"), primary_key=True),
+        sa.Column("child_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("duration_sec", sa.Float(), nullable=False),
+        sa.Column("text_sha256", sa.String(), nullable=True),
+        sa.Column("fingerprint", sa.LargeBinary(), nullable=False),
+    )
+    op.create_index(
+        "ix_audiofingerprint_child_created", "audiofingerprint", ["child_id", "created_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_audiofingerprint_child_created", table_name="audiofingerprint")
+    op.drop_table("audiofingerprint")
@@ -0,0 +1,31 @@
+"""upload session finalize state
+
+Revision ID: 0015_upload_session_status
+Revises: 0014_audio_fingerprints
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0015_upload_session_status"
+down_revision = "0014_audio_fingerprints"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "uploadsession", sa.Column("status", sa.String(), nullable=False, server_default="open")
+    )
+    op.add_column("uploadsession", sa.Column("response_id", sa.Integer(), nullable=True))
+    op.add_column("uploadsession", sa.Column("task_id", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("uploadsession", "task_id")
+    op.drop_column("uploadsession", "response_id")
+    op.drop_column("uploadsession", "status")
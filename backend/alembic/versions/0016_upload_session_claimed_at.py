@@ -0,0 +1,27 @@
+"""upload session finalize lease
+
+Revision ID: 0016_upload_session_claimed_at
+Revises: 0015_upload_session_status
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0016_upload_session_claimed_at"
+down_revision = "0015_upload_session_status"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "uploadsession", sa.Column("claimed_at", sa.DateTime(timezone=True), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("uploadsession", "claimed_at")
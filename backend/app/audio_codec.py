@@ -0,0 +1,423 @@
+"""Códecs de audio: copia canónica Ogg/Opus y decodificación PCM bajo demanda.
+
+Backends (`AUDIO_CODEC_BACKEND`):
+ - `pyav` (por defecto): decodificación/remuestreo/codificación en proceso con las
+   bibliotecas de libav (PyAV). Evita lanzar un proceso, inicializar códecs y pasar por
+   archivos temporales en cada clip corto.
+ - `ffmpeg`: subproceso `settings.ffmpeg_path`. Se usa también como respaldo si PyAV no
+   está instalado o falla con un archivo concreto.
+Las operaciones devuelven `ResultadoCodec` (backend, tipo de error y detalle: excepción de
+libav o stderr de ffmpeg) en lugar de tragarse los fallos; `decodificar_pcm` lanza
+`CodecError` con el resultado.
+
+Con `AUDIO_STORAGE_CODEC=opus` cada grabación sin comprimir (`AUDIO_OPUS_SOURCE_FORMATS`,
+por defecto WAV/FLAC) se recodifica a Opus mono 16 kHz con bitrate de voz
+(`AUDIO_OPUS_BITRATE`). La copia se verifica (contenedor legible y duración equivalente)
+antes de repuntar las respuestas y eliminar el upload original; si algo falla se conserva
+el original.
+"""
+from __future__ import annotations
+
+import os
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional
+
+import structlog
+
+from .audio_probe import probe_audio
+from .audio_store import clave_blob
+from .metrics import AUDIO_CODEC_OPERATIONS
+from .settings import settings
+from .storage import get_storage
+
+if TYPE_CHECKING:  # numpy se importa de forma perezosa en cada función
+    import numpy as np
+
+logger = structlog.get_logger()
+
+CANONICAL_EXT = "ogg"
+PCM_CHUNK_SEC = 5.0
+_STDERR_MAX = 2000
+
+
+@dataclass
+class ResultadoCodec:
+    ok: bool
+    backend: str
+    error: Optional[str] = None  # not_installed | invalid_data | codec | process | io
+    detail: Optional[str] = None
+    samples: int = 0  # muestras PCM producidas (decodificación)
+
+    def as_dict(self) -> dict:
+        return {"ok": self.ok, "backend": self.backend, "error": self.error, "detail": self.detail}
+
+
+class CodecError(Exception):
+    def __init__(self, resultado: ResultadoCodec):
+        super().__init__(f"{resultado.backend}: {resultado.error}: {resultado.detail}")
+        self.resultado = resultado
+
+
+def clave_canonica(sha256: str) -> str:
+    return clave_blob(sha256, CANONICAL_EXT)
+
+
+def _tmp_output(suffix: str) -> str:
+    os.makedirs(settings.storage_tmp_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=suffix, dir=settings.storage_tmp_dir)
+    os.close(fd)
+    return tmp
+
+
+def _backends() -> List[str]:
+    if settings.audio_codec_backend == "ffmpeg":
+        return ["ffmpeg"]
+    return ["pyav", "ffmpeg"]  # subproceso como respaldo
+
+
+def _resultado_error(backend: str, exc: BaseException) -> ResultadoCodec:
+    if isinstance(exc, ImportError):
+        return ResultadoCodec(False, backend, "not_installed", str(exc))
+    if isinstance(exc, CodecError):
+        return exc.resultado
+    if isinstance(exc, FileNotFoundError) and backend == "ffmpeg":
+        return ResultadoCodec(
+            False, backend, "not_installed", f"{settings.ffmpeg_path} no encontrado"
+        )
+    name = type(exc).__name__
+    if name == "InvalidDataError":
+        kind = "invalid_data"
+    elif type(exc).__module__.startswith("av"):
+        kind = "codec"
+    elif isinstance(exc, OSError):
+        kind = "io"
+    else:
+        kind = "codec"
+    return ResultadoCodec(False, backend, kind, f"{name}: {exc}")
+
+
+def _registrar(operacion: str, resultado: ResultadoCodec) -> None:
+    try:
+        AUDIO_CODEC_OPERATIONS.labels(
+            operacion, resultado.backend, "ok" if resultado.ok else resultado.error or "error"
+        ).inc()
+    except Exception:
+        pass
+    if not resultado.ok:
+        logger.warning("audio_codec_failed", operation=operacion, **resultado.as_dict())
+
+
+def _ejecutar(operacion: str, impls: dict, *args) -> ResultadoCodec:
+    """Prueba los backends en orden; devuelve el primer éxito o el último error."""
+    resultado = ResultadoCodec(False, "none", "not_installed", "sin backend disponible")
+    for backend in _backends():
+        try:
+            resultado = impls[backend](*args)
+        except Exception as exc:  # noqa: BLE001
+            resultado = _resultado_error(backend, exc)
+        _registrar(operacion, resultado)
+        if resultado.ok:
+            return resultado
+    return resultado
+
+
+# ---- PyAV (en proceso) ----
+
+def _pyav_transcodificar(
+    src_path: str,
+    dst_path: str,
+    fmt: str,
+    codec: str,
+    bit_rate: Optional[int] = None,
+    options: Optional[dict] = None,
+) -> ResultadoCodec:
+    import av  # type: ignore  # dependencia opcional
+
+    with av.open(src_path) as inp, av.open(dst_path, "w", format=fmt) as out:
+        ostream = out.add_stream(codec, rate=16000, options=options or {})
+        ostream.layout = "mono"
+        if bit_rate:
+            ostream.bit_rate = bit_rate
+        resampler = av.AudioResampler(format=ostream.format.name, layout="mono", rate=16000)
+        samples = 0
+        for frame in inp.decode(audio=0):
+            frame.pts = None
+            for rs in resampler.resample(frame):
+                samples += rs.samples
+                for packet in ostream.encode(rs):
+                    out.mux(packet)
+        for rs in resampler.resample(None):
+            samples += rs.samples
+            for packet in ostream.encode(rs):
+                out.mux(packet)
+        for packet in ostream.encode(None):
+            out.mux(packet)
+    return ResultadoCodec(True, "pyav", samples=samples)
+
+
+def _pyav_pcm(path: str, sample_rate: int, max_sec: Optional[float]) -> Iterator["np.ndarray"]:
+    import av  # type: ignore
+    import numpy as np
+
+    limit = int(max_sec * sample_rate) if max_sec else None
+    produced = 0
+    with av.open(path) as inp:
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=sample_rate)
+
+        def _frames():
+            for frame in inp.decode(audio=0):
+                frame.pts = None
+                yield from resampler.resample(frame)
+            yield from resampler.resample(None)
+
+        for rs in _frames():
+            block = rs.to_ndarray().reshape(-1).astype(np.float32, copy=False)
+            if limit is not None:
+                block = block[: max(0, limit - produced)]
+            if block.size:
+                produced += block.size
+                yield block
+            if limit is not None and produced >= limit:
+                return
+
+
+# ---- ffmpeg (subproceso) ----
+
+def _ffmpeg_run(cmd: list) -> ResultadoCodec:
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        detail = proc.stderr.decode("utf-8", "replace")[-_STDERR_MAX:]
+        return ResultadoCodec(False, "ffmpeg", "process", detail or f"código {proc.returncode}")
+    return ResultadoCodec(True, "ffmpeg")
+
+
+def _ffmpeg_opus(src_path: str, dst_path: str) -> ResultadoCodec:
+    return _ffmpeg_run([
+        settings.ffmpeg_path, '-y', '-nostdin', '-v', 'error', '-i', src_path,
+        '-ac', '1', '-ar', '16000',
+        '-c:a', 'libopus', '-b:a', settings.audio_opus_bitrate, '-application', 'voip',
+        '-f', 'ogg', dst_path,
+    ])
+
+
+def _ffmpeg_wav(src_path: str, dst_path: str) -> ResultadoCodec:
+    return _ffmpeg_run([
+        settings.ffmpeg_path, '-y', '-nostdin', '-v', 'error', '-i', src_path,
+        '-ac', '1', '-ar', '16000', '-c:a', 'pcm_s16le', '-f', 'wav', dst_path,
+    ])
+
+
+def _ffmpeg_pcm(path: str, sample_rate: int, max_sec: Optional[float]) -> Iterator["np.ndarray"]:
+    import numpy as np
+
+    cmd = [settings.ffmpeg_path, '-nostdin', '-v', 'error', '-i', path]
+    if max_sec:
+        cmd += ['-t', str(max_sec)]
+    cmd += ['-ac', '1', '-ar', str(sample_rate), '-f', 'f32le', 'pipe:1']
+    chunk_bytes = int(sample_rate * PCM_CHUNK_SEC) * 4
+    with tempfile.TemporaryFile() as err:  # stderr a archivo: sin riesgo de bloqueo del pipe
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+        try:
+            while True:
+                data = proc.stdout.read(chunk_bytes)
+                if not data:
+                    break
+                usable = len(data) - len(data) % 4
+                yield np.frombuffer(data[:usable], dtype=np.float32)
+            if proc.wait() != 0:
+                err.seek(0)
+                detail = err.read().decode("utf-8", "replace")[-_STDERR_MAX:]
+                raise CodecError(
+                    ResultadoCodec(
+                        False, "ffmpeg", "process", detail or f"código {proc.returncode}"
+                    )
+                )
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+
+
+def _parse_bitrate(value: str) -> int:
+    value = value.strip().lower()
+    if value.endswith("k"):
+        return int(float(value[:-1]) * 1000)
+    return int(value)
+
+
+def _codificar_opus(src_path: str, dst_path: str) -> ResultadoCodec:
+    """Ogg/Opus mono 16 kHz afinado para voz (`application=voip`)."""
+    return _ejecutar(
+        "encode_opus",
+        {
+            "pyav": lambda s, d: _pyav_transcodificar(
+                s,
+                d,
+                "ogg",
+                "libopus",
+                _parse_bitrate(settings.audio_opus_bitrate),
+                {"application": "voip"},
+            ),
+            "ffmpeg": _ffmpeg_opus,
+        },
+        src_path,
+        dst_path,
+    )
+
+
+def convertir_wav(src_path: str, dst_path: str) -> ResultadoCodec:
+    """WAV PCM 16 bits mono 16 kHz."""
+    return _ejecutar("encode_wav", {
+        "pyav": lambda s, d: _pyav_transcodificar(s, d, "wav", "pcm_s16le"),
+        "ffmpeg": _ffmpeg_wav,
+    }, src_path, dst_path)
+
+
+def verificar_copia(src_path: str, dst_path: str) -> bool:
+    """La copia es un Ogg legible cuya duración coincide con el original (±2%, mín. 100 ms)."""
+    copia = probe_audio(dst_path, CANONICAL_EXT)
+    if copia is None or not copia.duration_sec:
+        return False
+    original = probe_audio(src_path)
+    if original is None or not original.duration_sec:
+        return True  # sin referencia fiable: basta con que la copia sea legible
+    tolerancia = max(0.1, original.duration_sec * 0.02)
+    return abs(copia.duration_sec - original.duration_sec) <= tolerancia
+
+
+def codificar_opus_verificado(src_path: str) -> Optional[str]:
+    """Codifica a un temporal y lo devuelve solo si pasa la verificación."""
+    tmp = _tmp_output(f".{CANONICAL_EXT}")
+    try:
+        if _codificar_opus(src_path, tmp).ok and verificar_copia(src_path, tmp):
+            return tmp
+    except Exception:
+        pass
+    try:
+        os.unlink(tmp)
+    except Exception:
+        pass
+    return None
+
+
+def _repuntar_respuestas(ref: str, key: str, response_id: Optional[int]) -> bool:
+    """Apunta a `key` todas las filas que usaban `ref`.
+    True si el original quedó sin referencias."""
+    from sqlalchemy import update
+    from sqlmodel import select
+
+    from .db import session_scope
+    from .models import Response
+
+    with session_scope() as session:
+        result = session.exec(
+            update(Response)
+            .where(Response.audio_path == ref)
+            .values(audio_path=key, audio_format=CANONICAL_EXT)
+        )
+        if response_id is not None and not result.rowcount:
+            # La fila de esta tarea aún no es visible (commit pendiente): no borrar el original
+            return False
+    with session_scope() as session:
+        return (
+            session.exec(select(Response.id).where(Response.audio_path == ref).limit(1)).first()
+            is None
+        )
+
+
+def requiere_canonico(ref: Optional[str], sha256: Optional[str]) -> bool:
+    """True si `ref` es un blob sin comprimir que debe recodificarse (AUDIO_STORAGE_CODEC=opus)."""
+    if settings.audio_storage_codec != "opus" or not ref or not sha256:
+        return False
+    ext = os.path.splitext(ref)[1].lstrip(".").lower()
+    return ext in settings.audio_opus_source_formats and ref == clave_blob(sha256, ext)
+
+
+def almacenar_canonico(ref: str, sha256: Optional[str], response_id: Optional[int] = None) -> str:
+    """Garantiza la copia canónica Opus de `ref` y devuelve su clave (o `ref` si no aplica)."""
+    if not requiere_canonico(ref, sha256):
+        return ref
+    storage = get_storage()
+    key = clave_canonica(sha256)
+    try:
+        if not storage.exists(key):
+            with storage.local_path(ref) as path:
+                tmp = codificar_opus_verificado(path)
+            if tmp is None:
+                return ref
+            storage.put_file(key, tmp, move=True)
+        if _repuntar_respuestas(ref, key, response_id):
+            storage.delete(ref)
+    except Exception:
+        return ref
+    return key
+
+
+def _decodificar(
+    path: str, sample_rate: int, max_sec: Optional[float], estado: dict
+) -> Iterator["np.ndarray"]:
+    impls: dict[str, Callable[..., Iterator]] = {"pyav": _pyav_pcm, "ffmpeg": _ffmpeg_pcm}
+    resultado = ResultadoCodec(False, "none", "not_installed", "sin backend disponible")
+    for backend in _backends():
+        produced = 0
+        try:
+            for block in impls[backend](path, sample_rate, max_sec):
+                produced += block.size
+                yield block
+        except Exception as exc:  # noqa: BLE001
+            resultado = _resultado_error(backend, exc)
+            _registrar("decode", resultado)
+            if produced:
+                raise CodecError(resultado) from exc  # no se puede reintentar a mitad de stream
+            continue
+        estado["resultado"] = ResultadoCodec(True, backend, samples=produced)
+        _registrar("decode", estado["resultado"])
+        return
+    raise CodecError(resultado)
+
+
+def decodificar_pcm(
+    path: str, sample_rate: int = 16000, max_sec: Optional[float] = None
+) -> Iterator["np.ndarray"]:
+    """Itera bloques float32 mono remuestreados a `sample_rate` (sin archivos intermedios).
+    Si el backend preferido falla antes de producir muestras se intenta el siguiente;
+    si todos fallan se lanza `CodecError` con el último resultado."""
+    return _decodificar(path, sample_rate, max_sec, {})
+
+
+def decodificar_a_archivo(path: str, dest: str, sample_rate: int = 16000) -> ResultadoCodec:
+    """Decodifica a float32 crudo en `dest` (buffer compartido de `audio_pcm`)."""
+    estado: dict = {}
+    try:
+        with open(dest, "wb") as f:
+            for block in _decodificar(path, sample_rate, None, estado):
+                f.write(block.tobytes())
+    except CodecError as exc:
+        return exc.resultado
+    return estado["resultado"]
+
+
+def cargar_pcm(
+    path: str, sample_rate: int = 16000, max_sec: Optional[float] = None
+) -> "np.ndarray":
+    import numpy as np
+
+    bloques = list(decodificar_pcm(path, sample_rate, max_sec))
+    return np.concatenate(bloques) if bloques else np.zeros(0, dtype=np.float32)
+
+
+__all__ = [
+    "ResultadoCodec",
+    "CodecError",
+    "almacenar_canonico",
+    "requiere_canonico",
+    "clave_canonica",
+    "verificar_copia",
+    "convertir_wav",
+    "decodificar_pcm",
+    "decodificar_a_archivo",
+    "cargar_pcm",
+]
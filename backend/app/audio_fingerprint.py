@@ -0,0 +1,266 @@
+"""Huella acústica para detectar grabaciones casi idénticas.
+
+Además de los reenvíos byte a byte (mismo sha256), llegan clips acústicamente iguales:
+recodificados por el navegador, recortados unos milisegundos o subidos desde dos
+dispositivos. La etapa de features calcula, sobre el PCM ya decodificado, una huella
+binaria estilo Haitsma-Kalker: por frame (2048 muestras, hop 256 a 16 kHz) el signo de la
+variación temporal de la diferencia de energía entre 17 bandas log-espaciadas de
+300-2000 Hz, 16 bits por frame. Es robusta a recodificación y cambios de ganancia; el
+solape alto (hop = 1/8 de frame) la hace tolerante a recortes que no caen en un hop.
+
+Comparación: tasa de bits distintos (XOR + popcount por tabla) en el mejor alineamiento
+de ±`FINGERPRINT_MAX_OFFSET_FRAMES` (recortes del inicio); similitud = 1 - BER. El barrido
+de desplazamientos se hace primero sobre 1 de cada `PASO_GRUESO` frames y solo los mejores
+se miden completos; si ni la estimación gruesa se acerca al umbral se descarta ahí. Un clip
+de 60 s cuesta bastante menos de 1 ms por comparación (benchmark del test).
+
+Se calcula en la etapa de features (cola `features`, pool de procesos), tras un miss de la
+caché de features y sobre el PCM ya decodificado; no se calcula si el mismo sha256 ya tiene
+análisis (`buscar_derivados_previos`) ni con `ENABLE_AUDIO_FEATURES=0`.
+
+Índice: tabla `audiofingerprint` (niño, fecha). Solo se buscan los clips recientes del
+mismo niño (`FINGERPRINT_LOOKBACK_DAYS`, máx. `FINGERPRINT_MAX_CANDIDATES`) con duración
+parecida y el mismo texto adjunto; si la similitud supera `FINGERPRINT_MIN_SIMILARITY` el
+análisis y la transcripción de ese clip se reutilizan sin features, Whisper ni Grok.
+"""
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from sqlmodel import select
+
+from .audio_store import _analysis_de
+from .crypto_utils import decrypt_text
+from .models import AudioFingerprint, Response, ResponseStatus
+from .settings import settings
+
+N_FFT = 2048
+HOP = 256
+N_BANDAS = 17
+F_MIN = 300.0
+F_MAX = 2000.0
+MAX_SEC = 60.0
+# Barrido grueso de desplazamientos: 1 de cada 8 frames, y se refinan los 3 mejores
+PASO_GRUESO = 8
+REFINADOS = 3
+# Holgura de la estimación gruesa frente al umbral antes de descartar un candidato
+MARGEN_GRUESO = 0.05
+
+
+@lru_cache(maxsize=4)
+def _bordes_bandas(sr: int):
+    import numpy as np
+
+    freqs = np.geomspace(F_MIN, F_MAX, N_BANDAS + 1)
+    return np.round(freqs * N_FFT / sr).astype(int)
+
+
+@lru_cache(maxsize=1)
+def _popcount16():
+    import numpy as np
+
+    tabla = np.zeros(1 << 16, dtype=np.uint8)
+    for bit in range(16):
+        tabla += ((np.arange(1 << 16) >> bit) & 1).astype(np.uint8)
+    return tabla
+
+
+def huella(y, sr: int = 16000) -> bytes:
+    """Huella (uint16 little-endian por frame) de los primeros `MAX_SEC` segundos."""
+    import numpy as np
+
+    y = np.asarray(y[: int(MAX_SEC * sr)], dtype=np.float32)
+    if len(y) < N_FFT + HOP:
+        return b""
+    n_frames = 1 + (len(y) - N_FFT) // HOP
+    marcos = np.lib.stride_tricks.sliding_window_view(y, N_FFT)[::HOP][:n_frames]
+    espectro = np.abs(np.fft.rfft(marcos * np.hanning(N_FFT).astype(np.float32), axis=1)) ** 2
+    bordes = _bordes_bandas(sr)
+    energia = np.add.reduceat(espectro[:, bordes[0]:bordes[-1]], bordes[:-1] - bordes[0], axis=1)
+    diff = energia[:, :-1] - energia[:, 1:]  # (frames, 16)
+    bits = (diff[1:] - diff[:-1]) > 0
+    valores = (bits.astype(np.uint16) << np.arange(16, dtype=np.uint16)).sum(
+        axis=1, dtype=np.uint16
+    )
+    return valores.astype("<u2").tobytes()
+
+
+def _ber(popcount, x, y, desplazamiento: int) -> float:
+    xs = x[max(0, desplazamiento):]
+    ys = y[max(0, -desplazamiento):]
+    n = min(len(xs), len(ys))
+    return int(popcount[xs[:n] ^ ys[:n]].sum(dtype="int64")) / (16.0 * n)
+
+
+def _ber_gruesos(popcount, x, y, desplazamientos, n: int):
+    """BER estimada de todos los desplazamientos a la vez, con 1 de cada `PASO_GRUESO`
+    frames de los primeros `n` (solape común a todos)."""
+    import numpy as np
+
+    d = np.asarray(desplazamientos)
+    muestras = np.arange(0, n, PASO_GRUESO)
+    xor = x[np.maximum(d, 0)[:, None] + muestras] ^ y[np.maximum(-d, 0)[:, None] + muestras]
+    return popcount[xor].sum(axis=1, dtype=np.int64) / (16.0 * len(muestras))
+
+
+def similitud(
+    a: bytes, b: bytes, max_offset: Optional[int] = None, umbral: Optional[float] = None
+) -> float:
+    """1 - BER en el mejor desplazamiento; 0 si no hay solape suficiente (80% del menor).
+    Con `umbral`, si la estimación gruesa queda claramente por debajo se devuelve esa
+    estimación sin refinar (el candidato no puede superarlo)."""
+    import numpy as np
+
+    x = np.frombuffer(a, dtype="<u2")
+    y = np.frombuffer(b, dtype="<u2")
+    if not len(x) or not len(y):
+        return 0.0
+    max_offset = settings.fingerprint_max_offset_frames if max_offset is None else max_offset
+    minimo = max(int(0.8 * min(len(x), len(y))), 1)
+    desplazamientos = [
+        d for d in range(-max_offset, max_offset + 1)
+        if min(len(x) - max(0, d), len(y) - max(0, -d)) >= minimo
+    ]
+    if not desplazamientos:
+        return 0.0
+    popcount = _popcount16()
+    if minimo < 32 * PASO_GRUESO:  # clips muy cortos: el barrido completo ya es barato
+        return 1.0 - min(_ber(popcount, x, y, d) for d in desplazamientos)
+    gruesos = _ber_gruesos(popcount, x, y, desplazamientos, minimo)
+    orden = np.argsort(gruesos)
+    if umbral is not None and 1.0 - float(gruesos[orden[0]]) < umbral - MARGEN_GRUESO:
+        return 1.0 - float(gruesos[orden[0]])
+    return 1.0 - min(_ber(popcount, x, y, desplazamientos[i]) for i in orden[:REFINADOS])
+
+
+def hash_texto(text: Optional[str]) -> str:
+    return hashlib.sha256((text or "").strip().encode("utf-8")).hexdigest()
+
+
+def buscar_casi_duplicado(
+    session,
+    child_id: Optional[int],
+    fp: bytes,
+    duration_sec: float,
+    text_sha256: str,
+    exclude_id: Optional[int] = None,
+) -> Optional[Tuple[int, float]]:
+    """(response_id, similitud) del clip reciente del niño más parecido sobre el umbral."""
+    if child_id is None or not fp:
+        return None
+    desde = datetime.now(timezone.utc) - timedelta(days=settings.fingerprint_lookback_days)
+    tolerancia = max(0.5, 0.05 * duration_sec)
+    # Prefiltro en el índice: mismo texto y duración parecida; solo esos se comparan
+    stmt = (
+        select(AudioFingerprint)
+        .where(
+            AudioFingerprint.child_id == child_id,
+            AudioFingerprint.created_at >= desde,
+            AudioFingerprint.text_sha256 == text_sha256,
+            AudioFingerprint.duration_sec.between(
+                duration_sec - tolerancia, duration_sec + tolerancia
+            ),
+        )
+        .order_by(AudioFingerprint.created_at.desc())
+        .limit(settings.fingerprint_max_candidates)
+    )
+    mejor: Optional[Tuple[int, float]] = None
+    umbral = settings.fingerprint_min_similarity
+    for candidato in session.exec(stmt):
+        if candidato.response_id == exclude_id:
+            continue
+        valor = similitud(fp, candidato.fingerprint, umbral=umbral)
+        if valor >= umbral and (mejor is None or valor > mejor[1]):
+            mejor = (candidato.response_id, valor)
+    return mejor
+
+
+def analisis_reutilizable(session, response_id: int) -> Optional[dict]:
+    """Análisis (con transcript) de una respuesta completada, descifrando si hace falta."""
+    row = session.get(Response, response_id)
+    if row is None or row.status != ResponseStatus.COMPLETED:
+        return None
+    analysis = _analysis_de(row)
+    if not analysis:
+        return None
+    analysis = dict(analysis)
+    transcript = row.transcript
+    if transcript is None and row.transcript_enc:
+        try:
+            transcript = decrypt_text(row.transcript_enc)
+        except Exception:
+            transcript = None
+    if transcript:
+        analysis["transcript"] = transcript
+    elif analysis.get("transcript") == "<audio_pending_transcription>":
+        return None  # su transcripción aún no ha terminado: mejor analizar de nuevo
+    return analysis
+
+
+def contexto_huella(child_id, text: Optional[str], response_id: Optional[int]) -> Optional[dict]:
+    """Datos que la etapa de features necesita para buscar casi-duplicados (None = no buscar)."""
+    if not settings.fingerprint_enabled or child_id is None:
+        return None
+    try:
+        return {
+            "child_id": int(child_id),
+            "text_sha256": hash_texto(text),
+            "response_id": response_id,
+        }
+    except (TypeError, ValueError):
+        return None
+
+
+def etapa_huella(pcm, sr: int, contexto: dict) -> dict:
+    """Huella del PCM y, si hay un clip reciente casi idéntico con análisis reutilizable, su id
+    (la etapa de features se salta entonces la extracción). Serializable para Celery."""
+    from .db import session_scope
+
+    fp = huella(pcm, sr)
+    duracion = len(pcm) / float(sr)
+    etapa = {"fingerprint": fp.hex(), "near_duplicate_of": None, "near_duplicate_similarity": None}
+    if not fp:
+        return etapa
+    with session_scope() as s:
+        coincidencia = buscar_casi_duplicado(
+            s,
+            contexto["child_id"],
+            fp,
+            duracion,
+            contexto["text_sha256"],
+            exclude_id=contexto.get("response_id"),
+        )
+        if coincidencia is not None and analisis_reutilizable(s, coincidencia[0]) is not None:
+            etapa.update(
+                near_duplicate_of=coincidencia[0],
+                near_duplicate_similarity=round(coincidencia[1], 4),
+            )
+    return etapa
+
+
+def registrar(session, response_id: int, child_id: Optional[int], fp: bytes, duration_sec: float,
+              text_sha256: str) -> None:
+    if not fp or child_id is None or session.get(AudioFingerprint, response_id) is not None:
+        return
+    session.add(AudioFingerprint(
+        response_id=response_id,
+        child_id=child_id,
+        duration_sec=duration_sec,
+        text_sha256=text_sha256,
+        fingerprint=fp,
+    ))
+
+
+__all__ = [
+    "huella",
+    "similitud",
+    "hash_texto",
+    "buscar_casi_duplicado",
+    "analisis_reutilizable",
+    "contexto_huella",
+    "etapa_huella",
+    "registrar",
+]
@@ -0,0 +1,112 @@
+"""Ingesta de audio en streaming para `/api/submit-responses`.
+
+El upload se consume por bloques (sin `await upload.read()` completo):
+ - la cabecera se valida (formato por magic bytes, duración) antes de escribir nada,
+ - la escritura a disco ocurre en el threadpool (no bloquea el event loop),
+ - el hash de contenido se calcula de forma incremental,
+ - se aborta en cuanto se supera `max_audio_file_size_mb`.
+
+Tras la validación completa, el archivo se coloca en el almacén direccionado por
+contenido (`audio_store`) del backend configurado.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+
+from starlette.concurrency import run_in_threadpool
+
+from .audio_store import guardar_blob
+from .audio_utils import AudioValidationError, validar_audio, validar_cabecera_audio
+from .settings import settings
+
+CHUNK_SIZE = 1024 * 1024
+HEADER_BYTES = 64 * 1024
+
+
+@dataclass
+class AudioIngestado:
+    key: str  # clave en el backend de almacenamiento
+    size_bytes: int
+    sha256: str
+    ext: str
+    nuevo: bool = True  # False si el blob ya existía (reenvío idéntico)
+
+
+async def _leer_cabecera(upload) -> bytes:
+    """Lee hasta HEADER_BYTES (puede requerir varias lecturas en streams cortos)."""
+    header = b""
+    while len(header) < HEADER_BYTES:
+        chunk = await upload.read(HEADER_BYTES - len(header))
+        if not chunk:
+            break
+        header += chunk
+    return header
+
+
+def _descartar(fh, tmp_path: str) -> None:
+    try:
+        fh.close()
+    except Exception:
+        pass
+    try:
+        os.unlink(tmp_path)
+    except Exception:
+        pass
+
+
+async def ingerir_audio_streaming(upload, target_dir: str | None = None) -> AudioIngestado:
+    """Persiste `upload` por bloques en un temporal de `target_dir` (por defecto
+    `STORAGE_TMP_DIR`, mismo sistema de archivos que el almacén), valida el archivo
+    completo y lo mueve al almacén por hash.
+
+    Lanza AudioValidationError si la cabecera o el archivo no son válidos o se supera el
+    tamaño máximo; en ese caso no queda ningún archivo parcial en disco ni en el almacén.
+    """
+    max_size_bytes = int(settings.max_audio_file_size_mb * 1024 * 1024)
+    declared = getattr(upload, "size", None)
+    if declared is not None and declared > max_size_bytes:
+        raise AudioValidationError(
+            f"Archivo muy grande: {declared / 1024 / 1024:.1f}MB"
+            f" > {settings.max_audio_file_size_mb}MB"
+        )
+
+    header = await _leer_cabecera(upload)
+    if not header:
+        raise AudioValidationError("Archivo vacío")
+    # El formato real sale de los magic bytes; el nombre solo se usa para mensajes
+    ext = validar_cabecera_audio(header, upload.filename or "")
+
+    target_dir = target_dir or settings.storage_tmp_dir
+    os.makedirs(target_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".incoming_", suffix=f".{ext}", dir=target_dir)
+    fh = os.fdopen(fd, "wb")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        chunk = header
+        while chunk:
+            size += len(chunk)
+            if size > max_size_bytes:
+                raise AudioValidationError(
+                    f"Archivo muy grande: >{settings.max_audio_file_size_mb}MB"
+                )
+            hasher.update(chunk)
+            await run_in_threadpool(fh.write, chunk)
+            chunk = await upload.read(CHUNK_SIZE)
+        await run_in_threadpool(fh.close)
+        # Validación completa (duración que requiere índice/cola del contenedor)
+        await run_in_threadpool(validar_audio, tmp_path, size)
+        sha256 = hasher.hexdigest()
+        key, nuevo = await run_in_threadpool(guardar_blob, tmp_path, sha256, ext)
+    except BaseException:
+        _descartar(fh, tmp_path)
+        raise
+    # Si se reutilizó la copia canónica (Opus) el formato almacenado es el de la clave
+    ext = os.path.splitext(key)[1].lstrip(".") or ext
+    return AudioIngestado(key=key, size_bytes=size, sha256=sha256, ext=ext, nuevo=nuevo)
+
+
+__all__ = ["ingerir_audio_streaming", "AudioIngestado", "CHUNK_SIZE", "HEADER_BYTES"]
@@ -0,0 +1,125 @@
+"""Buffer PCM compartido: una sola decodificación por audio.
+
+`decodificar_compartido` decodifica el audio una vez a float32 mono 16 kHz en un archivo
+crudo (`<PCM_CACHE_DIR>/<sha256>.f32`, escrito por bloques por el backend de `audio_codec`,
+sin WAV intermedio). Duración, features prosódicas y transcripción lo leen como `np.memmap`
+(páginas compartidas vía caché del SO; con `PCM_CACHE_DIR=/dev/shm/...` queda en memoria
+compartida).
+
+Cada llamada devuelve una referencia propia: un enlace duro `<sha256>.<token>.f32` al buffer.
+Varias respuestas con el mismo audio comparten las páginas, y el número de enlaces hace de
+contador: `liberar_pcm` borra la referencia y, si ya no queda ninguna otra, el buffer base.
+La tarea de transcripción, que corre aparte, recibe su referencia en el payload y la libera
+al terminar.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import secrets
+import tempfile
+import time
+from typing import Optional
+
+from .settings import settings
+from .storage import get_storage
+
+SAMPLE_RATE = 16000
+
+
+def ruta_pcm(ident: str) -> str:
+    return os.path.join(settings.pcm_cache_dir, f"{ident}.f32")
+
+
+def _escribir_pcm(src_path: str, dest_tmp: str) -> None:
+    from .audio_codec import CodecError, decodificar_a_archivo
+
+    resultado = decodificar_a_archivo(src_path, dest_tmp, SAMPLE_RATE)
+    if not resultado.ok:
+        raise CodecError(resultado)
+
+
+def _enlazar(base: str, ident: str) -> str:
+    ref = os.path.join(settings.pcm_cache_dir, f"{ident}.{secrets.token_hex(8)}.f32")
+    os.link(base, ref)
+    return ref
+
+
+def decodificar_compartido(ref: str, sha256: Optional[str] = None) -> str:
+    """Devuelve una referencia propia al buffer PCM de `ref`, decodificándolo solo si aún no
+    existe. Cada referencia se libera con `liberar_pcm`."""
+    ident = sha256 or hashlib.sha1(ref.encode("utf-8")).hexdigest()
+    path = ruta_pcm(ident)
+    os.makedirs(settings.pcm_cache_dir, exist_ok=True)
+    try:
+        return _enlazar(path, ident)
+    except FileNotFoundError:
+        pass  # aún no decodificado (o liberado por su último consumidor)
+    fd, tmp = tempfile.mkstemp(prefix=f".{ident}.", suffix=".tmp", dir=settings.pcm_cache_dir)
+    os.close(fd)
+    try:
+        with get_storage().local_path(ref) as src:
+            _escribir_pcm(src, tmp)
+        propia = os.path.join(settings.pcm_cache_dir, f"{ident}.{secrets.token_hex(8)}.f32")
+        os.link(tmp, propia)
+        os.replace(tmp, path)  # visible solo completo (otras tareas pueden estar esperando)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return propia
+
+
+def abrir_pcm(path: str):
+    """Vista de solo lectura (memmap) del buffer; no copia muestras a memoria del proceso."""
+    import numpy as np
+
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r")
+
+
+def liberar_pcm(path: Optional[str]) -> None:
+    """Suelta una referencia; el buffer base se borra cuando no queda ninguna otra."""
+    if not path:
+        return
+    try:
+        os.unlink(path)
+    except Exception:
+        pass
+    ident = os.path.basename(path).split(".", 1)[0]
+    base = ruta_pcm(ident)
+    try:
+        # Solo el enlace base: nadie más lo usa. Si otra tarea enlaza justo ahora su
+        # referencia conserva los datos; la siguiente volverá a decodificar.
+        if os.stat(base).st_nlink <= 1:
+            os.unlink(base)
+    except Exception:
+        pass
+
+
+def limpiar_pcm_antiguos(max_age_hours: float = 6.0) -> int:
+    """Buffers abandonados (p.ej. transcripción que nunca llegó a ejecutarse)."""
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    try:
+        entries = list(os.scandir(settings.pcm_cache_dir))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                removed += 1
+        except Exception:
+            pass
+    return removed
+
+
+__all__ = [
+    "SAMPLE_RATE",
+    "decodificar_compartido",
+    "abrir_pcm",
+    "liberar_pcm",
+    "limpiar_pcm_antiguos",
+    "ruta_pcm",
+]
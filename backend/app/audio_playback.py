@@ -0,0 +1,219 @@
+"""Reproducción de audio con peticiones condicionales y por rangos.
+
+`respuesta_audio` resuelve la clave del almacén (o ruta legada) y construye la respuesta:
+ - `ETag` fuerte (hash de contenido para claves `audio/<sha256>.<ext>`) y `Last-Modified`;
+   `If-None-Match` / `If-Modified-Since` responden 304.
+ - `Range: bytes=...` (un solo rango) con `If-Range` -> 206 / 416.
+ - Almacén local: envío sin copia (extensión ASGI `http.response.zerocopysend`, sendfile)
+   si el servidor la ofrece; si no, lectura por bloques en el threadpool.
+ - S3: lectura en streaming de solo el rango pedido (`GetObject` con `Range`).
+En ningún caso se carga el archivo completo en memoria.
+"""
+from __future__ import annotations
+
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Mapping, Optional, Tuple
+
+import anyio
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import Response as StarletteResponse
+
+from .storage import BlobStorage, get_storage
+
+CHUNK_SIZE = 64 * 1024
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+MEDIA_TYPES = {
+    "wav": "audio/wav",
+    "ogg": "audio/ogg",
+    "webm": "audio/webm",
+    "mkv": "audio/x-matroska",
+    "mp3": "audio/mpeg",
+    "m4a": "audio/mp4",
+    "flac": "audio/flac",
+}
+
+
+class RangeNoSatisfacible(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """`bytes=a-b`, `bytes=a-` o `bytes=-n` -> (inicio, fin inclusivo).
+    None si la cabecera no aplica (otra unidad, varios rangos, sintaxis inválida):
+    se sirve completo."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first == "":
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNoSatisfacible()
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNoSatisfacible()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _etag(ref: str, size: int, mtime: float) -> str:
+    stem = os.path.splitext(os.path.basename(ref))[0]
+    if ref.startswith("audio/") and len(stem) == 64:
+        return f'"{stem}"'  # direccionado por contenido: el hash identifica los bytes
+    return f'"{size:x}-{int(mtime):x}"'
+
+
+def _not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or etag in tags
+    ims = headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class AudioRangeResponse(StarletteResponse):
+    """Cuerpo servido desde archivo local (sendfile si está disponible) o desde el almacén."""
+
+    def __init__(
+        self,
+        status_code: int,
+        headers: Mapping[str, str],
+        media_type: Optional[str] = None,
+        file_path: Optional[str] = None,
+        storage: Optional[BlobStorage] = None,
+        key: Optional[str] = None,
+        start: int = 0,
+        length: int = 0,
+        send_body: bool = True,
+    ) -> None:
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.file_path = file_path
+        self.storage = storage
+        self.key = key
+        self.start = start
+        self.length = length if send_body else 0
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send(
+            {"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers}
+        )
+        if self.length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if self.file_path is not None:
+            await self._send_file(scope, send)
+        else:
+            chunks = iterate_in_threadpool(
+                self.storage.iter_range(self.key, self.start, self.length, CHUNK_SIZE)
+            )
+            async for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_file(self, scope, send) -> None:
+        f = await anyio.to_thread.run_sync(open, self.file_path, "rb")
+        try:
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+                return
+            await anyio.to_thread.run_sync(f.seek, self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": remaining > 0}
+                )
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await anyio.to_thread.run_sync(f.close)
+
+
+def respuesta_audio(
+    request_headers: Mapping[str, str], ref: str, fmt: Optional[str] = None, method: str = "GET"
+) -> StarletteResponse:
+    """Construye la respuesta para `ref`. FileNotFoundError si el audio ya no existe."""
+    storage = get_storage()
+    file_path: Optional[str] = None
+    if os.path.isfile(ref):  # ruta legada (uploads/resp_*.wav)
+        file_path = ref
+        st = os.stat(ref)
+        size, mtime = st.st_size, st.st_mtime
+    else:
+        info = storage.stat(ref)
+        if info is None:
+            raise FileNotFoundError(ref)
+        size, mtime = info
+        file_path = storage.local_file(ref)
+    ext = (fmt or os.path.splitext(ref)[1].lstrip(".")).lower()
+    media_type = MEDIA_TYPES.get(ext, "application/octet-stream")
+    etag = _etag(ref, size, mtime)
+    last_modified = formatdate(mtime, usegmt=True)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": last_modified,
+        "cache-control": "private, max-age=0, must-revalidate",
+    }
+    if _not_modified(request_headers, etag, mtime):
+        return AudioRangeResponse(304, headers, send_body=False)
+
+    start, end = 0, size - 1
+    status_code = 200
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+        try:
+            rng = parse_range(range_header, size)
+        except RangeNoSatisfacible:
+            headers["content-range"] = f"bytes */{size}"
+            headers["content-length"] = "0"
+            return AudioRangeResponse(416, headers, send_body=False)
+        if rng is not None:
+            start, end = rng
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+    length = max(0, end - start + 1)
+    headers["content-length"] = str(length)
+    return AudioRangeResponse(
+        status_code,
+        headers,
+        media_type=media_type,
+        file_path=file_path,
+        storage=storage,
+        key=ref,
+        start=start,
+        length=length,
+        send_body=method != "HEAD",
+    )
+
+
+__all__ = ["respuesta_audio", "parse_range", "AudioRangeResponse"]
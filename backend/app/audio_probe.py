@@ -0,0 +1,502 @@
+"""Sondeo ligero de contenedores de audio (sin decodificar).
+
+Lee solo cabeceras o índices para obtener duración, sample rate y canales:
+ - WAV: chunks RIFF `fmt ` / `data`
+ - WebM/Matroska: Info/Duration + Tracks/Audio; si falta Duration (MediaRecorder)
+   se recorren solo las cabeceras de Cluster/SimpleBlock saltando los payloads
+ - Ogg (Opus/Vorbis): cabecera de identificación + granule position de la última página
+ - MP3: cabecera Xing/Info o VBRI; si no hay, recorrido de cabeceras de frame
+ - MP4/M4A: moov/mvhd + sample entry de audio en stsd
+
+`sniff_format` identifica el contenedor por magic bytes antes de persistir el upload.
+
+Con `solo_cabecera=True` (validación en la ingesta) no se usan datos que requieran el
+archivo completo; si la duración no está en la cabecera se devuelve None.
+"""
+from __future__ import annotations
+
+import io
+import os
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Optional
+
+
+@dataclass
+class AudioInfo:
+    format: str
+    duration_sec: Optional[float] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+
+
+def _read_exact(f: BinaryIO, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError
+    return data
+
+
+# ---------------- WAV ----------------
+def _probe_wav(f: BinaryIO, solo_cabecera: bool) -> Optional[AudioInfo]:
+    head = f.read(12)
+    if len(head) < 12 or head[:4] not in (b"RIFF", b"RF64") or head[8:12] != b"WAVE":
+        return None
+    info = AudioInfo("wav")
+    byte_rate = 0
+    while True:
+        ch = f.read(8)
+        if len(ch) < 8:
+            break
+        cid, size = ch[:4], struct.unpack("<I", ch[4:])[0]
+        if cid == b"fmt ":
+            fmt = f.read(min(size, 16))
+            if len(fmt) < 16:
+                break
+            _, channels, rate, byte_rate = struct.unpack("<HHII", fmt[:12])
+            info.channels, info.sample_rate = channels, rate
+            f.seek(size - 16 + (size & 1), io.SEEK_CUR)
+        elif cid == b"data":
+            if byte_rate > 0 and size not in (0, 0xFFFFFFFF):
+                info.duration_sec = size / float(byte_rate)
+            break
+        else:
+            f.seek(size + (size & 1), io.SEEK_CUR)
+    return info
+
+
+# ---------------- Matroska / WebM ----------------
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_AUDIO = 0xE1
+_SAMPLING_FREQ = 0xB5
+_CHANNELS = 0x9F
+_CLUSTER = 0x1F43B675
+_CLUSTER_TIMECODE = 0xE7
+_SIMPLE_BLOCK = 0xA3
+_BLOCK_GROUP = 0xA0
+_BLOCK = 0xA1
+_SEGMENT_CHILDREN = {
+    0x114D9B74,
+    _INFO,
+    _TRACKS,
+    _CLUSTER,
+    0x1C53BB6B,
+    0x1941A469,
+    0x1043A770,
+    0x1254C367,
+}
+_UNKNOWN = -1
+
+
+def _read_vint(f: BinaryIO, keep_marker: bool) -> int:
+    first = _read_exact(f, 1)[0]
+    mask = 0x80
+    length = 1
+    while length <= 8 and not (first & mask):
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("vint inválido")
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = (first & (mask - 1)) == (mask - 1)
+    for b in _read_exact(f, length - 1):
+        value = (value << 8) | b
+        all_ones = all_ones and b == 0xFF
+    if not keep_marker and all_ones:
+        return _UNKNOWN
+    return value
+
+
+def _read_element_header(f: BinaryIO) -> tuple[int, int]:
+    return _read_vint(f, keep_marker=True), _read_vint(f, keep_marker=False)
+
+
+def _read_uint(f: BinaryIO, size: int) -> int:
+    return int.from_bytes(_read_exact(f, size), "big") if size else 0
+
+
+def _read_float(f: BinaryIO, size: int) -> Optional[float]:
+    data = _read_exact(f, size)
+    if size == 4:
+        return struct.unpack(">f", data)[0]
+    if size == 8:
+        return struct.unpack(">d", data)[0]
+    return None
+
+
+def _iter_children(f: BinaryIO, end: Optional[int]):
+    """Itera (id, size, data_start, start) de los hijos hasta `end` (None = tamaño desconocido)."""
+    while end is None or f.tell() < end:
+        start = f.tell()
+        try:
+            eid, size = _read_element_header(f)
+        except EOFError:
+            return
+        yield eid, size, f.tell(), start
+
+
+def _probe_matroska(f: BinaryIO, solo_cabecera: bool) -> Optional[AudioInfo]:
+    try:
+        eid, size = _read_element_header(f)
+    except (EOFError, ValueError):
+        return None
+    if eid != _EBML:
+        return None
+    f.seek(size, io.SEEK_CUR)
+    info = AudioInfo("webm")
+    scale = 1_000_000
+    duration_ticks: Optional[float] = None
+    last_cluster_tc: Optional[int] = None
+    last_block_tc = 0
+    try:
+        eid, seg_size = _read_element_header(f)
+        if eid != _SEGMENT:
+            return info
+        seg_end = None if seg_size == _UNKNOWN else f.tell() + seg_size
+        pending = None
+        while True:
+            if pending is not None:
+                eid, size, data_start = pending
+                pending = None
+            else:
+                nxt = next(_iter_children(f, seg_end), None)
+                if nxt is None:
+                    break
+                eid, size, data_start, _ = nxt
+            end = None if size == _UNKNOWN else data_start + size
+            if eid == _INFO:
+                for cid, csize, _, _ in _iter_children(f, end):
+                    if cid == _TIMECODE_SCALE:
+                        scale = _read_uint(f, csize) or scale
+                    elif cid == _DURATION:
+                        duration_ticks = _read_float(f, csize)
+                    else:
+                        f.seek(csize, io.SEEK_CUR)
+            elif eid == _TRACKS:
+                _parse_tracks(f, end, info)
+            elif eid == _CLUSTER:
+                if duration_ticks is not None or solo_cabecera:
+                    break  # la duración ya es conocida (o no debe estimarse con datos parciales)
+                for cid, csize, cstart, _ in _iter_children(f, end):
+                    if end is None and cid in _SEGMENT_CHILDREN:
+                        # Cluster de tamaño desconocido: el siguiente elemento de nivel 1 lo cierra
+                        pending = (cid, csize, cstart)
+                        break
+                    if cid == _CLUSTER_TIMECODE:
+                        last_cluster_tc = _read_uint(f, csize)
+                        last_block_tc = 0
+                    elif cid in (_SIMPLE_BLOCK, _BLOCK_GROUP):
+                        last_block_tc = max(last_block_tc, _block_timecode(f, cid, csize))
+                        f.seek(cstart + csize)
+                    else:
+                        f.seek(csize, io.SEEK_CUR)
+                continue
+            if end is None:
+                break
+            f.seek(end)
+    except (EOFError, ValueError):
+        pass
+    if duration_ticks is not None:
+        info.duration_sec = duration_ticks * scale / 1e9
+    elif last_cluster_tc is not None and not solo_cabecera:
+        info.duration_sec = (last_cluster_tc + last_block_tc) * scale / 1e9
+    return info
+
+
+def _block_timecode(f: BinaryIO, eid: int, size: int) -> int:
+    """Timecode relativo (int16) de un SimpleBlock/Block, leyendo solo sus primeros bytes."""
+    if eid == _BLOCK_GROUP:
+        end = f.tell() + size
+        for cid, csize, _, _ in _iter_children(f, end):
+            if cid == _BLOCK:
+                return _block_timecode(f, _SIMPLE_BLOCK, csize)
+            f.seek(csize, io.SEEK_CUR)
+        return 0
+    _read_vint(f, keep_marker=False)  # track number
+    return struct.unpack(">h", _read_exact(f, 2))[0]
+
+
+def _parse_tracks(f: BinaryIO, end: Optional[int], info: AudioInfo) -> None:
+    for eid, size, data_start, _ in _iter_children(f, end):
+        if eid == _TRACK_ENTRY:
+            _parse_tracks(f, data_start + size, info)
+        elif eid == _AUDIO:
+            for cid, csize, _, _ in _iter_children(f, data_start + size):
+                if cid == _SAMPLING_FREQ:
+                    freq = _read_float(f, csize)
+                    info.sample_rate = int(freq) if freq else None
+                elif cid == _CHANNELS:
+                    info.channels = _read_uint(f, csize)
+                else:
+                    f.seek(csize, io.SEEK_CUR)
+            if info.sample_rate:
+                return
+        else:
+            f.seek(size, io.SEEK_CUR)
+
+
+# ---------------- Ogg ----------------
+_OGG_TAIL_BYTES = 64 * 1024
+
+
+def _probe_ogg(f: BinaryIO, solo_cabecera: bool) -> Optional[AudioInfo]:
+    page = f.read(27)
+    if len(page) < 27 or page[:4] != b"OggS":
+        return None
+    serial = page[14:18]
+    nsegs = page[26]
+    lacing = f.read(nsegs)
+    packet = f.read(sum(lacing))
+    info = AudioInfo("ogg")
+    granule_rate = None
+    pre_skip = 0
+    if packet.startswith(b"OpusHead") and len(packet) >= 16:
+        info.channels = packet[9]
+        pre_skip = struct.unpack("<H", packet[10:12])[0]
+        info.sample_rate = struct.unpack("<I", packet[12:16])[0] or 48000
+        granule_rate = 48000  # Opus siempre usa granule a 48 kHz
+    elif packet.startswith(b"\x01vorbis") and len(packet) >= 16:
+        info.channels = packet[11]
+        info.sample_rate = struct.unpack("<I", packet[12:16])[0]
+        granule_rate = info.sample_rate
+    if solo_cabecera or not granule_rate:
+        return info
+    f.seek(0, io.SEEK_END)
+    size = f.tell()
+    f.seek(max(0, size - _OGG_TAIL_BYTES))
+    tail = f.read()
+    pos = tail.rfind(b"OggS")
+    while pos >= 0:
+        if tail[pos + 14:pos + 18] == serial and pos + 14 <= len(tail):
+            granule = struct.unpack("<q", tail[pos + 6:pos + 14])[0]
+            if granule >= 0:
+                info.duration_sec = max(0.0, (granule - pre_skip) / float(granule_rate))
+                break
+        pos = tail.rfind(b"OggS", 0, pos)
+    return info
+
+
+# ---------------- MP3 ----------------
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+_MP3_MAX_SCAN_FRAMES = 200_000
+
+
+def _mp3_frame(h: bytes) -> Optional[tuple[int, int, int, int, int]]:
+    """Decodifica cabecera de frame: (version, layer, sample_rate, frame_len, samples_per_frame)."""
+    if len(h) < 4 or h[0] != 0xFF or (h[1] & 0xE0) != 0xE0:
+        return None
+    ver_bits = (h[1] >> 3) & 0x3
+    layer_bits = (h[1] >> 1) & 0x3
+    br_idx = (h[2] >> 4) & 0xF
+    sr_idx = (h[2] >> 2) & 0x3
+    padding = (h[2] >> 1) & 0x1
+    if ver_bits == 1 or layer_bits == 0 or br_idx in (0, 15) or sr_idx == 3:
+        return None
+    version = {3: 1, 2: 2, 0: 25}[ver_bits]
+    layer = 4 - layer_bits
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][br_idx] * 1000
+    rate = _MP3_RATES[version][sr_idx]
+    if layer == 1:
+        spf = 384
+        frame_len = (12 * bitrate // rate + padding) * 4
+    else:
+        spf = 1152 if (layer == 2 or version == 1) else 576
+        frame_len = (spf // 8) * bitrate // rate + padding
+    return version, layer, rate, frame_len, spf
+
+
+def _probe_mp3(f: BinaryIO, solo_cabecera: bool) -> Optional[AudioInfo]:
+    start = 0
+    head = f.read(10)
+    if head[:3] == b"ID3" and len(head) == 10:
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        start = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+    f.seek(start)
+    buf = f.read(64 * 1024)
+    offset = -1
+    for i in range(len(buf) - 4):
+        fr = _mp3_frame(buf[i:i + 4])
+        if fr and (i + fr[3] + 4 > len(buf) or _mp3_frame(buf[i + fr[3]:i + fr[3] + 4])):
+            offset = i
+            break
+    if offset < 0:
+        return None
+    version, layer, rate, frame_len, spf = _mp3_frame(buf[offset:offset + 4])  # type: ignore[misc]
+    channels = 1 if ((buf[offset + 3] >> 6) & 0x3) == 3 else 2
+    info = AudioInfo("mp3", sample_rate=rate, channels=channels)
+    frame = buf[offset:offset + frame_len]
+    # Xing/Info (VBR o CBR de LAME)
+    side = (17 if channels == 1 else 32) if version == 1 else (9 if channels == 1 else 17)
+    x = 4 + side
+    if frame[x:x + 4] in (b"Xing", b"Info") and len(frame) >= x + 12:
+        flags = struct.unpack(">I", frame[x + 4:x + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack(">I", frame[x + 8:x + 12])[0]
+            info.duration_sec = frames * spf / float(rate)
+            return info
+    # VBRI (Fraunhofer), 32 bytes tras la cabecera
+    if frame[36:40] == b"VBRI" and len(frame) >= 36 + 18:
+        frames = struct.unpack(">I", frame[36 + 14:36 + 18])[0]
+        info.duration_sec = frames * spf / float(rate)
+        return info
+    if solo_cabecera:
+        return info
+    # Recorrido de cabeceras de frame (sin decodificar): saltos de frame_len
+    pos = start + offset
+    total_samples = 0
+    count = 0
+    while count < _MP3_MAX_SCAN_FRAMES:
+        f.seek(pos)
+        fr = _mp3_frame(f.read(4))
+        if not fr:
+            break
+        total_samples += fr[4]
+        pos += fr[3]
+        count += 1
+    if count:
+        info.duration_sec = total_samples / float(rate)
+    return info
+
+
+# ---------------- MP4 / M4A ----------------
+_MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+_MP4_AUDIO_ENTRIES = {b"mp4a", b"Opus", b"alac", b"fLaC", b"ac-3", b"ec-3", b".mp3"}
+
+
+def _iter_boxes(f: BinaryIO, end: Optional[int]):
+    while end is None or f.tell() + 8 <= end:
+        start = f.tell()
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            return
+        size, btype = struct.unpack(">I", hdr[:4])[0], hdr[4:8]
+        header_len = 8
+        if size == 1:
+            size = struct.unpack(">Q", _read_exact(f, 8))[0]
+            header_len = 16
+        elif size == 0:
+            if end is None:
+                f.seek(0, io.SEEK_END)
+                end = f.tell()
+                f.seek(start + 8)
+            size = end - start
+        if size < header_len:
+            return
+        yield btype, start, start + header_len, start + size
+        f.seek(start + size)
+
+
+def _probe_mp4(f: BinaryIO, solo_cabecera: bool) -> Optional[AudioInfo]:
+    head = f.read(8)
+    if len(head) < 8 or head[4:8] != b"ftyp":
+        return None
+    f.seek(0)
+    info = AudioInfo("m4a")
+    try:
+        _walk_mp4(f, None, info)
+    except EOFError:
+        pass
+    return info
+
+
+def _walk_mp4(f: BinaryIO, end: Optional[int], info: AudioInfo) -> None:
+    for btype, start, data, box_end in _iter_boxes(f, end):
+        if btype in _MP4_CONTAINERS:
+            _walk_mp4(f, box_end, info)
+            if btype == b"moov":
+                return  # todo lo necesario está en moov; mdat se salta sin leer
+        elif btype == b"mvhd":
+            version = _read_exact(f, 4)[0]
+            if version == 1:
+                f.seek(16, io.SEEK_CUR)
+                timescale, duration = struct.unpack(">IQ", _read_exact(f, 12))
+            else:
+                f.seek(8, io.SEEK_CUR)
+                timescale, duration = struct.unpack(">II", _read_exact(f, 8))
+            if timescale:
+                info.duration_sec = duration / float(timescale)
+        elif btype == b"stsd" and info.sample_rate is None:
+            f.seek(8, io.SEEK_CUR)  # version/flags + entry_count
+            for etype, _, edata, _ in _iter_boxes(f, box_end):
+                if etype in _MP4_AUDIO_ENTRIES:
+                    f.seek(edata + 16)
+                    channels, _ = struct.unpack(">HH", _read_exact(f, 4))
+                    f.seek(4, io.SEEK_CUR)
+                    rate = struct.unpack(">I", _read_exact(f, 4))[0] >> 16
+                    info.channels, info.sample_rate = channels, rate
+                    break
+
+
+_PROBES: Dict[str, Callable[[BinaryIO, bool], Optional[AudioInfo]]] = {
+    "wav": _probe_wav,
+    "webm": _probe_matroska,
+    "mkv": _probe_matroska,
+    "ogg": _probe_ogg,
+    "opus": _probe_ogg,
+    "mp3": _probe_mp3,
+    "m4a": _probe_mp4,
+    "mp4": _probe_mp4,
+}
+
+
+def sniff_format(header: bytes) -> Optional[str]:
+    """Identifica el contenedor real por magic bytes (ignora la extensión declarada).
+    Devuelve la extensión canónica (wav, webm, mkv, ogg, mp3, m4a, flac) o None."""
+    if len(header) < 12:
+        return None
+    if header[:4] in (b"RIFF", b"RF64") and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        # DocType dentro de la cabecera EBML: "webm" o "matroska"
+        return "webm" if b"webm" in header[:64] else "mkv"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[4:8] == b"ftyp":
+        return "m4a"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[:3] == b"ID3" or _mp3_frame(header[:4]) is not None:
+        return "mp3"
+    return None
+
+
+def probe_stream(f: BinaryIO, fmt: str, solo_cabecera: bool = False) -> Optional[AudioInfo]:
+    """Sondea un stream binario posicionado al inicio. Nunca lanza: None si no se reconoce."""
+    probe = _PROBES.get(fmt)
+    if probe is None:
+        return None
+    try:
+        return probe(f, solo_cabecera)
+    except Exception:
+        return None
+
+
+def probe_audio(path: str, fmt: Optional[str] = None) -> Optional[AudioInfo]:
+    """Sondea un archivo; el formato por defecto se toma de la extensión."""
+    if not path or not os.path.isfile(path):
+        return None
+    fmt = fmt or os.path.splitext(path)[1][1:].lower()
+    with open(path, "rb") as f:
+        return probe_stream(f, fmt)
+
+
+def probe_header(header: bytes, fmt: str) -> Optional[AudioInfo]:
+    """Sondea solo los primeros bytes del upload (validación previa a persistir)."""
+    return probe_stream(io.BytesIO(header), fmt, solo_cabecera=True)
+
+
+__all__ = ["AudioInfo", "probe_audio", "probe_header", "probe_stream", "sniff_format"]
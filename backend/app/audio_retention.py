@@ -0,0 +1,181 @@
+"""Retención de audio guiada por el índice de respuestas.
+
+En lugar de recorrer `uploads/` con `listdir` + `getmtime` en cada ejecución:
+
+ - Las respuestas expiradas se seleccionan por `Response.created_at` (índice) en lotes
+   acotados; en cada lote se limpia `audio_path` y se confirma antes de borrar archivos.
+ - Un blob solo se borra cuando ninguna respuesta viva lo referencia (consulta puntual por
+   `ix_response_audio_path`) y lleva más de `AUDIO_ORPHAN_GRACE_HOURS` sin tocarse (una
+   ingesta deduplicada renueva su mtime antes de confirmar su respuesta), junto con sus
+   derivados (normalizado, comprimido) y la caché de transcripción.
+ - Los huérfanos (blobs sin fila, p.ej. ingestas abortadas) se detectan de forma
+   incremental: cada ejecución revisa `AUDIO_ORPHAN_SCAN_SHARDS` fragmentos `ab/cd` del
+   almacén a partir de un cursor persistido en `AppConfig`.
+"""
+from __future__ import annotations
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import update
+from sqlmodel import select
+
+from .audio_store import claves_derivadas
+from .db import session_scope
+from .metrics import AUDIO_RETENTION_BYTES, AUDIO_RETENTION_FILES
+from .models import AppConfig, Response
+from .settings import settings
+from .storage import get_storage
+from .transcription_cache import borrar as borrar_transcripciones
+
+ORPHAN_CURSOR_KEY = "audio_orphan_scan_cursor"
+TOTAL_SHARDS = 256 * 256
+
+
+def _registrar(stats: dict, kind: str, size: int) -> None:
+    stats["files"] += 1
+    stats["bytes"] += size
+    stats[kind] = stats.get(kind, 0) + 1
+    try:
+        AUDIO_RETENTION_FILES.labels(kind).inc()
+        AUDIO_RETENTION_BYTES.labels(kind).inc(size)
+    except Exception:
+        pass
+
+
+def _borrar(ref: str, kind: str, stats: dict) -> None:
+    """Borra una clave del almacén o una ruta legada (`uploads/resp_*.wav`)."""
+    storage = get_storage()
+    try:
+        size = storage.size(ref)
+        if size is not None:
+            if storage.delete(ref):
+                _registrar(stats, kind, size)
+        elif os.path.isfile(ref):
+            size = os.path.getsize(ref)
+            os.unlink(ref)
+            _registrar(stats, kind, size)
+    except Exception:
+        pass
+
+
+def _referenciado(session, ref: str) -> bool:
+    stmt = select(Response.id).where(Response.audio_path == ref).limit(1)
+    return session.exec(stmt).first() is not None
+
+
+def _mtime(ref: str) -> Optional[float]:
+    stat = get_storage().stat(ref)
+    if stat is not None:
+        return stat[1]
+    try:
+        return os.path.getmtime(ref)  # ruta legada
+    except OSError:
+        return None
+
+
+def _borrable(session, ref: str, mtime: Optional[float], grace_cutoff: float) -> bool:
+    """Sin referencias y fuera del periodo de gracia: el blob se guarda (o se renueva al
+    deduplicar) antes de confirmar la fila que lo referencia."""
+    if mtime is not None and mtime >= grace_cutoff:
+        return False
+    return not _referenciado(session, ref)
+
+
+def _sha_de_clave(ref: str) -> Optional[str]:
+    if not ref.startswith("audio/"):
+        return None
+    return os.path.splitext(os.path.basename(ref))[0]
+
+
+def _borrar_con_derivados(ref: str, sha256: Optional[str], kind: str, stats: dict) -> None:
+    _borrar(ref, kind, stats)
+    sha256 = sha256 or _sha_de_clave(ref)
+    for derived in claves_derivadas(ref, sha256):
+        _borrar(derived, "derived", stats)
+    borrar_transcripciones(sha256)
+
+
+def _expirar_lotes(cutoff: datetime, stats: dict) -> None:
+    batch_size = max(1, settings.audio_cleanup_batch_size)
+    for _ in range(max(1, settings.audio_cleanup_max_batches)):
+        with session_scope() as session:
+            stmt = (
+                select(Response.id, Response.audio_path, Response.audio_sha256)
+                .where(Response.audio_path.is_not(None), Response.created_at < cutoff)
+                .order_by(Response.created_at)
+                .limit(batch_size)
+            )
+            rows = list(session.exec(stmt))
+            if not rows:
+                return
+            session.exec(
+                update(Response)
+                .where(Response.id.in_([r[0] for r in rows]))
+                .values(audio_path=None)
+            )
+        stats["rows"] += len(rows)
+        # Las filas ya no apuntan al audio (commit hecho): borrar lo que quedó sin referencias
+        candidatos = {r[1]: r[2] for r in rows}
+        grace_cutoff = time.time() - settings.audio_orphan_grace_hours * 3600
+        with session_scope() as session:
+            for ref, sha256 in candidatos.items():
+                if _borrable(session, ref, _mtime(ref), grace_cutoff):
+                    _borrar_con_derivados(ref, sha256, "expired", stats)
+        if len(rows) < batch_size:
+            return
+
+
+def _leer_cursor(session) -> int:
+    row = session.exec(select(AppConfig).where(AppConfig.key == ORPHAN_CURSOR_KEY)).first()
+    try:
+        return int(row.value) % TOTAL_SHARDS if row else 0
+    except ValueError:
+        return 0
+
+
+def _guardar_cursor(session, value: int) -> None:
+    row = session.exec(select(AppConfig).where(AppConfig.key == ORPHAN_CURSOR_KEY)).first()
+    if row is None:
+        row = AppConfig(key=ORPHAN_CURSOR_KEY, value=str(value))
+    else:
+        row.value = str(value)
+        row.updated_at = datetime.now(timezone.utc)
+    session.add(row)
+
+
+def _barrer_huerfanos(stats: dict) -> None:
+    shards = max(0, min(settings.audio_orphan_scan_shards, TOTAL_SHARDS))
+    if shards == 0:
+        return
+    storage = get_storage()
+    grace_cutoff = time.time() - settings.audio_orphan_grace_hours * 3600
+    with session_scope() as session:
+        cursor = _leer_cursor(session)
+        for i in range(shards):
+            idx = (cursor + i) % TOTAL_SHARDS
+            shard = f"{idx >> 8:02x}/{idx & 0xFF:02x}"
+            try:
+                entries = list(storage.list_shard("audio", shard))
+            except Exception:
+                entries = []
+            for key, _size, mtime in entries:
+                if _borrable(session, key, mtime, grace_cutoff):
+                    _borrar_con_derivados(key, None, "orphan", stats)
+        _guardar_cursor(session, (cursor + shards) % TOTAL_SHARDS)
+
+
+def aplicar_retencion(now: Optional[datetime] = None) -> dict:
+    """Aplica la política de retención. Devuelve conteos (filas, archivos, bytes por tipo)."""
+    stats = {"rows": 0, "files": 0, "bytes": 0, "expired": 0, "derived": 0, "orphan": 0}
+    if settings.audio_cleanup_days <= 0:
+        return stats
+    now = now or datetime.now(timezone.utc)
+    _expirar_lotes(now - timedelta(days=settings.audio_cleanup_days), stats)
+    _barrer_huerfanos(stats)
+    return stats
+
+
+__all__ = ["aplicar_retencion"]
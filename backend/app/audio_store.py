@@ -0,0 +1,182 @@
+"""Almacén de audio direccionado por contenido.
+
+Cada upload se guarda una sola vez bajo la clave `audio/<sha256>.<ext>` del backend de
+almacenamiento (`storage.get_storage()`); los reenvíos idénticos (reintentos de red)
+reutilizan el mismo blob. Las referencias se consultan en las filas `Response` (índice por
+`audio_path`, ver audio_retention), así que no hay contador que mantener en paralelo.
+
+Los artefactos derivados (WAV normalizado, features, transcripción) también se indexan
+por el hash, lo que permite reutilizarlos entre respuestas que comparten audio. Son
+transformaciones puras: la clave incluye la identidad del contenido de entrada y los
+parámetros de salida (`clave_derivada`), se escriben a un temporal que se renombra al
+final y `producir_una_vez` evita que dos tareas del mismo host generen el mismo derivado
+a la vez (entre hosts el resultado es idéntico y la escritura atómica, así que repetirlo
+solo cuesta CPU).
+"""
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+from typing import Callable, Iterator, Optional, Tuple
+
+from sqlalchemy import desc
+from sqlmodel import select
+
+from .crypto_utils import decrypt_text
+from .models import Response, ResponseStatus
+from .settings import settings
+from .storage import get_storage
+
+
+def clave_blob(sha256: str, ext: str) -> str:
+    return f"audio/{sha256}.{ext}"
+
+
+def _clave_canonica_existente(sha256: str, ext: str) -> Optional[str]:
+    """Copia Opus ya verificada del mismo contenido (AUDIO_STORAGE_CODEC=opus)."""
+    if settings.audio_storage_codec != "opus" or ext not in settings.audio_opus_source_formats:
+        return None
+    key = clave_blob(sha256, "ogg")
+    return key if get_storage().exists(key) else None
+
+
+def guardar_blob(tmp_path: str, sha256: str, ext: str) -> Tuple[str, bool]:
+    """Mueve `tmp_path` al almacén. Si el blob ya existe se descarta la copia temporal y se
+    renueva su mtime: la retención no lo borra mientras la respuesta que lo va a referenciar
+    aún no está confirmada (periodo de gracia). Devuelve (clave, nuevo)."""
+    storage = get_storage()
+    key = _clave_canonica_existente(sha256, ext) or clave_blob(sha256, ext)
+    if storage.touch(key):
+        try:
+            os.unlink(tmp_path)
+        except Exception:
+            pass
+        return key, False
+    storage.put_file(key, tmp_path, move=True)
+    return key, True
+
+
+def ident_contenido(ref: str, path: str) -> str:
+    """`<sha256>.<ext>` de la entrada: el nombre del blob si viene del almacén; para rutas
+    legadas se calcula el hash del archivo."""
+    base = os.path.basename(ref)
+    stem, ext = os.path.splitext(base)
+    if ref.startswith("audio/") and len(stem) == 64:
+        return base
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return f"{h.hexdigest()}{ext.lower()}"
+
+
+def clave_derivada(tipo: str, ident: str, params: str, ext: str) -> str:
+    return f"derived/{tipo}_{ident}.{params}.{ext}"
+
+
+@contextlib.contextmanager
+def _candado(key: str) -> Iterator[None]:
+    """Exclusión entre procesos del host (flock); sin fcntl no bloquea."""
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover - no POSIX
+        yield
+        return
+    directorio = os.path.join(settings.storage_tmp_dir, "locks")
+    os.makedirs(directorio, exist_ok=True)
+    path = os.path.join(directorio, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".lock")
+    with open(path, "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def producir_una_vez(key: str, suffix: str, producir: Callable[[str], bool]) -> bool:
+    """Genera el derivado `key` con `producir(tmp)` si aún no existe. El temporal se sube
+    con `put_file(move=True)` (renombrado atómico en local) y nunca se deja a medias.
+    True si el derivado existe al terminar."""
+    storage = get_storage()
+    if storage.exists(key):
+        return True
+    with _candado(key):
+        if storage.exists(key):  # lo generó otra tarea mientras esperábamos
+            return True
+        os.makedirs(settings.storage_tmp_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=suffix, dir=settings.storage_tmp_dir)
+        os.close(fd)
+        try:
+            if not producir(tmp):
+                return False
+            storage.put_file(key, tmp, move=True)
+            return True
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.unlink(tmp)
+                except Exception:
+                    pass
+
+
+def claves_derivadas(key: str, sha256: Optional[str]) -> list[str]:
+    """Claves de derivados y caché asociadas a un blob (se eliminan junto con él)."""
+    from .audio_utils import clave_comprimida, clave_normalizada
+
+    base = os.path.basename(key)
+    stem = os.path.splitext(base)[0]
+    # Nombres anteriores (sin parámetros) para limpiar derivados ya existentes
+    keys = [f"derived/norm_{base}.wav", f"derived/{stem}_compressed.ogg"]
+    if sha256 or len(stem) == 64:
+        ident = f"{sha256 or stem}{os.path.splitext(base)[1].lower()}"
+        keys += [clave_normalizada(ident), clave_comprimida(ident)]
+    if sha256:
+        # Caché de transcripción anterior (un JSON por clave en el almacén)
+        keys.append(
+            f"transcription_cache/transcription_{sha256}_{settings.transcription_model}_{settings.transcription_language}.json"
+        )
+    return keys
+
+
+def _analysis_de(row: Response) -> Optional[dict]:
+    if row.analysis_json:
+        return row.analysis_json
+    if row.analysis_json_enc:
+        try:
+            raw = decrypt_text(row.analysis_json_enc)
+            return json.loads(raw) if raw else None
+        except Exception:
+            return None
+    return None
+
+
+def buscar_derivados_previos(session, sha256: str, exclude_id: Optional[int] = None) -> dict:
+    """Features/duración ya calculados para el mismo audio en una respuesta anterior completada."""
+    stmt = (
+        select(Response)
+        .where(Response.audio_sha256 == sha256, Response.status == ResponseStatus.COMPLETED)
+        .order_by(desc(Response.id))
+        .limit(5)
+    )
+    for row in session.exec(stmt):
+        if exclude_id is not None and row.id == exclude_id:
+            continue
+        analysis = _analysis_de(row) or {}
+        feats = analysis.get("audio_features")
+        if feats:
+            return {"audio_features": dict(feats), "audio_duration_sec": row.audio_duration_sec}
+    return {}
+
+
+__all__ = [
+    "clave_blob",
+    "guardar_blob",
+    "ident_contenido",
+    "clave_derivada",
+    "producir_una_vez",
+    "claves_derivadas",
+    "buscar_derivados_previos",
+]
@@ -0,0 +1,331 @@
+"""Ingesta de audio en directo por WebSocket (`/ws/audio`) con análisis incremental.
+
+El cliente envía PCM mono 16 kHz (`pcm_s16le` o `pcm_f32le`) mientras graba. Por cada
+bloque el servidor:
+ - guarda las muestras (WAV que se almacena como blob al cerrar);
+ - pasa el VAD causal (`audio_vad.VADIncremental`): solo la voz sigue adelante;
+ - alimenta el acumulador prosódico (`prosodic_features.AcumuladorProsodico`, ventanas de
+   `STREAM_FEATURE_WINDOW_SEC`);
+ - transcribe la voz pendiente al cerrarse una región de voz (≥ `STREAM_TRANSCRIBE_MIN_SEC`)
+   o al acumular `STREAM_TRANSCRIBE_MAX_SEC`, y confirma ese texto, solo con
+   `STREAM_TRANSCRIBE_ENABLED=1`: Whisper correría en el proceso de la API (modelo residente
+   por proceso de uvicorn, ver whisper_registry). Por defecto no se carga y la transcripción
+   la hace el worker de transcripción al cerrar;
+ - cada `STREAM_UPDATE_SEC` de audio puede pedir una emoción provisional (Grok o mock) en
+   segundo plano, solo si hay texto nuevo o pasaron `STREAM_EMOTION_INTERVAL_SEC` de reloj.
+   Con una petición en curso la actualización se descarta (no se encola) y la recepción no
+   espera a Grok: el resultado sale como `analysis_partial` (features parciales,
+   transcripción confirmada y emoción) en el siguiente bloque recibido.
+Al cerrar solo queda por procesar la última región: la fila `Response` se crea con las
+features y la transcripción del stream (`stream_audio_features` / `stream_transcript` en el
+payload), así que el análisis final no vuelve a decodificar, extraer features ni
+transcribir. Sin texto escrito, la transcripción es el texto que se analiza.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+import structlog
+
+from .settings import settings
+
+logger = structlog.get_logger()
+
+SAMPLE_RATE = 16000
+FORMATOS = {"pcm_s16le", "pcm_f32le"}
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _pool_emociones() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, settings.stream_emotion_workers),
+                                       thread_name_prefix="stream-emotion")
+        return _pool
+
+
+class StreamError(Exception):
+    """Error de protocolo o límite del stream (se envía al cliente y se cierra)."""
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def _provisional(evento: dict, texto: str) -> dict:
+    """Completa `evento` con la emoción provisional (hilo del pool; puede tardar)."""
+    from .grok_client import analyze_text as grok_analyze
+
+    analysis = grok_analyze(texto, evento["audio_features"])
+    for campo in ("primary_emotion", "intensity", "polarity", "confidence"):
+        evento[campo] = analysis.get(campo)
+    return evento
+
+
+class SesionStreaming:
+    """Estado de una grabación en curso. Síncrona: el endpoint la ejecuta en un hilo."""
+
+    def __init__(self, text: str = "", formato: str = "pcm_s16le"):
+        from .audio_vad import VADIncremental
+        from .prosodic_features import AcumuladorProsodico
+
+        if formato not in FORMATOS:
+            raise StreamError(f"formato no soportado: {formato}")
+        self.stream_id = uuid.uuid4().hex
+        self.text = text or ""
+        self.formato = formato
+        self.vad = VADIncremental(SAMPLE_RATE)
+        self.acumulador = (
+            AcumuladorProsodico(SAMPLE_RATE, settings.stream_feature_window_sec)
+            if settings.enable_prosodic_features else None
+        )
+        self.transcripcion: List[str] = []
+        self._voz_pendiente: list = []
+        self._n_voz_pendiente = 0
+        self._muestras = 0
+        self._ultima_actualizacion = 0
+        self._resto = b""
+        self._emocion: Optional[Future] = None  # una petición provisional como máximo
+        self._emocion_texto: Optional[str] = None
+        self._emocion_lanzada = 0.0
+        os.makedirs(settings.storage_tmp_dir, exist_ok=True)
+        fd, self._raw_path = tempfile.mkstemp(suffix=".pcm", dir=settings.storage_tmp_dir)
+        self._raw = os.fdopen(fd, "wb")
+
+    @property
+    def duracion_sec(self) -> float:
+        return self._muestras / float(SAMPLE_RATE)
+
+    @property
+    def transcript(self) -> str:
+        return " ".join(self.transcripcion).strip()
+
+    def _muestras_de(self, data: bytes):
+        import numpy as np
+
+        ancho = 2 if self.formato == "pcm_s16le" else 4
+        data = self._resto + data
+        usable = len(data) - len(data) % ancho
+        self._resto = data[usable:]
+        if self.formato == "pcm_s16le":
+            pcm16 = np.frombuffer(data[:usable], dtype="<i2")
+            return pcm16.astype(np.float32) / 32768.0, pcm16
+        y = np.frombuffer(data[:usable], dtype="<f4")
+        return y, (np.clip(y, -1.0, 1.0) * 32767).astype("<i2")
+
+    def recibir(self, data: bytes) -> List[dict]:
+        """Procesa un bloque de audio; devuelve los eventos a enviar al cliente."""
+        y, pcm16 = self._muestras_de(data)
+        if not len(y):
+            return []
+        self._muestras += len(y)
+        if self.duracion_sec > settings.max_audio_duration_sec:
+            raise StreamError("audio_too_long")
+        self._raw.write(pcm16.tobytes())
+        voz, region_cerrada = self.vad.procesar(y)
+        self._alimentar(voz)
+        eventos = []
+        provisional = self._recoger_emocion()
+        if provisional is not None:
+            eventos.append(provisional)
+        pendiente_sec = self._n_voz_pendiente / float(SAMPLE_RATE)
+        if settings.stream_transcribe_enabled and (
+            (region_cerrada and pendiente_sec >= settings.stream_transcribe_min_sec)
+            or pendiente_sec >= settings.stream_transcribe_max_sec
+        ):
+            texto = self._transcribir_pendiente()
+            if texto:
+                eventos.append(
+                    {
+                        "type": "transcript_partial",
+                        "stream_id": self.stream_id,
+                        "text": texto,
+                        "transcript": self.transcript,
+                        "t_sec": round(self.duracion_sec, 2),
+                    }
+                )
+        if self._muestras - self._ultima_actualizacion >= settings.stream_update_sec * SAMPLE_RATE:
+            self._ultima_actualizacion = self._muestras
+            self._lanzar_emocion()
+        return eventos
+
+    def _alimentar(self, voz: list) -> None:
+        for bloque in voz:
+            if self.acumulador is not None:
+                self.acumulador.alimentar(bloque)
+            if settings.stream_transcribe_enabled:
+                self._voz_pendiente.append(bloque)
+                self._n_voz_pendiente += len(bloque)
+
+    def _transcribir_pendiente(self) -> Optional[str]:
+        import numpy as np
+
+        from .audio_utils import transcribir_muestras
+
+        if not self._voz_pendiente:
+            return None
+        audio = np.concatenate(self._voz_pendiente)
+        self._voz_pendiente = []
+        self._n_voz_pendiente = 0
+        texto = transcribir_muestras(audio)
+        if texto:
+            self.transcripcion.append(texto)
+        return texto
+
+    def _features(self, final: bool) -> dict:
+        feats: dict = {"duration_sec": round(self.duracion_sec, 3)}
+        if settings.vad_enabled:
+            feats.update(self.vad.resultado().as_dict())
+        if self.acumulador is not None:
+            try:
+                prosodicas, serie = (
+                    self.acumulador.terminar() if final else self.acumulador.parcial()
+                )
+            except Exception:
+                prosodicas, serie = {}, []
+            feats.update(prosodicas)
+            if final and serie and settings.prosodic_series_enabled:
+                feats["prosodic_series"] = serie
+        return feats
+
+    def _lanzar_emocion(self) -> None:
+        """Pide la emoción provisional en segundo plano; se descarta si hay una en curso o si
+        no hay texto nuevo y no ha pasado `STREAM_EMOTION_INTERVAL_SEC`."""
+        if self._emocion is not None:
+            return
+        texto = self.text or self.transcript
+        ahora = time.monotonic()
+        if (
+            texto == self._emocion_texto
+            and ahora - self._emocion_lanzada < settings.stream_emotion_interval_sec
+        ):
+            return
+        self._emocion_texto, self._emocion_lanzada = texto, ahora
+        evento = {
+            "type": "analysis_partial",
+            "stream_id": self.stream_id,
+            "t_sec": round(self.duracion_sec, 2),
+            "audio_features": self._features(final=False),
+            "transcript": self.transcript,
+        }
+        self._emocion = _pool_emociones().submit(_provisional, evento, texto)
+
+    def _recoger_emocion(self) -> Optional[dict]:
+        if self._emocion is None or not self._emocion.done():
+            return None
+        futuro, self._emocion = self._emocion, None
+        try:
+            return futuro.result()
+        except Exception:
+            return None
+
+    def cerrar(self) -> dict:
+        """Procesa la última región y escribe el WAV. Devuelve features, transcripción y
+        (ruta temporal del WAV, sha256) para almacenarlo."""
+        self._emocion = None  # una emoción provisional en curso ya no se envía
+        self._alimentar(self.vad.terminar())
+        if settings.stream_transcribe_enabled:
+            self._transcribir_pendiente()
+        feats = self._features(final=True)
+        self._raw.close()
+        wav_path, sha256 = self._escribir_wav()
+        return {
+            "audio_features": feats,
+            "transcript": self.transcript,
+            "duration_sec": self.duracion_sec,
+            "wav_path": wav_path,
+            "sha256": sha256,
+        }
+
+    def _escribir_wav(self):
+        fd, wav_path = tempfile.mkstemp(suffix=".wav", dir=settings.storage_tmp_dir)
+        os.close(fd)
+        try:
+            with open(self._raw_path, "rb") as raw, wave.open(wav_path, "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(SAMPLE_RATE)
+                for chunk in iter(lambda: raw.read(1 << 20), b""):
+                    wf.writeframes(chunk)
+        finally:
+            self.descartar()
+        h = hashlib.sha256()
+        with open(wav_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return wav_path, h.hexdigest()
+
+    def descartar(self) -> None:
+        try:
+            self._raw.close()
+            os.unlink(self._raw_path)
+        except Exception:
+            pass
+
+
+def finalizar_stream(
+    sesion: SesionStreaming, child_id: Optional[str], selected_emoji: Optional[str]
+) -> dict:
+    """Cierra el stream, guarda el WAV en el almacén y crea/encola la `Response` con las
+    features y la transcripción ya calculadas."""
+    from .audio_store import guardar_blob
+    from .db import session_scope
+    from .events import publish_event
+    from .models import Response, ResponseStatus
+    from .tasks import enqueue_analysis_task
+
+    final = sesion.cerrar()
+    if not final["duration_sec"]:
+        os.unlink(final["wav_path"])
+        raise StreamError("empty_stream")
+    key, _ = guardar_blob(final["wav_path"], final["sha256"], "wav")
+    child_name = (child_id or "child").strip() or "child"
+    numeric_child_id = int(child_id) if child_id and child_id.isdigit() else None
+    with session_scope() as s:
+        row = Response(child_name=child_name, child_id=numeric_child_id, emotion="Unknown",
+                       status=ResponseStatus.QUEUED, audio_path=key, audio_format="wav",
+                       audio_sha256=final["sha256"], audio_duration_sec=final["duration_sec"])
+        s.add(row)
+        s.flush()
+        response_id = row.id
+    # Encolar tras el commit: el worker ya ve la fila
+    payload = {
+        "text": sesion.text or final["transcript"],
+        "child_id": child_id,
+        "emoji": selected_emoji,
+        "response_id": response_id,
+        "audio_path": key,
+        "audio_sha256": final["sha256"],
+        "stream_audio_features": final["audio_features"],
+    }
+    if settings.stream_transcribe_enabled:
+        payload["stream_transcript"] = final["transcript"]  # sin ella transcribe el worker
+    task_id = enqueue_analysis_task(payload)
+    with session_scope() as s:
+        row = s.get(Response, response_id)
+        if row is not None and row.task_id is None:
+            row.task_id = task_id
+    publish_event(
+        "task_queued",
+        task_id=task_id,
+        response_id=response_id,
+        status="QUEUED",
+        stream_id=sesion.stream_id,
+    )
+    logger.info("stream_finalized", stream_id=sesion.stream_id, response_id=response_id,
+                duration_sec=round(final["duration_sec"], 2))
+    return {"response_id": response_id, "task_id": task_id, "stream_id": sesion.stream_id}
+
+
+__all__ = ["SesionStreaming", "StreamError", "finalizar_stream"]
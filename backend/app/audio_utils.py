@@ -1,25 +1,26 @@
-"""Utilidades de procesamiento de audio (placeholders iniciales).
+"""Utilidades de audio: validación, duración, features y transcripción.
 
-Objetivos futuros:
- - Normalizar formatos a WAV mono 16 kHz (ffmpeg)
- - Extraer características (librosa / praat) para enriquecer `tone_features`
- - Integrar Whisper (local o API) para transcripción bajo flag ENABLE_TRANSCRIPTION
-
-Implementación actual (MVP):
- - normalizar_audio(): copiar/retornar path original (sin cambio)
- - extraer_features_audio(): retorna dict mínimo con duración si se puede inferir
+ - `validar_cabecera_audio` / `validar_audio`: magic bytes, tamaño y duración (la ingesta
+   en streaming está en `audio_ingest`).
+ - `extraer_features_pcm`: duración y features prosódicas sobre muestras ya decodificadas
+   (buffer compartido de `audio_pcm`, restringidas a las regiones de voz del VAD);
+   `extraer_features_audio` decodifica por pipe cuando no hay buffer.
+ - `transcribir_audio`: Whisper local bajo `ENABLE_TRANSCRIPTION`, con caché de
+   transcripciones (`transcription_cache`) y trozos en paralelo para grabaciones largas.
+ - Derivados WAV 16 kHz / Opus en el almacén (`normalizar_audio`, `comprimir_audio`) y
+   limpieza de archivos antiguos.
 """
 from __future__ import annotations
 
 import os
 import wave
 import contextlib
-import subprocess
-import tempfile
-import hashlib
-import json
 from typing import Optional, Dict
+from .audio_codec import _codificar_opus, convertir_wav, decodificar_pcm
+from .audio_probe import probe_audio, probe_header, sniff_format
+from .audio_store import clave_derivada, ident_contenido, producir_una_vez
 from .settings import settings
+from .storage import get_storage
 
 
 class AudioValidationError(Exception):
@@ -42,277 +43,328 @@ def validar_audio(file_path: str, file_size_bytes: int) -> None:
     if ext not in settings.allowed_audio_formats:
         raise AudioValidationError(f"Formato no permitido: {ext}. Permitidos: {', '.join(settings.allowed_audio_formats)}")
     
-    # Validar duración si es WAV
-    if ext == 'wav':
-        duration = _duracion_wav(file_path)
-        if duration and duration > settings.max_audio_duration_sec:
-            raise AudioValidationError(f"Audio muy largo: {duration:.1f}s > {settings.max_audio_duration_sec}s")
+    # Validar duración (sondeo de contenedor, sin decodificar)
+    info = probe_audio(file_path)
+    duration = info.duration_sec if info else None
+    if duration and duration > settings.max_audio_duration_sec:
+        raise AudioValidationError(
+            f"Audio muy largo: {duration:.1f}s > {settings.max_audio_duration_sec}s"
+        )
 
 
-def _get_transcription_cache_key(file_path: str, model: str, language: str) -> str:
-    """Genera clave de caché basada en hash del archivo y parámetros."""
-    with open(file_path, 'rb') as f:
-        file_hash = hashlib.md5(f.read()).hexdigest()
-    return f"transcription:{file_hash}:{model}:{language}"
+def duracion_audio(ref: str) -> Optional[float]:
+    """Duración por sondeo de cabecera/índice del contenedor (WAV, WebM, Ogg, MP3, M4A).
+    Acepta ruta local o clave del almacén."""
+    try:
+        with get_storage().local_path(ref) as path:
+            info = probe_audio(path)
+    except FileNotFoundError:
+        return None
+    if info is None or info.duration_sec is None or info.duration_sec <= 0:
+        return None
+    return info.duration_sec
 
 
-def _get_cache_file_path(cache_key: str) -> str:
-    """Retorna path del archivo de caché."""
-    cache_dir = os.path.join("uploads", ".transcription_cache")
-    os.makedirs(cache_dir, exist_ok=True)
-    safe_key = cache_key.replace(":", "_").replace("/", "_")
-    return os.path.join(cache_dir, f"{safe_key}.json")
+def validar_cabecera_audio(header: bytes, filename: str) -> str:
+    """Valida formato (por magic bytes) y duración con los primeros bytes del upload,
+    antes de persistir el cuerpo. Devuelve el formato detectado (no el declarado)."""
+    declared = os.path.splitext(filename or "")[1][1:].lower()
+    ext = sniff_format(header)
+    if ext is None:
+        raise AudioValidationError(
+            f"Contenido no reconocido como audio (extensión declarada: {declared or '-'})"
+        )
+    if ext not in settings.allowed_audio_formats:
+        raise AudioValidationError(
+            f"Formato no permitido: {ext}. Permitidos: {', '.join(settings.allowed_audio_formats)}"
+        )
+    # Solo cabecera: WAV, WebM con Duration, MP3 con Xing/VBRI o MP4 con moov al inicio
+    info = probe_header(header, ext)
+    duration = info.duration_sec if info else None
+    if duration and duration > settings.max_audio_duration_sec:
+        raise AudioValidationError(
+            f"Audio muy largo: {duration:.1f}s > {settings.max_audio_duration_sec}s"
+        )
+    return ext
 
 
-def _load_from_cache(cache_key: str) -> Optional[str]:
-    """Carga transcripción desde caché si existe y es válida."""
-    if not settings.transcription_cache_enabled:
-        return None
-    
-    cache_file = _get_cache_file_path(cache_key)
-    try:
-        if os.path.isfile(cache_file):
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get('transcript')
-    except Exception:
-        pass
-    return None
+def _get_transcription_cache_key(
+    file_path: str, model: str, language: str, content_hash: Optional[str] = None
+) -> str:
+    """Clave de caché (ver transcription_cache) por hash de contenido y parámetros.
+    Si se conoce el hash de contenido (calculado en la ingesta) no se vuelve a leer el archivo;
+    si no, se calcula por bloques sin cargarlo en memoria."""
+    from .transcription_cache import clave_transcripcion, sha256_archivo
 
+    return clave_transcripcion(content_hash or sha256_archivo(file_path), model, language)
 
-def _save_to_cache(cache_key: str, transcript: str) -> None:
-    """Guarda transcripción en caché."""
-    if not settings.transcription_cache_enabled:
-        return
-    
-    cache_file = _get_cache_file_path(cache_key)
-    try:
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump({'transcript': transcript}, f, ensure_ascii=False)
-    except Exception:
-        pass
 
+# Parámetros de salida que forman parte de la clave del derivado
+NORM_PARAMS = "16k1c_s16"
 
-def normalizar_audio(path: str, target_dir: str = "uploads") -> str:
-    """Normaliza a WAV mono 16k si ENABLE_AUDIO_NORMALIZATION está activo.
-    Devuelve path del archivo normalizado (igual al original si ya es WAV válido o si la normalización está desactivada).
-    """
-    if not os.path.isfile(path):
-        raise FileNotFoundError(path)
-    if not settings.enable_audio_normalization:
-        return path
-    os.makedirs(target_dir, exist_ok=True)
-    # Si ya es WAV 16k mono podemos reutilizarlo (heurística mínima)
-    if path.lower().endswith('.wav'):
-        try:
-            with contextlib.closing(wave.open(path, 'rb')) as wf:
-                if wf.getnchannels() == 1 and wf.getframerate() == 16000:
-                    return path
-        except Exception:
-            pass
-    out_path = os.path.join(target_dir, f"norm_{os.path.basename(path)}.wav")
-    cmd = [settings.ffmpeg_path, '-y', '-i', path, '-ac', '1', '-ar', '16000', out_path]
-    try:
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-        return out_path
-    except Exception:
-        return path  # fallback silencioso
 
+def clave_normalizada(ident: str) -> str:
+    return clave_derivada("norm", ident, NORM_PARAMS, "wav")
 
-def _duracion_wav(path: str) -> Optional[float]:
-    if not path.lower().endswith('.wav'):
-        return None
-    try:
-        with contextlib.closing(wave.open(path, 'rb')) as wf:
-            frames = wf.getnframes()
-            rate = wf.getframerate()
-            if rate > 0:
-                return frames / float(rate)
-    except Exception:
-        return None
-    return None
+
+def clave_comprimida(ident: str) -> str:
+    return clave_derivada("opus", ident, f"{settings.audio_opus_bitrate}_voip", "ogg")
+
+
+def normalizar_audio(ref: str) -> str:
+    """Normaliza a WAV mono 16k si ENABLE_AUDIO_NORMALIZATION está activo.
+    `ref` es una clave del almacén (o ruta legada). Devuelve la clave del derivado normalizado
+    (igual a `ref` si ya es WAV válido o si la normalización está desactivada).
+    Transformación pura: el derivado se identifica por (hash de la entrada, parámetros), se
+    genera una sola vez y el original nunca se modifica.
+    """
+    storage = get_storage()
+    with storage.local_path(ref) as path:  # FileNotFoundError si no existe
+        if not settings.enable_audio_normalization:
+            return ref
+        # Si ya es WAV 16k mono podemos reutilizarlo (heurística mínima)
+        if path.lower().endswith('.wav'):
+            try:
+                with contextlib.closing(wave.open(path, 'rb')) as wf:
+                    if wf.getnchannels() == 1 and wf.getframerate() == 16000:
+                        return ref
+            except Exception:
+                pass
+        out_key = clave_normalizada(ident_contenido(ref, path))
+        # error estructurado registrado en audio_codec
+        if producir_una_vez(out_key, '.wav', lambda tmp: convertir_wav(path, tmp).ok):
+            return out_key
+        return ref
 
 
-def extraer_features_audio(path: str) -> Dict:
-    """Devuelve un dict con features básicos (duración si WAV) y prosódicos si habilitado."""
+def extraer_features_audio(ref: str) -> Dict:
+    """Devuelve un dict con features básicos (duración por sondeo) y prosódicos si habilitado."""
     feats: Dict[str, float] = {}
-    dur = _duracion_wav(path)
-    if dur is not None:
-        feats["duration_sec"] = dur
-    
-    # Features prosódicas avanzadas con librosa (opcional)
-    if settings.enable_prosodic_features:
-        prosodic_feats = _extraer_features_prosodicos(path)
-        feats.update(prosodic_feats)
+    with get_storage().local_path(ref) as path:
+        info = probe_audio(path)
+        if info is not None and info.duration_sec:
+            feats["duration_sec"] = info.duration_sec
+        
+        # Features prosódicas avanzadas con librosa (opcional)
+        if settings.enable_prosodic_features:
+            prosodic_feats = _extraer_features_prosodicos(path)
+            feats.update(prosodic_feats)
     
     return feats
 
 
-def _extraer_features_prosodicos(path: str) -> Dict[str, float]:
-    """Extrae características prosódicas usando librosa."""
+def _extraer_features_prosodicos(path: str) -> Dict:
+    """Extrae características prosódicas de la grabación completa, por bloques."""
     try:
         import librosa
-        import numpy as np
     except ImportError:
         return {}
     
     try:
-        # Cargar audio (librosa normaliza automáticamente)
-        y, sr = librosa.load(path, sr=16000, duration=30.0)  # máximo 30s para eficiencia
-        
-        if len(y) == 0:
-            return {}
-        
-        # Pitch (F0) usando algoritmo piptrack
-        pitches, magnitudes = librosa.piptrack(y=y, sr=sr, threshold=0.1)
-        pitch_values = []
-        for t in range(pitches.shape[1]):
-            index = magnitudes[:, t].argmax()
-            pitch = pitches[index, t]
-            if pitch > 0:
-                pitch_values.append(pitch)
-        
-        # Energía RMS
-        rms = librosa.feature.rms(y=y)[0]
-        energy_mean = float(np.mean(rms))
-        energy_std = float(np.std(rms))
-        
-        # Spectral centroid (brillo)
-        spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-        spectral_centroid_mean = float(np.mean(spectral_centroids))
-        
-        # MFCC (características espectrales)
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        mfcc_mean = float(np.mean(mfccs))
-        mfcc_std = float(np.std(mfccs))
-        
-        # Detectar pausas (segmentos de baja energía)
-        pause_threshold = energy_mean * 0.1
-        pause_frames = np.sum(rms < pause_threshold)
-        pause_ratio = float(pause_frames / len(rms))
-        
-        features = {
-            "pitch_mean_hz": float(np.mean(pitch_values)) if pitch_values else 0.0,
-            "pitch_std_hz": float(np.std(pitch_values)) if len(pitch_values) > 1 else 0.0,
-            "energy_mean_db": energy_mean,
-            "energy_std_db": energy_std,
-            "spectral_centroid_hz": spectral_centroid_mean,
-            "mfcc_mean": mfcc_mean,
-            "mfcc_std": mfcc_std,
-            "pause_ratio": pause_ratio,
-            "pitch_range_hz": float(np.max(pitch_values) - np.min(pitch_values)) if len(pitch_values) > 1 else 0.0,
-        }
-        
-        return features
-        
+        # PCM decodificado en streaming (sin WAV temporal ni el clip entero en memoria)
+        return _features_prosodicos_stream(decodificar_pcm(path, 16000), 16000)
+    except Exception:
+        pass
+    try:
+        # librosa.load si ningún backend decodifica (solo los primeros 30 s)
+        y, sr = librosa.load(path, sr=16000, duration=30.0)
     except Exception:
         return {}
+    return _features_prosodicos(y, sr)
 
 
-def transcribir_audio(path: str) -> Optional[str]:
+def extraer_features_pcm(y, sr: int = 16000, segmentos=None) -> Dict:
+    """Features desde el buffer PCM compartido (mono float32); no vuelve a decodificar.
+    El memmap se recorre por ventanas: solo se paginan las muestras en proceso. Con
+    `segmentos` (salida de `audio_vad.detectar_voz`) las features prosódicas se calculan solo
+    sobre las regiones con voz y se añaden `speech_sec`, `speech_ratio` y `speech_segments`."""
+    feats: Dict = {"duration_sec": len(y) / float(sr)} if len(y) else {}
+    if segmentos is not None and len(y):
+        from .audio_vad import ResultadoVAD
+        feats.update(ResultadoVAD(list(segmentos), len(y), sr).as_dict())
+    if settings.enable_prosodic_features:
+        try:
+            from .prosodic_features import bloques_de
+            if segmentos is None:
+                bloques = bloques_de(y, sr, settings.prosodic_window_sec)
+            else:
+                bloques = (
+                    b
+                    for inicio, fin in segmentos
+                    for b in bloques_de(y[inicio:fin], sr, settings.prosodic_window_sec)
+                )
+            feats.update(_features_prosodicos_stream(bloques, sr))
+        except Exception:
+            pass
+    return feats
+
+
+def _features_prosodicos_stream(bloques, sr: int) -> Dict:
+    from .prosodic_features import calcular_features_stream
+
+    feats, serie = calcular_features_stream(bloques, sr, settings.prosodic_window_sec)
+    if serie and settings.prosodic_series_enabled:
+        feats["prosodic_series"] = serie
+    return feats
+
+
+def _features_prosodicos(y, sr: int) -> Dict[str, float]:
+    """Una STFT compartida para todas las features (ver prosodic_features)."""
+    try:
+        from .prosodic_features import calcular_features
+        return calcular_features(y, sr)
+    except Exception:
+        return {}
+
+
+def transcribir_audio(ref: str, content_hash: Optional[str] = None, pcm_path: Optional[str] = None,
+                      segmentos=None, al_segmento=None) -> Optional[str]:
     """Transcribe usando faster-whisper si ENABLE_TRANSCRIPTION=1 y lib disponible.
-    Incluye caché y soporte multiidioma.
+    Incluye caché (por hash de contenido si se provee) y soporte multiidioma.
+    Con `pcm_path` (buffer compartido de `audio_pcm`) whisper recibe las muestras ya
+    decodificadas en lugar de volver a decodificar el archivo; con `segmentos` (VAD) solo
+    las regiones con voz (sin voz no se transcribe). Las grabaciones largas se transcriben
+    por trozos en paralelo (ver transcription_parallel); `al_segmento` recibe cada trozo.
     Retorna transcript o None si no procede.
     """
     if not settings.enable_transcription:
         return None
     
+    if pcm_path and os.path.isfile(pcm_path):
+        from .audio_pcm import SAMPLE_RATE, abrir_pcm
+        pcm = audio = abrir_pcm(pcm_path)
+        if segmentos is not None:
+            from .audio_vad import audio_voz
+            audio = audio_voz(pcm, segmentos)
+            if len(audio) == 0:
+                return None
+        if (
+            settings.transcription_parallel_enabled
+            and len(audio) >= settings.transcription_parallel_min_sec * SAMPLE_RATE
+        ):
+            from .transcription_parallel import planificar, transcribir_paralelo
+            if segmentos is None:
+                from .audio_vad import detectar_voz
+                segmentos = detectar_voz(pcm, SAMPLE_RATE).segmentos
+            trozos = planificar(pcm, [tuple(seg) for seg in segmentos], SAMPLE_RATE)
+            if len(trozos) > 1:
+                return _transcribir_local(
+                    pcm_path,
+                    content_hash,
+                    audio=audio,
+                    transcribir=lambda: transcribir_paralelo(
+                        pcm, trozos, _whisper, SAMPLE_RATE, al_segmento
+                    ),
+                )
+        return _transcribir_local(pcm_path, content_hash, audio=audio)
+    try:
+        with get_storage().local_path(ref) as path:
+            return _transcribir_local(path, content_hash)
+    except FileNotFoundError:
+        return None
+
+
+def _transcribir_local(
+    path: str, content_hash: Optional[str], audio=None, transcribir=None
+) -> Optional[str]:
     # Verificar caché primero
-    cache_key = _get_transcription_cache_key(path, settings.transcription_model, settings.transcription_language)
-    cached = _load_from_cache(cache_key)
+    from . import transcription_cache
+
+    cache_key = _get_transcription_cache_key(
+        path, settings.transcription_model, settings.transcription_language, content_hash
+    )
+    cached = transcription_cache.obtener(cache_key)
     if cached:
         return cached
-    
+
+    transcript = (
+        transcribir() if transcribir is not None else _whisper(audio if audio is not None else path)
+    )
+    # Guardar en caché si se obtuvo resultado
+    if transcript:
+        transcription_cache.guardar(cache_key, settings.transcription_model, transcript)
+    return transcript
+
+
+def _whisper(source) -> Optional[str]:
+    """Transcribe `source` (ruta o muestras float32 16 kHz); None si whisper no está disponible."""
     try:
-        # Import perezoso
-        from faster_whisper import WhisperModel  # type: ignore
+        # Modelo residente del proceso (se carga una vez; ver whisper_registry)
+        from .whisper_registry import beam_size, obtener_modelo
+        model = obtener_modelo()
     except Exception:
         return None
     
     try:
-        model = WhisperModel(settings.transcription_model, device="cpu")
-        
         # Configurar idioma
         language = None if settings.transcription_language == "auto" else settings.transcription_language
         
-        segments, info = model.transcribe(path, beam_size=1, language=language)
+        segments, info = model.transcribe(source, beam_size=beam_size(), language=language)
         text_parts = [s.text.strip() for s in segments if getattr(s, 'text', '').strip()]
-        transcript = " ".join(text_parts).strip() or None
-        
-        # Guardar en caché si se obtuvo resultado
-        if transcript:
-            _save_to_cache(cache_key, transcript)
-        
-        return transcript
+        return " ".join(text_parts).strip() or None
     except Exception:
         return None
 
 
-def comprimir_audio(path: str) -> str:
-    """Comprime archivo de audio si está habilitado."""
+def transcribir_muestras(audio) -> Optional[str]:
+    """Transcripción de un fragmento PCM 16 kHz en memoria (streaming; sin caché)."""
+    if not settings.enable_transcription or len(audio) == 0:
+        return None
+    return _whisper(audio)
+
+
+def comprimir_audio(ref: str) -> str:
+    """Comprime a Ogg/Opus (voz) si está habilitado.
+    El resultado se guarda como derivado en el almacén, con la misma clave por (hash de la
+    entrada, bitrate) y generado una sola vez; el original no se modifica. Con
+    AUDIO_STORAGE_CODEC=opus la copia canónica ya está comprimida y no se genera derivado."""
     if not settings.enable_audio_compression:
-        return path
-    
-    # Solo comprimir si no es WAV ya comprimido
-    if path.lower().endswith('.wav'):
-        return path
-    
+        return ref
+    if settings.audio_storage_codec == "opus" and ref.lower().endswith('.ogg'):
+        return ref
+
     try:
-        compressed_path = path.rsplit('.', 1)[0] + '_compressed.wav'
-        cmd = [
-            settings.ffmpeg_path, '-y', '-i', path,
-            '-ac', '1', '-ar', '16000', '-b:a', '64k',
-            compressed_path
-        ]
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-        
-        # Si compresión exitosa y archivo es menor, reemplazar
-        if os.path.isfile(compressed_path):
-            original_size = os.path.getsize(path)
-            compressed_size = os.path.getsize(compressed_path)
-            if compressed_size < original_size * 0.8:  # al menos 20% de reducción
-                os.replace(compressed_path, path)
-                return path
-            else:
-                os.unlink(compressed_path)
-        
+        with get_storage().local_path(ref) as path:
+            out_key = clave_comprimida(ident_contenido(ref, path))
+
+            def _producir(tmp: str) -> bool:
+                # Solo compensa si reduce al menos un 20%
+                return (
+                    _codificar_opus(path, tmp).ok
+                    and os.path.getsize(tmp) < os.path.getsize(path) * 0.8
+                )
+
+            if producir_una_vez(out_key, '.ogg', _producir):
+                return out_key
     except Exception:
         pass
-    
-    return path
+    return ref
 
 
 def limpiar_archivos_antiguos() -> int:
-    """Limpia archivos de audio más antiguos que audio_cleanup_days."""
+    """Aplica la retención de audio (ver `audio_retention`). Devuelve archivos eliminados."""
     if settings.audio_cleanup_days <= 0:
         return 0
-    
-    import time
-    
-    uploads_dir = "uploads"
-    if not os.path.isdir(uploads_dir):
-        return 0
-    
-    cutoff_time = time.time() - (settings.audio_cleanup_days * 24 * 3600)
-    cleaned = 0
-    
     try:
-        for filename in os.listdir(uploads_dir):
-            filepath = os.path.join(uploads_dir, filename)
-            if os.path.isfile(filepath):
-                # Solo limpiar archivos de audio (no caché de transcripción)
-                if any(filename.lower().endswith(f'.{ext}') for ext in settings.allowed_audio_formats):
-                    if os.path.getmtime(filepath) < cutoff_time:
-                        try:
-                            os.unlink(filepath)
-                            cleaned += 1
-                        except Exception:
-                            pass
+        from .audio_retention import aplicar_retencion
+
+        return aplicar_retencion()["files"]
     except Exception:
-        pass
-    
-    return cleaned
+        return 0
 
 
-__all__ = ["normalizar_audio", "extraer_features_audio", "transcribir_audio", "validar_audio", 
-           "AudioValidationError", "comprimir_audio", "limpiar_archivos_antiguos"]
+__all__ = [
+    "normalizar_audio",
+    "clave_normalizada",
+    "clave_comprimida",
+    "extraer_features_audio",
+    "extraer_features_pcm",
+    "transcribir_audio",
+    "transcribir_muestras",
+    "validar_audio",
+    "validar_cabecera_audio",
+    "duracion_audio",
+    "AudioValidationError",
+    "comprimir_audio",
+    "limpiar_archivos_antiguos",
+]
@@ -0,0 +1,267 @@
+"""Detección de actividad de voz (VAD) por energía sobre el buffer PCM compartido.
+
+Se ejecuta una vez por respuesta sobre el PCM 16 kHz ya decodificado (`audio_pcm`) y
+devuelve los segmentos con voz. Features prosódicas y Whisper reciben solo esas regiones,
+de modo que el silencio inicial/final y las pausas largas no cuestan CPU.
+
+Algoritmo (vectorizado, memoria acotada: solo guarda un valor de energía por frame):
+ - energía RMS en dBFS por frames de `VAD_FRAME_MS`;
+ - umbral = min(suelo de ruido (percentil 10) + `VAD_MARGIN_DB`, pico - 6 dB), nunca por
+   debajo de `VAD_FLOOR_DB` (silencio digital);
+ - cada región con voz se amplía `VAD_PADDING_MS` por cada lado; huecos menores que
+   `VAD_MIN_SILENCE_MS` se unen (las pausas cortas siguen contando en `pause_ratio`) y se
+   descartan regiones de menos de `VAD_MIN_SPEECH_MS`.
+"""
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterator, List, Tuple
+
+from .settings import settings
+
+# Frames procesados por bloque al recorrer el memmap
+_FRAMES_POR_BLOQUE = 4096
+# Histograma de energía del VAD incremental: -100..+20 dBFS en pasos de 0.05 dB
+_HIST_MIN_DB = -100.0
+_HIST_PASO_DB = 0.05
+_HIST_BINS = 2400
+
+
+@dataclass
+class ResultadoVAD:
+    segmentos: List[Tuple[int, int]] = field(default_factory=list)  # [inicio, fin) en muestras
+    total_muestras: int = 0
+    sample_rate: int = 16000
+
+    @property
+    def muestras_voz(self) -> int:
+        return sum(fin - inicio for inicio, fin in self.segmentos)
+
+    def as_dict(self) -> dict:
+        total_sec = self.total_muestras / float(self.sample_rate)
+        speech_sec = self.muestras_voz / float(self.sample_rate)
+        return {
+            "speech_sec": round(speech_sec, 3),
+            "speech_ratio": round(speech_sec / total_sec, 4) if total_sec else 0.0,
+            "speech_segments": len(self.segmentos),
+        }
+
+
+def _energia_db(y, frame: int):
+    import numpy as np
+
+    n_frames = len(y) // frame
+    energia = np.empty(n_frames + (1 if len(y) % frame else 0), dtype=np.float32)
+    for inicio in range(0, n_frames, _FRAMES_POR_BLOQUE):
+        fin = min(n_frames, inicio + _FRAMES_POR_BLOQUE)
+        bloque = np.asarray(y[inicio * frame:fin * frame], dtype=np.float32).reshape(-1, frame)
+        energia[inicio:fin] = np.mean(np.square(bloque), axis=1)
+    if len(energia) > n_frames:
+        energia[-1] = np.mean(np.square(np.asarray(y[n_frames * frame:], dtype=np.float32)))
+    return 10.0 * np.log10(np.maximum(energia, 1e-10))
+
+
+def detectar_voz(y, sr: int = 16000) -> ResultadoVAD:
+    """Segmentos con voz de `y` (array o memmap mono float32)."""
+    import numpy as np
+
+    resultado = ResultadoVAD(total_muestras=len(y), sample_rate=sr)
+    frame = max(1, int(sr * settings.vad_frame_ms / 1000))
+    if len(y) == 0:
+        return resultado
+    db = _energia_db(y, frame)
+    ruido = float(np.percentile(db, 10))
+    umbral = max(min(ruido + settings.vad_margin_db, float(db.max()) - 6.0), settings.vad_floor_db)
+    voz = db >= umbral
+    if not voz.any():
+        return resultado
+
+    # Bordes de las regiones con voz (en frames)
+    cambios = np.flatnonzero(np.diff(np.concatenate(([0], voz.view(np.int8), [0]))))
+    regiones = cambios.reshape(-1, 2)
+    pad = int(round(settings.vad_padding_ms / settings.vad_frame_ms))
+    min_hueco = int(round(settings.vad_min_silence_ms / settings.vad_frame_ms))
+    min_voz = int(round(settings.vad_min_speech_ms / settings.vad_frame_ms))
+    segmentos: List[List[int]] = []
+    for inicio, fin in regiones:
+        inicio, fin = max(0, int(inicio) - pad), min(len(db), int(fin) + pad)
+        if segmentos and inicio - segmentos[-1][1] < min_hueco:
+            segmentos[-1][1] = max(segmentos[-1][1], fin)
+        else:
+            segmentos.append([inicio, fin])
+    resultado.segmentos = [
+        (inicio * frame, min(len(y), fin * frame))
+        for inicio, fin in segmentos
+        if fin - inicio >= min_voz
+    ]
+    return resultado
+
+
+class VADIncremental:
+    """Versión causal de `detectar_voz` para audio que llega en directo (`audio_stream`).
+
+    Decide por frames de `VAD_FRAME_MS` con el mismo umbral, calculado sobre la energía vista
+    hasta cada bloque. La voz se emite con `VAD_PADDING_MS` de margen previo; el silencio que
+    sigue a la voz se retiene hasta saber si es una pausa corta (se emite y la región sigue,
+    como la unión de huecos de `detectar_voz`) o el final de la región (se emite solo el
+    margen). La energía vista se acumula en un histograma de tamaño fijo (percentil con
+    resolución de 0.05 dB): memoria y coste por bloque constantes aunque el stream sea largo.
+    """
+
+    def __init__(self, sr: int = 16000):
+        import numpy as np
+
+        self.sr = sr
+        self.frame = max(1, int(sr * settings.vad_frame_ms / 1000))
+        self._pad = int(round(settings.vad_padding_ms / settings.vad_frame_ms))
+        self._max_retenidos = (
+            int(round(settings.vad_min_silence_ms / settings.vad_frame_ms)) + 2 * self._pad
+        )
+        self._resto = np.zeros(0, dtype=np.float32)
+        self._hist = np.zeros(_HIST_BINS, dtype=np.int64)
+        self._pico = float("-inf")
+        self._n_frames = 0
+        self._previos: deque = deque(maxlen=max(1, self._pad))  # (índice, muestras) antes de la voz
+        self._retenidos: List[Tuple[int, "np.ndarray"]] = []  # silencio tras la voz
+        self._en_region = False
+        self.total_muestras = 0
+        self.segmentos: List[List[int]] = []
+
+    def _acumular(self, db) -> None:
+        import numpy as np
+
+        idx = np.clip(((db - _HIST_MIN_DB) / _HIST_PASO_DB).astype(np.int64), 0, _HIST_BINS - 1)
+        self._hist += np.bincount(idx, minlength=_HIST_BINS)
+        self._pico = max(self._pico, float(db.max()))
+
+    def _umbral(self) -> float:
+        import numpy as np
+
+        # Percentil 10 (mismo rango que np.percentile) sobre el histograma acumulado
+        acumulado = np.cumsum(self._hist)
+        rango = int(0.1 * (int(acumulado[-1]) - 1))
+        ruido = (
+            _HIST_MIN_DB
+            + (int(np.searchsorted(acumulado, rango, side="right")) + 0.5) * _HIST_PASO_DB
+        )
+        pico = self._pico
+        if pico - ruido < 6.0:
+            # Aún sin contraste (p.ej. solo ruido de fondo al empezar): nada cuenta como voz
+            return float("inf")
+        return max(min(ruido + settings.vad_margin_db, pico - 6.0), settings.vad_floor_db)
+
+    def _emitir(self, salida: list, idx: int, muestras) -> None:
+        inicio = idx * self.frame
+        fin = inicio + len(muestras)
+        if self.segmentos and self.segmentos[-1][1] == inicio:
+            self.segmentos[-1][1] = fin
+        else:
+            self.segmentos.append([inicio, fin])
+        salida.append(muestras)
+
+    def _cerrar_region(self, salida: list) -> None:
+        for idx, muestras in self._retenidos[: self._pad]:
+            self._emitir(salida, idx, muestras)
+        self._previos.clear()
+        if self._pad:
+            self._previos.extend(self._retenidos[-self._pad:])
+        self._retenidos = []
+        self._en_region = False
+
+    def _frames(self, frames, umbral: float, salida: list) -> bool:
+        cerrada = False
+        for muestras in frames:
+            idx = self._n_frames
+            self._n_frames += 1
+            energia = float(self._db_frame(muestras))
+            if energia >= umbral:
+                if not self._en_region:
+                    for previo in self._previos:
+                        self._emitir(salida, *previo)
+                    self._previos.clear()
+                    self._en_region = True
+                for retenido in self._retenidos:
+                    self._emitir(salida, *retenido)
+                self._retenidos = []
+                self._emitir(salida, idx, muestras)
+            elif self._en_region:
+                self._retenidos.append((idx, muestras))
+                if len(self._retenidos) >= self._max_retenidos:
+                    self._cerrar_region(salida)
+                    cerrada = True
+            elif self._pad:
+                self._previos.append((idx, muestras))
+        return cerrada
+
+    @staticmethod
+    def _db_frame(muestras):
+        import numpy as np
+
+        return 10.0 * np.log10(max(float(np.mean(np.square(muestras))), 1e-10))
+
+    def procesar(self, bloque) -> Tuple[list, bool]:
+        """(bloques con voz listos para features/transcripción, ¿se cerró una región?)."""
+        import numpy as np
+
+        bloque = np.asarray(bloque, dtype=np.float32)
+        self.total_muestras += len(bloque)
+        datos = np.concatenate([self._resto, bloque]) if len(self._resto) else bloque
+        n = len(datos) // self.frame
+        self._resto = datos[n * self.frame:].copy()
+        if not n:
+            return [], False
+        frames = datos[: n * self.frame].reshape(n, self.frame)
+        self._acumular(_energia_db(frames.reshape(-1), self.frame))
+        salida: list = []
+        cerrada = self._frames(frames, self._umbral(), salida)
+        return salida, cerrada
+
+    def terminar(self) -> list:
+        """Último frame incompleto y margen final de la región abierta."""
+        salida: list = []
+        if len(self._resto):
+            self._acumular(_energia_db(self._resto, len(self._resto)))
+            self._frames([self._resto], self._umbral(), salida)
+            self._resto = self._resto[:0]
+        if self._en_region:
+            self._cerrar_region(salida)
+        return salida
+
+    @property
+    def en_voz(self) -> bool:
+        return self._en_region
+
+    def resultado(self) -> ResultadoVAD:
+        min_voz = int(self.sr * settings.vad_min_speech_ms / 1000)
+        segmentos = [(a, b) for a, b in self.segmentos if b - a >= min_voz]
+        return ResultadoVAD(segmentos, self.total_muestras, self.sr)
+
+
+def firma() -> str:
+    """Parámetros que cambian los segmentos; forma parte de las claves de caché de features
+    y transcripción (ambas se calculan solo sobre la voz)."""
+    if not settings.vad_enabled:
+        return "vad0"
+    return (
+        f"vad{settings.vad_frame_ms}_{settings.vad_margin_db:g}_{settings.vad_floor_db:g}_"
+        f"{settings.vad_padding_ms}_{settings.vad_min_silence_ms}_{settings.vad_min_speech_ms}"
+    )
+
+
+def regiones_voz(y, segmentos: List[Tuple[int, int]]) -> Iterator:
+    """Vistas (sin copia en memmap) de las regiones con voz."""
+    for inicio, fin in segmentos:
+        yield y[inicio:fin]
+
+
+def audio_voz(y, segmentos: List[Tuple[int, int]]):
+    """Muestras con voz concatenadas (entrada de Whisper)."""
+    import numpy as np
+
+    if not segmentos:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate([np.asarray(r, dtype=np.float32) for r in regiones_voz(y, segmentos)])
+
+
+__all__ = ["ResultadoVAD", "VADIncremental", "detectar_voz", "firma", "regiones_voz", "audio_voz"]
@@ -34,7 +34,12 @@ celery_app.conf.update(
     # Definir rutas de cola para separar transcripción de análisis regular
     task_routes={
         'transcribe.audio': {'queue': 'transcription'},
+        'transcribe.audio_batch': {'queue': 'transcription'},
         'analyze.text': {'queue': 'analysis'},
+        # CPU (librosa): workers de procesos separados de los de análisis (I/O con Grok)
+        'features.extract': {'queue': 'features'},
+        'features.extract_batch': {'queue': 'features'},
+        'audio.canonical': {'queue': 'features'},
     },
 )
 
@@ -42,3 +47,17 @@ try:  # Registrar tareas
     import backend.app.tasks  # noqa: F401
 except Exception:
     pass
+
+
+from celery.signals import worker_process_init  # noqa: E402
+
+
+@worker_process_init.connect
+def _precargar_whisper(**_kwargs):
+    # Cada proceso del pool prefork carga Whisper una vez (ver whisper_registry)
+    try:
+        from backend.app.whisper_registry import precargar
+
+        precargar()
+    except Exception:
+        pass
@@ -91,6 +91,7 @@ def _ensure_sqlite_columns() -> None:
             ("audio_format", "TEXT"),
             ("audio_duration_sec", "REAL"),
             ("transcript", "TEXT"),
+            ("audio_sha256", "TEXT"),
         ]
         for col_name, col_type in audio_columns:
             if col_name not in cols:
@@ -115,6 +116,10 @@ def _ensure_sqlite_columns() -> None:
         try:
             with engine.begin() as conn:
                 conn.execute(text("CREATE INDEX IF NOT EXISTS ix_response_audio_path ON response(audio_path)"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_response_audio_sha256 "
+                    "ON response(audio_sha256)"
+                ))
         except Exception:
             pass
         # Create child table if not exists (simple check)
@@ -192,6 +197,23 @@ def _ensure_sqlite_columns() -> None:
                     UNIQUE(parent_id, child_id)
                 )
                 """))
+        # Upload sessions: estado de finalización y concesión (migraciones 0015-0016)
+        if "uploadsession" in insp.get_table_names():
+            upload_cols = {c["name"] for c in insp.get_columns("uploadsession")}
+            for col_name, col_type in [
+                ("status", "TEXT NOT NULL DEFAULT 'open'"),
+                ("response_id", "INTEGER"),
+                ("task_id", "TEXT"),
+                ("claimed_at", "DATETIME"),
+            ]:
+                if col_name not in upload_cols:
+                    try:
+                        with engine.begin() as conn:
+                            conn.execute(
+                                text(f"ALTER TABLE uploadsession ADD COLUMN {col_name} {col_type}")
+                            )
+                    except Exception:
+                        pass
     except Exception:
         # Best-effort; ignore if not applicable
         pass
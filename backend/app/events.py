@@ -9,7 +9,7 @@ en el futuro (persistencia de cola, reintentos, métricas).
 from __future__ import annotations
 
 import json
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 
 import redis
 
@@ -41,4 +41,20 @@ def publish_event(event_type: str, **fields: Any) -> None:
     except Exception:
         pass
 
-__all__ = ["publish_event", "CHANNEL"]
+
+def publish_events(events: List[Tuple[str, Dict[str, Any]]]) -> None:
+    """Publica varios eventos con un solo viaje a Redis (pipeline)."""
+    client = _get_client()
+    if client is None or not events:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for event_type, fields in events:
+            payload: Dict[str, Any] = {"type": event_type}
+            payload.update(fields)
+            pipe.publish(CHANNEL, json.dumps(payload))
+        pipe.execute()
+    except Exception:
+        pass
+
+__all__ = ["publish_event", "publish_events", "CHANNEL"]
@@ -0,0 +1,222 @@
+"""Lotes de clips cortos para la etapa de features.
+
+En una sesión de aula llegan decenas de clips de pocos segundos casi a la vez. En lugar de
+una tarea `features.extract` por clip, los clips de hasta `FEATURES_BATCH_MAX_SEC` se
+acumulan en Redis durante `FEATURES_BATCH_WINDOW_MS` y una única tarea
+`features.extract_batch` los procesa juntos con `prosodic_features.calcular_features_lote`
+(cubetas por longitud). Cada resultado vuelve a su análisis por una lista propia.
+
+Protocolo (Redis):
+ - el análisis añade `{id, audio_path, audio_sha256}` a `emotrack:features:lote`;
+ - si consigue la marca `...:lider` (SET NX con caducidad) programa la tarea de lote con
+   `countdown` = ventana; los demás solo encolan;
+ - la tarea borra la marca *antes* de vaciar la lista (un clip que llegue después
+   programa otro lote) y publica cada resultado en `...:res:<id>` (con caducidad);
+ - el análisis espera con BLPOP hasta `FEATURES_TASK_TIMEOUT_SEC`.
+Sin Redis, `solicitar` devuelve None y el análisis usa la tarea por clip.
+"""
+from __future__ import annotations
+
+import json
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+import structlog
+
+from .settings import settings
+
+logger = structlog.get_logger()
+
+LISTA = "emotrack:features:lote"
+LIDER = "emotrack:features:lote:lider"
+RESULTADO = "emotrack:features:lote:res:{}"
+
+_redis_client = None
+
+
+def _get_client():  # lazy init
+    global _redis_client
+    if _redis_client is not None:
+        return _redis_client
+    try:
+        import redis
+
+        _redis_client = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+    except Exception:
+        _redis_client = None
+    return _redis_client
+
+
+def admite_lote(duracion_sec: Optional[float]) -> bool:
+    """Solo clips cortos y con features prosódicas (lo que de verdad cuesta CPU)."""
+    return (
+        settings.features_batch_enabled
+        and settings.enable_prosodic_features
+        and duracion_sec is not None
+        and duracion_sec <= settings.features_batch_max_sec
+    )
+
+
+def _vacio() -> dict:
+    return {"features": {}, "pcm_path": None, "vad_segments": None}
+
+
+def solicitar(audio_path: str, audio_sha256: Optional[str], programar: Callable[[float], None],
+              huella_ctx: Optional[dict] = None) -> Optional[dict]:
+    """Encola el clip en el lote en curso y espera su resultado.
+    `programar(countdown_sec)` lanza la tarea de lote. None si Redis no está disponible."""
+    client = _get_client()
+    if client is None:
+        return None
+    ident = uuid.uuid4().hex
+    ventana = settings.features_batch_window_ms / 1000.0
+    try:
+        client.rpush(
+            LISTA,
+            json.dumps(
+                {
+                    "id": ident,
+                    "audio_path": audio_path,
+                    "audio_sha256": audio_sha256,
+                    "huella": huella_ctx,
+                }
+            ),
+        )
+        if client.set(LIDER, ident, nx=True, px=int(settings.features_batch_window_ms * 4)):
+            programar(ventana)
+    except Exception:
+        return None
+    try:
+        respuesta = client.blpop(
+            RESULTADO.format(ident), timeout=settings.features_task_timeout_sec
+        )
+    except Exception:
+        respuesta = None
+    if respuesta is None:
+        logger.warning("features_batch_timeout", audio_path=audio_path)
+        return _vacio()
+    return json.loads(respuesta[1])
+
+
+def preparar_clip(audio_path: str, audio_sha256: Optional[str],
+                  huella_ctx: Optional[dict] = None) -> Tuple[dict, Optional[object]]:
+    """Etapa de features de un clip hasta las prosódicas: caché, decodificación al buffer PCM
+    compartido, huella (con `huella_ctx`, tras un miss de caché) y VAD. Devuelve
+    `(resultado, pcm)`; con `pcm` None el resultado ya está completo (caché o casi-duplicado),
+    si no faltan las prosódicas y `completar_clip`. La usan la tarea por clip y el lote."""
+    from .audio_fingerprint import etapa_huella
+    from .audio_pcm import SAMPLE_RATE, abrir_pcm, decodificar_compartido, liberar_pcm
+    from .audio_vad import ResultadoVAD, detectar_voz
+    from .feature_cache import obtener_features
+
+    cacheado = obtener_features(audio_sha256, SAMPLE_RATE)
+    if cacheado is not None:
+        return {"features": cacheado, "pcm_path": None, "vad_segments": None}, None
+    pcm_path = decodificar_compartido(audio_path, audio_sha256)
+    try:
+        pcm = abrir_pcm(pcm_path)
+        feats = {"duration_sec": len(pcm) / float(SAMPLE_RATE)} if len(pcm) else {}
+        por_huella = {}
+        if huella_ctx is not None:
+            try:
+                por_huella = etapa_huella(pcm, SAMPLE_RATE, huella_ctx)
+            except Exception:
+                por_huella = {}
+            if por_huella.get("near_duplicate_of") is not None:
+                return {
+                    "features": feats,
+                    "pcm_path": pcm_path,
+                    "vad_segments": None,
+                    **por_huella,
+                }, None
+        # VAD una sola vez: sus segmentos los usan features y transcripción
+        segmentos = None
+        if settings.vad_enabled:
+            segmentos = [list(seg) for seg in detectar_voz(pcm, SAMPLE_RATE).segmentos]
+            if len(pcm):
+                feats.update(
+                    ResultadoVAD([tuple(s) for s in segmentos], len(pcm), SAMPLE_RATE).as_dict()
+                )
+        return {
+            "features": feats,
+            "pcm_path": pcm_path,
+            "vad_segments": segmentos,
+            **por_huella,
+        }, pcm
+    except Exception:
+        liberar_pcm(pcm_path)
+        raise
+
+
+def completar_clip(resultado: dict, audio_sha256: Optional[str], prosodicas: dict) -> dict:
+    """Añade las features prosódicas al resultado de `preparar_clip` y lo guarda en caché."""
+    from .audio_pcm import SAMPLE_RATE
+    from .feature_cache import guardar_features
+
+    resultado["features"].update(prosodicas)
+    guardar_features(audio_sha256, SAMPLE_RATE, resultado["features"])
+    return resultado
+
+
+def extraer_lote(items: List[dict]) -> List[dict]:
+    """Misma salida que `tasks._extraer_features` por clip (ver `preparar_clip`), con las
+    features prosódicas calculadas en lote sobre la voz de cada clip; lo que falle por clip
+    se devuelve vacío sin afectar al resto."""
+    from .audio_pcm import SAMPLE_RATE
+    from .audio_vad import audio_voz
+    from .prosodic_features import calcular_features_lote
+
+    resultados: List[Optional[dict]] = [None] * len(items)
+    pendientes, clips = [], []
+    for i, item in enumerate(items):
+        try:
+            resultados[i], pcm = preparar_clip(
+                item["audio_path"], item.get("audio_sha256"), item.get("huella")
+            )
+            if pcm is not None:
+                segmentos = resultados[i]["vad_segments"]
+                clips.append(pcm if segmentos is None else audio_voz(pcm, segmentos))
+                pendientes.append(i)
+        except Exception:
+            resultados[i] = _vacio()
+    if clips:
+        try:
+            lote = calcular_features_lote(clips, SAMPLE_RATE, settings.prosodic_window_sec)
+        except Exception:
+            lote = [({}, [])] * len(clips)
+        for i, (prosodicas, serie) in zip(pendientes, lote):
+            prosodicas = dict(prosodicas)
+            if serie and settings.prosodic_series_enabled:
+                prosodicas["prosodic_series"] = serie
+            completar_clip(resultados[i], items[i].get("audio_sha256"), prosodicas)
+    return resultados  # type: ignore[return-value]
+
+
+def procesar_lote() -> int:
+    """Vacía la lista de clips pendientes en lotes de `FEATURES_BATCH_SIZE`."""
+    client = _get_client()
+    if client is None:
+        return 0
+    client.delete(LIDER)
+    procesados = 0
+    while True:
+        crudos = client.lpop(LISTA, settings.features_batch_size)
+        if not crudos:
+            break
+        items = [json.loads(c) for c in crudos]
+        for item, resultado in zip(items, extraer_lote(items)):
+            clave = RESULTADO.format(item["id"])
+            client.rpush(clave, json.dumps(resultado))
+            client.expire(clave, settings.features_task_timeout_sec * 2)
+        procesados += len(items)
+    return procesados
+
+
+__all__ = [
+    "admite_lote",
+    "solicitar",
+    "preparar_clip",
+    "completar_clip",
+    "extraer_lote",
+    "procesar_lote",
+]
@@ -0,0 +1,197 @@
+"""Caché de features de audio ya extraídas.
+
+Reanálisis del mismo audio (reintentos, reprocesado histórico tras cambiar reglas,
+duplicados) no vuelven a decodificar ni a pasar por librosa. La clave combina el hash de
+contenido, el sample rate y la versión del extractor (`version_extractor`: versión del
+código + parámetros que cambian el resultado), así que un cambio de configuración o de
+algoritmo invalida las entradas sin borrarlas: envejecen y las expulsa el LRU.
+
+Backends (`FEATURE_CACHE_BACKEND`):
+ - `disk` (por defecto): un JSON por entrada en `FEATURE_CACHE_DIR`; el mtime hace de
+   marca LRU (se toca en cada hit).
+ - `redis`: valores en `emotrack:features:<clave>` y un sorted set con el último acceso.
+ - `off`: sin caché.
+Ambos limitan el número de entradas (`FEATURE_CACHE_MAX_ENTRIES`). Cualquier fallo del
+backend se trata como miss: la caché nunca rompe el análisis.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+from .metrics import FEATURE_CACHE_EVICTIONS, FEATURE_CACHE_REQUESTS
+from .settings import settings
+
+REDIS_PREFIX = "emotrack:features:"
+REDIS_LRU = "emotrack:features:lru"
+
+
+def version_extractor() -> str:
+    from .audio_vad import firma as firma_vad
+    from .prosodic_features import VERSION
+
+    prosodic = f"p{settings.prosodic_window_sec:g}" if settings.enable_prosodic_features else "p0"
+    series = "s1" if settings.prosodic_series_enabled else "s0"
+    return f"v{VERSION}-{prosodic}-{series}-{firma_vad()}"
+
+
+def clave_features(sha256: str, sample_rate: int) -> str:
+    return f"{sha256}:{sample_rate}:{version_extractor()}"
+
+
+class DiskFeatureCache:
+    name = "disk"
+
+    def __init__(self, root: str, max_entries: int):
+        self.root = root
+        self.max_entries = max_entries
+        self._puts = 0
+        # Recuento del directorio solo cada cierto número de escrituras
+        self._intervalo = max(1, min(64, max_entries // 10))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+        except FileNotFoundError:
+            return None
+        if data.get("key") != key:
+            return None
+        try:
+            os.utime(path)  # marca LRU
+        except OSError:
+            pass
+        return data.get("features")
+
+    def put(self, key: str, features: dict) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps({"key": key, "features": features}).encode("utf-8"))
+        os.replace(tmp, path)
+        self._puts += 1
+        if self._puts % self._intervalo == 0:
+            self._expulsar()
+
+    def _expulsar(self) -> None:
+        entradas = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".json"):
+                try:
+                    entradas.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        exceso = len(entradas) - self.max_entries
+        if exceso <= 0:
+            return
+        # Margen del 10% para no expulsar en cada escritura
+        exceso += self.max_entries // 10
+        entradas.sort()
+        for _, path in entradas[:exceso]:
+            try:
+                os.unlink(path)
+                FEATURE_CACHE_EVICTIONS.labels(self.name).inc()
+            except OSError:
+                pass
+
+
+class RedisFeatureCache:
+    name = "redis"
+
+    def __init__(self, client, max_entries: int):
+        self.client = client
+        self.max_entries = max_entries
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self.client.get(REDIS_PREFIX + key)
+        if raw is None:
+            return None
+        self.client.zadd(REDIS_LRU, {key: time.time()})
+        return json.loads(raw)
+
+    def put(self, key: str, features: dict) -> None:
+        pipe = self.client.pipeline()
+        pipe.set(REDIS_PREFIX + key, json.dumps(features))
+        pipe.zadd(REDIS_LRU, {key: time.time()})
+        pipe.zcard(REDIS_LRU)
+        total = pipe.execute()[-1]
+        exceso = int(total) - self.max_entries
+        if exceso > 0:
+            viejas = self.client.zrange(REDIS_LRU, 0, exceso - 1)
+            if viejas:
+                pipe = self.client.pipeline()
+                pipe.delete(
+                    *[REDIS_PREFIX + (k.decode() if isinstance(k, bytes) else k) for k in viejas]
+                )
+                pipe.zrem(REDIS_LRU, *viejas)
+                pipe.execute()
+                FEATURE_CACHE_EVICTIONS.labels(self.name).inc(len(viejas))
+
+
+_cache = None
+
+
+def get_feature_cache():
+    """Backend configurado (None si `FEATURE_CACHE_BACKEND=off` o no disponible)."""
+    global _cache
+    if _cache is None:
+        backend = settings.feature_cache_backend.lower()
+        if backend == "redis":
+            try:
+                import redis
+
+                _cache = RedisFeatureCache(
+                    redis.Redis.from_url(settings.redis_url, decode_responses=True),
+                    settings.feature_cache_max_entries,
+                )
+            except Exception:
+                _cache = False
+        elif backend == "disk":
+            _cache = DiskFeatureCache(
+                settings.feature_cache_dir, settings.feature_cache_max_entries
+            )
+        else:
+            _cache = False
+    return _cache or None
+
+
+def obtener_features(sha256: Optional[str], sample_rate: int) -> Optional[dict]:
+    cache = get_feature_cache()
+    if cache is None or not sha256:
+        return None
+    try:
+        features = cache.get(clave_features(sha256, sample_rate))
+    except Exception:
+        FEATURE_CACHE_REQUESTS.labels(cache.name, "error").inc()
+        return None
+    FEATURE_CACHE_REQUESTS.labels(cache.name, "hit" if features is not None else "miss").inc()
+    return features
+
+
+def guardar_features(sha256: Optional[str], sample_rate: int, features: dict) -> None:
+    cache = get_feature_cache()
+    if cache is None or not sha256 or not features:
+        return
+    try:
+        cache.put(clave_features(sha256, sample_rate), features)
+    except Exception:
+        pass
+
+
+__all__ = [
+    "DiskFeatureCache",
+    "RedisFeatureCache",
+    "clave_features",
+    "get_feature_cache",
+    "guardar_features",
+    "obtener_features",
+    "version_extractor",
+]
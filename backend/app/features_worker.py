@@ -0,0 +1,70 @@
+"""Worker Celery para las etapas de CPU (features y, por defecto, transcripción).
+
+Uso:
+    python -m backend.app.features_worker
+
+Arranca un pool prefork con tantos procesos como núcleos físicos (hyperthreading no
+acelera librosa/whisper y duplica memoria), `prefetch-multiplier=1` para no acaparar
+tareas largas, y consume `FEATURES_WORKER_QUEUES`. Cada proceso precarga su modelo
+Whisper al arrancar (`whisper_registry`), así que se recicla con menos frecuencia
+(`FEATURES_WORKER_MAX_TASKS_PER_CHILD`) que el resto de workers. Los workers de análisis,
+que pasan la mayor parte del tiempo esperando a Grok, se escalan aparte con un pool de
+hilos amplio (ver docker-compose: `worker`).
+"""
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+from .settings import settings
+
+
+def nucleos_fisicos() -> int:
+    """Núcleos físicos disponibles (Linux: /proc/cpuinfo); si no, CPUs lógicas."""
+    logicas = (
+        len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    )
+    try:
+        nucleos = set()
+        fisico = core = None
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for linea in f:
+                if linea.startswith("physical id"):
+                    fisico = linea.split(":", 1)[1].strip()
+                elif linea.startswith("core id"):
+                    core = linea.split(":", 1)[1].strip()
+                elif not linea.strip():
+                    if core is not None:
+                        nucleos.add((fisico, core))
+                    fisico = core = None
+        if core is not None:
+            nucleos.add((fisico, core))
+        if nucleos:
+            return max(1, min(len(nucleos), logicas))
+    except Exception:
+        pass
+    return max(1, logicas)
+
+
+def argumentos_worker(concurrency: Optional[int] = None) -> list:
+    n = concurrency or settings.features_worker_concurrency or nucleos_fisicos()
+    return [
+        "worker",
+        "-l", "info",
+        "-Q", settings.features_worker_queues,
+        "-P", "prefork",
+        "-c", str(n),
+        "--prefetch-multiplier", "1",
+        "--max-tasks-per-child", str(settings.features_worker_max_tasks_per_child),
+        "-n", "features@%h",
+    ]
+
+
+def main() -> None:
+    from .celery_app import celery_app
+
+    celery_app.worker_main(argumentos_worker())
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import asyncio
 from datetime import datetime, timezone
 import json
 import re
+import uuid
 from contextlib import asynccontextmanager
 from typing import Optional, Dict, Deque
 from collections import defaultdict, deque
@@ -9,7 +10,18 @@ from collections import defaultdict, deque
 import redis
 import structlog
 import os
-from fastapi import Depends, FastAPI, File, Form, UploadFile, WebSocket, WebSocketDisconnect, HTTPException, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    Form,
+    Request,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+    HTTPException,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
@@ -18,7 +30,7 @@ from pydantic import BaseModel
 from sqlalchemy import desc
 from sqlmodel import select
 
-from .db import get_session, init_db
+from .db import get_session, init_db, session_scope
 from .logging_setup import configure_logging
 from .models import Response, UserRole, ResponseStatus, Child, Psychologist, Consent
 from sqlalchemy.exc import IntegrityError
@@ -527,6 +539,46 @@ async def submit_responses(
     audio_file: Optional[UploadFile] = File(None),
     session=Depends(get_session),
 ):
+    _verificar_consentimiento(session, parent_id, child_id)
+    # Minimal: persist file later; for now, enqueue text for analysis
+    audio_path = None
+    audio_sha256 = None
+    audio_format = None
+    if audio_file is not None:
+        try:
+            from .audio_utils import AudioValidationError
+            from .audio_ingest import ingerir_audio_streaming
+
+            # Streaming a disco: cabecera validada antes de persistir el cuerpo; el blob
+            # solo llega al almacén si el archivo completo es válido
+            try:
+                ingested = await ingerir_audio_streaming(audio_file)
+            except AudioValidationError as e:
+                raise HTTPException(status_code=400, detail=f"Audio inválido: {str(e)}")
+            audio_path = ingested.key
+            audio_sha256 = ingested.sha256
+            audio_format = ingested.ext  # formato detectado por magic bytes
+            logger.info(
+                "stored_audio",
+                key=audio_path,
+                size=ingested.size_bytes,
+                sha256=ingested.sha256,
+                dedup=not ingested.nuevo,
+            )
+        except HTTPException:
+            raise
+        except Exception as e:  # noqa: BLE001
+            logger.warning("audio_store_failed", error=str(e))
+            # Si falla el almacenamiento, continuar sin audio
+            audio_path = None
+            audio_sha256 = None
+            audio_format = None
+    return _encolar_respuesta(
+        session, child_id, text, selected_emoji, audio_path, audio_format, audio_sha256
+    )
+
+
+def _verificar_consentimiento(session, parent_id: Optional[str], child_id: Optional[str]) -> None:
     # Consent check si parent_id y child_id disponibles
     if settings.dynamic_config_enabled and parent_id and child_id and child_id.isdigit():
         try:
@@ -542,50 +594,49 @@ async def submit_responses(
             raise
         except Exception:
             pass
-    # Minimal: persist file later; for now, enqueue text for analysis
-    audio_path = None
-    if audio_file is not None:
-        try:
-            # Validar archivo antes de guardarlo
-            content = await audio_file.read()
-            from .audio_utils import validar_audio, AudioValidationError
-            
-            # Guardar temporalmente para validación
-            os.makedirs("uploads", exist_ok=True)
-            suffix = os.path.splitext(audio_file.filename or "audio.webm")[1] or ".webm"
-            fname = f"resp_{int(asyncio.get_event_loop().time()*1000)}_{os.getpid()}{suffix}"
-            audio_path = os.path.join("uploads", fname)
-            
-            with open(audio_path, "wb") as f:
-                f.write(content)
-            
-            # Validar formato, tamaño y duración
-            try:
-                validar_audio(audio_path, len(content))
-            except AudioValidationError as e:
-                # Limpiar archivo inválido
-                try:
-                    os.unlink(audio_path)
-                except Exception:
-                    pass
-                raise HTTPException(status_code=400, detail=f"Audio inválido: {str(e)}")
-            
-            logger.info("stored_audio", path=audio_path, size=len(content))
-        except HTTPException:
-            raise
-        except Exception as e:  # noqa: BLE001
-            logger.warning("audio_store_failed", error=str(e))
-            # Si falla el almacenamiento, continuar sin audio
-            audio_path = None
+
+
+def _encolar_respuesta(
+    session,
+    child_id: Optional[str],
+    text: Optional[str],
+    selected_emoji: Optional[str],
+    audio_path: Optional[str],
+    audio_format: Optional[str],
+    audio_sha256: Optional[str],
+    upload=None,
+) -> JSONResponse:
+    """Crea la fila Response (QUEUED) y encola el análisis (multipart y subidas reanudables).
+
+    Con `upload` (sesión reclamada por `finalizar`) la sesión de subida queda finalizada con esta
+    respuesta en la misma transacción. La transacción se confirma antes de encolar: el worker
+    siempre encuentra la fila; si el encolado falla se deshace la respuesta.
+    """
     # Minimal persistence (status QUEUED)
     child_name = (child_id or "child").strip() or "child"
     # child_id numérico opcional si viene convertible
     numeric_child_id = None
     if child_id and child_id.isdigit():
         numeric_child_id = int(child_id)
-    row = Response(child_name=child_name, child_id=numeric_child_id, emotion="Unknown", status=ResponseStatus.QUEUED, audio_path=audio_path, audio_format=(os.path.splitext(audio_path)[1][1:] if audio_path else None))
+    row = Response(
+        child_name=child_name,
+        child_id=numeric_child_id,
+        emotion="Unknown",
+        status=ResponseStatus.QUEUED,
+        audio_path=audio_path,
+        audio_format=audio_format,
+        audio_sha256=audio_sha256,
+    )
     session.add(row)
     session.flush()  # to get id
+    # task_id propio: se guarda con la fila antes de que la tarea exista
+    task_id = str(uuid.uuid4())
+    row.task_id = task_id
+    if upload is not None:
+        from .upload_sessions import marcar_finalizada
+
+        marcar_finalizada(session, upload, row.id, task_id)
+    session.commit()
 
     payload = {
         "text": text or "",
@@ -593,11 +644,19 @@ async def submit_responses(
         "emoji": selected_emoji,
         "response_id": row.id,
         "audio_path": audio_path,
+        "audio_sha256": audio_sha256,
     }
-    task_id = enqueue_analysis_task(payload)
-    # Persist task_id para tracking directo sin Celery backend si se desea
-    row.task_id = task_id
-    session.add(row)
+    try:
+        enqueue_analysis_task(payload, task_id=task_id)
+    except Exception:
+        # Sin tarea no hay análisis: la respuesta confirmada se elimina
+        if upload is not None:
+            from .upload_sessions import deshacer_finalizada
+
+            deshacer_finalizada(session, upload.id)
+        session.delete(row)
+        session.commit()
+        raise
     # Notify listeners (WS relay listens on this channel)
     publish_event("task_queued", task_id=task_id, response_id=row.id, status="QUEUED")
     return JSONResponse(
@@ -611,6 +670,134 @@ async def submit_responses(
     )
 
 
+# ---- Subidas reanudables ----
+class UploadCreate(BaseModel):
+    filename: str
+    size: int
+    parent_id: Optional[str] = None
+    child_id: Optional[str] = None
+    text: Optional[str] = None
+    selected_emoji: Optional[str] = None
+
+
+def _upload_error(e) -> JSONResponse:
+    headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else None
+    content = {"detail": e.detail}
+    if e.offset is not None:
+        content["offset"] = e.offset
+    return JSONResponse(status_code=e.status_code, content=content, headers=headers)
+
+
+@app.post("/api/uploads", status_code=201)
+def create_upload(payload: UploadCreate, session=Depends(get_session)):
+    from .upload_sessions import UploadSessionError, crear_sesion
+
+    _verificar_consentimiento(session, payload.parent_id, payload.child_id)
+    try:
+        up = crear_sesion(
+            session,
+            payload.filename,
+            payload.size,
+            parent_id=payload.parent_id,
+            child_id=payload.child_id,
+            text=payload.text,
+            selected_emoji=payload.selected_emoji,
+        )
+    except UploadSessionError as e:
+        return _upload_error(e)
+    return {
+        "upload_id": up.id,
+        "offset": 0,
+        "size": up.total_size,
+        "expires_at": up.expires_at.isoformat(),
+    }
+
+
+@app.get("/api/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    from .upload_sessions import UploadSessionError, obtener_sesion
+
+    try:
+        up = obtener_sesion(upload_id)
+    except UploadSessionError as e:
+        return _upload_error(e)
+    content = {"upload_id": up.id, "offset": up.offset, "size": up.total_size, "status": up.status}
+    if up.response_id is not None:
+        content["response_id"] = up.response_id
+    return JSONResponse(
+        content=content,
+        headers={"Upload-Offset": str(up.offset), "Cache-Control": "no-store"},
+    )
+
+
+@app.patch("/api/uploads/{upload_id}", status_code=204)
+async def patch_upload(upload_id: str, request: Request):
+    from .upload_sessions import UploadSessionError, recibir_parte
+
+    raw_offset = request.headers.get("upload-offset", "")
+    if not raw_offset.isdigit():
+        raise HTTPException(status_code=400, detail="upload_offset_required")
+    try:
+        offset = await recibir_parte(upload_id, int(raw_offset), request.stream())
+    except UploadSessionError as e:
+        return _upload_error(e)
+    return FastAPIResponse(status_code=204, headers={"Upload-Offset": str(offset)})
+
+
+@app.post("/api/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, session=Depends(get_session)):
+    from .audio_utils import AudioValidationError
+    from .upload_sessions import UploadSessionError, borrar_partes, finalizar, liberar
+
+    try:
+        up, ingested = await finalizar(upload_id)
+    except UploadSessionError as e:
+        return _upload_error(e)
+    except AudioValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Audio inválido: {str(e)}")
+    if ingested is None:
+        # Reintento de un finalize ya completado: la misma respuesta
+        return JSONResponse(
+            status_code=202,
+            content={
+                "status": "accepted",
+                "task_id": up.task_id,
+                "response_id": up.response_id,
+                "message": "Already finalized",
+            },
+        )
+    logger.info(
+        "stored_audio",
+        key=ingested.key,
+        size=ingested.size_bytes,
+        sha256=ingested.sha256,
+        dedup=not ingested.nuevo,
+        upload_id=upload_id,
+    )
+    try:
+        resp = _encolar_respuesta(
+            session,
+            up.child_id,
+            up.text,
+            up.selected_emoji,
+            ingested.key,
+            ingested.ext,
+            ingested.sha256,
+            upload=up,
+        )
+    except UploadSessionError as e:
+        # Otra petición retomó la reclamación vencida mientras se ensamblaba
+        session.rollback()
+        return _upload_error(e)
+    except Exception:
+        session.rollback()
+        liberar(upload_id)
+        raise
+    # Las partes solo se borran con la respuesta ya confirmada y encolada
+    await asyncio.to_thread(borrar_partes, upload_id, up.parts)
+    return resp
+
+
 @app.get("/api/response-status/{task_id}")
 async def response_status(task_id: str, session=Depends(get_session)):
     status = get_task_status(task_id)
@@ -690,6 +877,30 @@ async def get_response(response_id: int, session=Depends(get_session)):
     }
 
 
+@app.api_route("/api/responses/{response_id}/audio", methods=["GET", "HEAD"])
+def get_response_audio(
+    response_id: int,
+    request: Request,
+    session=Depends(get_session),
+    user=Depends(require_roles(UserRole.ADMIN, UserRole.PARENT, UserRole.PSYCHOLOGIST)),
+):
+    """Audio de la respuesta con soporte de Range/If-Range, ETag y Last-Modified."""
+    r = session.get(Response, response_id)
+    if r is None or not r.audio_path:
+        raise HTTPException(status_code=404, detail="not_found")
+    role = user["role"] if isinstance(user, dict) else getattr(user, "role", None)
+    if role == UserRole.PARENT:
+        parent_id = user["id"] if isinstance(user, dict) else getattr(user, "id")
+        c = session.get(Child, r.child_id) if r.child_id else None
+        if c is None or c.parent_id != parent_id:
+            raise HTTPException(status_code=404, detail="not_found")
+    from .audio_playback import respuesta_audio
+    try:
+        return respuesta_audio(request.headers, r.audio_path, r.audio_format, method=request.method)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="audio_not_found")
+
+
 @app.get("/api/dashboard/{child_ref}")
 async def dashboard(child_ref: str, session=Depends(get_session), user=Depends(require_roles(UserRole.ADMIN, UserRole.PARENT, UserRole.PSYCHOLOGIST))):
     # child_ref puede ser id numérico (child_id) o nombre legacy
@@ -1050,6 +1261,78 @@ async def websocket_endpoint(ws: WebSocket):
         except Exception:
             pass
 
+@app.websocket("/ws/audio")
+async def websocket_audio(ws: WebSocket):
+    """Ingesta de audio en directo con análisis incremental (ver `audio_stream`).
+
+    Protocolo: mensaje JSON `{"type": "start", "child_id", "parent_id", "text",
+    "selected_emoji", "format": "pcm_s16le"|"pcm_f32le"}`, después frames binarios de PCM mono
+    16 kHz y, al terminar, `{"type": "end"}` (o cerrar el socket). El servidor responde con
+    `transcript_partial` / `analysis_partial` mientras se graba y `stream_completed`
+    (`response_id`, `task_id`) al cerrar."""
+    from .audio_stream import SesionStreaming, StreamError, finalizar_stream
+
+    await ws.accept()
+    sesion = None
+    conectado = True
+    try:
+        if not settings.stream_enabled:
+            raise StreamError("stream_disabled")
+        inicio = await asyncio.wait_for(ws.receive_json(), timeout=settings.stream_idle_timeout_sec)
+        if not isinstance(inicio, dict) or inicio.get("type") != "start":
+            raise StreamError("start_expected")
+        child_id = str(inicio["child_id"]) if inicio.get("child_id") is not None else None
+        parent_id = str(inicio["parent_id"]) if inicio.get("parent_id") is not None else None
+        with session_scope() as s:
+            _verificar_consentimiento(s, parent_id, child_id)
+        sesion = SesionStreaming(inicio.get("text") or "", inicio.get("format") or "pcm_s16le")
+        await ws.send_json(
+            {"type": "stream_started", "stream_id": sesion.stream_id, "sample_rate": 16000}
+        )
+        while True:
+            msg = await asyncio.wait_for(ws.receive(), timeout=settings.stream_idle_timeout_sec)
+            if msg["type"] == "websocket.disconnect":
+                conectado = False
+                break
+            if msg.get("bytes"):
+                for evento in await asyncio.to_thread(sesion.recibir, msg["bytes"]):
+                    await ws.send_json(evento)
+                    publish_event(
+                        evento["type"],
+                        child_id=child_id,
+                        **{k: v for k, v in evento.items() if k != "type"},
+                    )
+            elif msg.get("text"):
+                try:
+                    control = json.loads(msg["text"])
+                except ValueError:
+                    control = {}
+                if isinstance(control, dict) and control.get("type") == "end":
+                    break
+        # La fila se crea también si el cliente cierra sin `end`
+        final = await asyncio.to_thread(
+            finalizar_stream, sesion, child_id, inicio.get("selected_emoji")
+        )
+        sesion = None
+        if conectado:
+            await ws.send_json({"type": "stream_completed", **final})
+            await ws.close()
+    except WebSocketDisconnect:
+        logger.info("audio_stream_disconnected")
+    except (StreamError, HTTPException, asyncio.TimeoutError) as e:
+        detail = getattr(e, "detail", None) or "idle_timeout"
+        logger.info("audio_stream_rejected", detail=detail)
+        if conectado:
+            try:
+                await ws.send_json({"type": "error", "detail": detail})
+                await ws.close(code=1008)
+            except Exception:
+                pass
+    finally:
+        if sesion is not None:
+            sesion.descartar()
+
+
 @app.get("/api/admin/cleanup-audio", status_code=200)
 async def cleanup_audio_endpoint(user=Depends(require_roles(UserRole.ADMIN))):
     """Endpoint para limpiar archivos de audio antiguos manualmente."""
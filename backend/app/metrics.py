@@ -43,6 +43,66 @@ TRANSCRIPTION_LATENCY = Histogram(
     "emotrack_transcription_latency_seconds", "Latencia de transcripción de audio", ["status"]
 )
 
+# Retención de audio
+AUDIO_RETENTION_FILES = Counter(
+    "emotrack_audio_retention_files_total", "Archivos de audio eliminados por retención", ["kind"]
+)
+AUDIO_RETENTION_BYTES = Counter(
+    "emotrack_audio_retention_bytes_total", "Bytes recuperados por retención de audio", ["kind"]
+)
+
+# Códecs de audio (decodificación/codificación por backend)
+AUDIO_CODEC_OPERATIONS = Counter(
+    "emotrack_audio_codec_operations_total",
+    "Operaciones de códec de audio",
+    ["operation", "backend", "status"],
+)
+
+# Caché de features de audio
+FEATURE_CACHE_REQUESTS = Counter(
+    "emotrack_feature_cache_requests_total",
+    "Consultas a la caché de features (hit/miss/error)",
+    ["backend", "result"],
+)
+FEATURE_CACHE_EVICTIONS = Counter(
+    "emotrack_feature_cache_evictions_total",
+    "Entradas expulsadas (LRU) de la caché de features",
+    ["backend"],
+)
+
+TRANSCRIPTION_CACHE_REQUESTS = Counter(
+    "emotrack_transcription_cache_requests_total",
+    "Consultas a la caché de transcripciones (hit/miss/error)",
+    ["backend", "result"],
+)
+TRANSCRIPTION_CACHE_EVICTIONS = Counter(
+    "emotrack_transcription_cache_evictions_total",
+    "Entradas expulsadas de la caché de transcripciones (lru/ttl)",
+    ["backend", "reason"],
+)
+TRANSCRIPTION_CACHE_BYTES = Gauge(
+    "emotrack_transcription_cache_bytes",
+    "Bytes de texto en la caché de transcripciones",
+    ["backend"],
+)
+
+# Modelos Whisper residentes (whisper_registry)
+WHISPER_MODEL_LOAD_SECONDS = Histogram(
+    "emotrack_whisper_model_load_seconds",
+    "Tiempo de carga de un modelo Whisper",
+    ["model", "compute_type"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 40, 80),
+)
+WHISPER_MODEL_RESIDENT_BYTES = Gauge(
+    "emotrack_whisper_model_resident_bytes",
+    "Memoria residente atribuida a cada modelo Whisper cargado",
+    ["model", "compute_type"],
+)
+WHISPER_MODEL_EVICTIONS = Counter(
+    "emotrack_whisper_model_evictions_total",
+    "Modelos Whisper expulsados por presupuesto de memoria",
+)
+
 __all__ = [
     "REQUEST_COUNT",
     "REQUEST_LATENCY",
@@ -55,4 +115,15 @@ __all__ = [
     "GROK_FALLBACKS",
     "TRANSCRIPTION_REQUESTS",
     "TRANSCRIPTION_LATENCY",
+    "AUDIO_RETENTION_FILES",
+    "AUDIO_RETENTION_BYTES",
+    "AUDIO_CODEC_OPERATIONS",
+    "FEATURE_CACHE_REQUESTS",
+    "FEATURE_CACHE_EVICTIONS",
+    "TRANSCRIPTION_CACHE_REQUESTS",
+    "TRANSCRIPTION_CACHE_EVICTIONS",
+    "TRANSCRIPTION_CACHE_BYTES",
+    "WHISPER_MODEL_LOAD_SECONDS",
+    "WHISPER_MODEL_RESIDENT_BYTES",
+    "WHISPER_MODEL_EVICTIONS",
 ]
@@ -2,7 +2,7 @@ from datetime import datetime, timezone
 from enum import Enum
 from typing import Optional
 
-from sqlalchemy import JSON, Column, DateTime, String, LargeBinary
+from sqlalchemy import JSON, Column, DateTime, Index, String, LargeBinary
 from sqlmodel import Field, SQLModel
 from sqlalchemy import UniqueConstraint
 
@@ -46,6 +46,8 @@ class Response(SQLModel, table=True):
     # Audio pipeline metadata
     audio_path: Optional[str] = Field(default=None, index=True)
     audio_format: Optional[str] = None
+    # Hash SHA-256 del contenido calculado en la ingesta (clave del almacén de audio)
+    audio_sha256: Optional[str] = Field(default=None, index=True)
     audio_duration_sec: Optional[float] = None
     transcript: Optional[str] = None
     transcript_enc: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
@@ -101,3 +103,42 @@ class AppConfig(SQLModel, table=True):
     key: str = Field(index=True, unique=True)
     value: str
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class UploadSession(SQLModel, table=True):
+    """Subida reanudable: las partes recibidas viven en el almacén hasta finalizar."""
+    id: str = Field(primary_key=True)  # token aleatorio no adivinable
+    filename: str
+    total_size: int
+    offset: int = Field(default=0)
+    # [[offset, bytes], ...] en orden; claves `upload_parts/<id>/<offset>`
+    parts: list = Field(default_factory=list, sa_column=Column(JSON))
+    # Campos del formulario de /api/submit-responses
+    parent_id: Optional[str] = None
+    child_id: Optional[str] = None
+    text: Optional[str] = None
+    selected_emoji: Optional[str] = None
+    # open -> finalizing (una sola petición ensambla el audio) -> finalized (se conserva la
+    # respuesta creada para que un reintento de finalize la devuelva)
+    status: str = Field(default="open")
+    # Inicio de la reclamación (finalizing); pasada la concesión otro finalize puede retomarla
+    claimed_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+    response_id: Optional[int] = None
+    task_id: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    expires_at: datetime = Field(sa_column=Column(DateTime(timezone=True), index=True))
+
+
+class AudioFingerprint(SQLModel, table=True):
+    """Huella acústica de una respuesta; índice por niño para detectar casi-duplicados."""
+    response_id: int = Field(foreign_key="response.id", primary_key=True)
+    child_id: Optional[int] = None
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(DateTime(timezone=True)),
+    )
+    duration_sec: float
+    # SHA-256 del texto que acompañaba al audio: solo se reutiliza con el mismo texto
+    text_sha256: Optional[str] = None
+    fingerprint: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    __table_args__ = (Index("ix_audiofingerprint_child_created", "child_id", "created_at"),)
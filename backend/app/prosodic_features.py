@@ -0,0 +1,396 @@
+"""Motor de features prosódicas sobre un único espectrograma.
+
+Antes, `piptrack`, `spectral_centroid` y `mfcc` calculaban cada uno su propia STFT y el
+pitch por frame se elegía con un bucle Python (`argmax` + `append`). Aquí:
+ - se calcula una sola STFT de magnitud (n_fft=2048, hop=512, los valores por defecto de
+   librosa) y de ella salen pitch, centroide espectral y MFCC (mel sobre |S|²);
+ - el pitch dominante por frame se selecciona de forma vectorizada y solo sobre la banda
+   150-4000 Hz de `piptrack` (`_pitch_dominante`);
+ - la energía RMS se sigue calculando en el dominio del tiempo (enmarcado, sin FFT), igual
+   que `librosa.feature.rms(y=...)`, para conservar los valores existentes.
+Los resultados son numéricamente equivalentes a la implementación anterior.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:  # numpy/librosa se importan de forma perezosa
+    import numpy as np
+
+# Cambiar al modificar el cálculo: invalida la caché de features (feature_cache)
+VERSION = "2"
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MFCC = 13
+PITCH_THRESHOLD = 0.1
+PITCH_FMIN = 150.0  # valores por defecto de librosa.piptrack
+PITCH_FMAX = 4000.0
+
+
+@dataclass
+class MarcosProsodicos:
+    """Series por frame (hop de 512 muestras)."""
+
+    pitch_hz: "np.ndarray"  # 0 = frame sin pitch
+    rms: "np.ndarray"
+    centroid_hz: "np.ndarray"
+    mfcc: "np.ndarray"  # (N_MFCC, frames)
+
+
+@lru_cache(maxsize=8)
+def _mel_basis(sr: int):
+    """Banco de filtros mel (librosa lo reconstruye en cada llamada a `melspectrogram`)."""
+    import librosa
+
+    return librosa.filters.mel(sr=sr, n_fft=N_FFT)
+
+
+def _mel_db(S, sr: int):
+    """log-mel sin recorte; mismo cálculo que `power_to_db(melspectrogram(S=S**2))`."""
+    import librosa
+    import numpy as np
+
+    mel = np.einsum("...ft,mf->...mt", S ** 2, _mel_basis(sr), optimize=True)
+    return librosa.power_to_db(mel, top_db=None)
+
+
+def _pitch_dominante(S, sr: int):
+    """Pitch del pico dominante por frame, igual que `piptrack` + `argmax` por columna,
+    pero evaluando solo la banda [PITCH_FMIN, PITCH_FMAX) (la mitad de las filas a 16 kHz)
+    y sin materializar las matrices completas de pitches/magnitudes. Admite lotes
+    (`S` de forma (..., bins, frames))."""
+    import numpy as np
+
+    d = S.shape[-2]
+    n_fft = 2 * (d - 1)
+    freqs = np.arange(d) * (float(sr) / n_fft)
+    banda = np.flatnonzero((freqs >= PITCH_FMIN) & (freqs < min(PITCH_FMAX, sr / 2.0)))
+    lo, hi = int(banda[0]), int(banda[-1]) + 1
+    if lo == 0 or hi >= d:  # la banda toca un extremo del espectro: caso general de librosa
+        import librosa
+
+        pitches, mags = librosa.piptrack(S=S, sr=sr, threshold=PITCH_THRESHOLD)
+        k = mags.argmax(axis=-2)[..., None, :]
+        return np.take_along_axis(pitches, k, axis=-2)[..., 0, :]
+    c, prev, nxt = S[..., lo:hi, :], S[..., lo - 1:hi - 1, :], S[..., lo + 1:hi + 1, :]
+    ref = PITCH_THRESHOLD * S.max(axis=-2, keepdims=True)
+    # Máximos locales del espectro umbralizado (util.localmax sobre S * (S > ref))
+    tc = c * (c > ref)
+    pico = (tc > prev * (prev > ref)) & (tc >= nxt * (nxt > ref))
+    # Interpolación parabólica (desplazamiento 0 si el óptimo cae fuera de ±1 bin)
+    a = nxt + prev - 2 * c
+    b = (nxt - prev) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shift = np.where(np.abs(b) >= np.abs(a), 0, -b / a).astype(S.dtype)
+    mags = np.where(pico, c + 0.5 * b * shift, 0)
+    k = mags.argmax(axis=-2)[..., None, :]
+    mejor = np.take_along_axis(mags, k, axis=-2)[..., 0, :]
+    desplazamiento = np.take_along_axis(shift, k, axis=-2)[..., 0, :].astype(np.float64)
+    pitch = ((lo + k[..., 0, :]) + desplazamiento) * (float(sr) / n_fft)
+    # Sin pico positivo, argmax de librosa cae en la fila 0 (pitch 0)
+    return np.where(mejor > 0, pitch, 0).astype(S.dtype)
+
+
+def _marcos(S, rms, sr: int, ref_db: Optional[float] = None) -> Tuple[MarcosProsodicos, float]:
+    """Frames a partir de |S|; devuelve también el máximo del log-mel usado para el recorte
+    de 80 dB (`power_to_db(top_db=80)`), o `ref_db` si es mayor."""
+    import librosa
+    import numpy as np
+
+    pitch = _pitch_dominante(S, sr)
+    centroid = librosa.feature.spectral_centroid(S=S, sr=sr)[0]
+    mel_db = _mel_db(S, sr)
+    max_db = float(mel_db.max()) if ref_db is None else max(ref_db, float(mel_db.max()))
+    mel_db = np.maximum(mel_db, max_db - 80.0)
+    mfcc = librosa.feature.mfcc(S=mel_db, n_mfcc=N_MFCC)
+    return MarcosProsodicos(pitch_hz=pitch, rms=rms, centroid_hz=centroid, mfcc=mfcc), max_db
+
+
+def marcos_prosodicos(y, sr: int) -> MarcosProsodicos:
+    import librosa
+    import numpy as np
+
+    y = np.ascontiguousarray(y, dtype=np.float32)
+    S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    rms = librosa.feature.rms(y=y, frame_length=N_FFT, hop_length=HOP_LENGTH)[0]
+    return _marcos(S, rms, sr)[0]
+
+
+def agregar(m: MarcosProsodicos) -> Dict[str, float]:
+    import numpy as np
+
+    pitch_values = m.pitch_hz[m.pitch_hz > 0]
+    energy_mean = float(np.mean(m.rms))
+    # Pausas: frames con energía < 10% de la media
+    pause_ratio = float(np.sum(m.rms < energy_mean * 0.1) / len(m.rms))
+    return {
+        "pitch_mean_hz": float(np.mean(pitch_values)) if pitch_values.size else 0.0,
+        "pitch_std_hz": float(np.std(pitch_values)) if pitch_values.size > 1 else 0.0,
+        "energy_mean_db": energy_mean,
+        "energy_std_db": float(np.std(m.rms)),
+        "spectral_centroid_hz": float(np.mean(m.centroid_hz)),
+        "mfcc_mean": float(np.mean(m.mfcc)),
+        "mfcc_std": float(np.std(m.mfcc)),
+        "pause_ratio": pause_ratio,
+        "pitch_range_hz": (
+            float(np.max(pitch_values) - np.min(pitch_values)) if pitch_values.size > 1 else 0.0
+        ),
+    }
+
+
+def calcular_features(y, sr: int) -> Dict[str, float]:
+    """Features prosódicas agregadas de la señal mono `y` ({} si está vacía)."""
+    if len(y) == 0:
+        return {}
+    return agregar(marcos_prosodicos(y, sr))
+
+
+def serie_ventanas(m: MarcosProsodicos, sr: int, window_sec: float) -> List[Dict[str, float]]:
+    """Serie por ventana (mismo formato que `AcumuladorProsodico`) desde frames en memoria."""
+    import numpy as np
+
+    por_ventana = max(1, int(window_sec * sr) // HOP_LENGTH)
+    pausa = m.rms < float(np.mean(m.rms)) * 0.1
+    serie = []
+    for inicio in range(0, len(m.rms), por_ventana):
+        pitch = m.pitch_hz[inicio:inicio + por_ventana]
+        voz = pitch[pitch > 0].astype(np.float64)
+        serie.append({
+            "t_sec": round(inicio * HOP_LENGTH / sr, 2),
+            "pitch_mean_hz": round(float(voz.mean()) if voz.size else 0.0, 1),
+            "energy_mean": round(float(np.mean(m.rms[inicio:inicio + por_ventana])), 5),
+            "pause_ratio": round(float(np.mean(pausa[inicio:inicio + por_ventana])), 3),
+        })
+    return serie
+
+
+def marcos_lote(clips: List, sr: int) -> List[MarcosProsodicos]:
+    """Frames de varios clips con una sola STFT, RMS y log-mel vectorizados sobre el lote.
+
+    Los clips se rellenan con ceros hasta el más largo; como la STFT centrada ya rellena
+    con ceros, los frames válidos de cada clip (1 + len // hop) son idénticos a los de
+    `marcos_prosodicos` sobre el clip suelto. Pitch y centroide (reducciones limitadas
+    por memoria, más lentas sobre el bloque 3D completo) se calculan sobre la vista de
+    cada clip; el recorte de 80 dB del log-mel usa el máximo de cada clip."""
+    import librosa
+    import numpy as np
+
+    largo = max(len(c) for c in clips)
+    Y = np.zeros((len(clips), largo), dtype=np.float32)
+    for i, clip in enumerate(clips):
+        Y[i, :len(clip)] = clip
+    S = np.abs(librosa.stft(Y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    rms = librosa.feature.rms(y=Y, frame_length=N_FFT, hop_length=HOP_LENGTH)[:, 0, :]
+    mel_db = _mel_db(S, sr)
+    marcos = []
+    for i, clip in enumerate(clips):
+        n = 1 + len(clip) // HOP_LENGTH
+        S_i = np.ascontiguousarray(S[i, :, :n])
+        mel_i = mel_db[i, :, :n]
+        mfcc = librosa.feature.mfcc(S=np.maximum(mel_i, mel_i.max() - 80.0), n_mfcc=N_MFCC)
+        marcos.append(MarcosProsodicos(
+            pitch_hz=_pitch_dominante(S_i, sr),
+            rms=rms[i, :n],
+            centroid_hz=librosa.feature.spectral_centroid(S=S_i, sr=sr)[0],
+            mfcc=mfcc,
+        ))
+    return marcos
+
+
+def _cubetas(largos: List[int], max_lote: int, holgura: float = 1.25) -> List[List[int]]:
+    """Agrupa índices por longitud: en cada cubeta el más largo no supera `holgura` veces
+    al más corto (poco relleno desperdiciado) y hay como mucho `max_lote` clips."""
+    orden = sorted((i for i, n in enumerate(largos) if n > 0), key=lambda i: largos[i])
+    cubetas: List[List[int]] = []
+    for i in orden:
+        if (
+            cubetas
+            and len(cubetas[-1]) < max_lote
+            and largos[i] <= largos[cubetas[-1][0]] * holgura
+        ):
+            cubetas[-1].append(i)
+        else:
+            cubetas.append([i])
+    return cubetas
+
+
+def calcular_features_lote(
+    clips: List, sr: int, window_sec: float = 10.0, max_lote: int = 8
+) -> List[Tuple[Dict[str, float], List[Dict[str, float]]]]:
+    """(features, serie) por clip, en el orden de entrada; clips vacíos -> ({}, [])."""
+    import numpy as np
+
+    clips = [np.asarray(c, dtype=np.float32) for c in clips]
+    resultados: List[Tuple[Dict[str, float], List[Dict[str, float]]]] = [({}, []) for _ in clips]
+    for cubeta in _cubetas([len(c) for c in clips], max_lote):
+        for i, m in zip(cubeta, marcos_lote([clips[i] for i in cubeta], sr)):
+            resultados[i] = (agregar(m), serie_ventanas(m, sr, window_sec))
+    return resultados
+
+
+class AcumuladorProsodico:
+    """Features prosódicas por bloques con memoria acotada (grabaciones completas).
+
+    Recibe el PCM en bloques de cualquier tamaño (`alimentar`) y procesa ventanas fijas de
+    `window_sec` segundos (+ n_fft/2 de contexto a cada lado), de modo que los frames son
+    los mismos que los de una STFT centrada sobre toda la señal. Solo se acumulan sumas
+    (pitch, centroide, MFCC) y la energía RMS por frame (~4 bytes cada 32 ms, necesaria
+    para el umbral de pausas relativo a la media global), nunca el audio ni el espectrograma.
+
+    Única diferencia con `calcular_features`: el recorte de 80 dB del log-mel (MFCC) se
+    aplica respecto al máximo acumulado hasta cada ventana, no al máximo global; con una
+    sola ventana el resultado es idéntico.
+    """
+
+    def __init__(self, sr: int, window_sec: float = 10.0):
+        self.sr = sr
+        self.frames_por_ventana = max(1, int(window_sec * sr) // HOP_LENGTH)
+        self._pendientes: List["np.ndarray"] = []
+        self._n_pendientes = 0
+        self._buffer = None  # señal "centrada" (con relleno inicial) desde el frame `_frame`
+        self._frame = 0
+        self._muestras = 0
+        self._ref_db: Optional[float] = None
+        self._pitch = [0, 0.0, 0.0, float("inf"), float("-inf")]  # n, suma, suma², min, max
+        self._centroid = [0, 0.0]
+        self._mfcc = [0, 0.0, 0.0]
+        self._rms: List["np.ndarray"] = []
+        self._ventanas: List[Tuple[int, float]] = []  # (frame inicial, pitch medio)
+
+    def alimentar(self, bloque) -> None:
+        import numpy as np
+
+        if self._buffer is None:
+            self._buffer = np.zeros(N_FFT // 2, dtype=np.float32)
+        bloque = np.asarray(bloque, dtype=np.float32)
+        self._muestras += len(bloque)
+        self._pendientes.append(bloque)
+        self._n_pendientes += len(bloque)
+        necesario = (self.frames_por_ventana - 1) * HOP_LENGTH + N_FFT
+        if len(self._buffer) + self._n_pendientes >= necesario:
+            self._consolidar()
+            while len(self._buffer) >= necesario:
+                self._procesar(self.frames_por_ventana)
+
+    def _consolidar(self) -> None:
+        import numpy as np
+
+        if self._pendientes:
+            self._buffer = np.concatenate([self._buffer] + self._pendientes)
+            self._pendientes = []
+            self._n_pendientes = 0
+
+    def _procesar(self, n_frames: int) -> None:
+        import librosa
+        import numpy as np
+
+        segmento = self._buffer[: (n_frames - 1) * HOP_LENGTH + N_FFT]
+        S = np.abs(librosa.stft(segmento, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False))
+        rms = librosa.feature.rms(
+            y=segmento, frame_length=N_FFT, hop_length=HOP_LENGTH, center=False
+        )[0]
+        m, self._ref_db = _marcos(S, rms, self.sr, ref_db=self._ref_db)
+
+        voz = m.pitch_hz[m.pitch_hz > 0].astype(np.float64)
+        if voz.size:
+            p = self._pitch
+            p[0] += voz.size
+            p[1] += float(voz.sum())
+            p[2] += float(np.square(voz).sum())
+            p[3] = min(p[3], float(voz.min()))
+            p[4] = max(p[4], float(voz.max()))
+        self._centroid[0] += m.centroid_hz.size
+        self._centroid[1] += float(m.centroid_hz.sum(dtype=np.float64))
+        mfcc = m.mfcc.astype(np.float64)
+        self._mfcc[0] += mfcc.size
+        self._mfcc[1] += float(mfcc.sum())
+        self._mfcc[2] += float(np.square(mfcc).sum())
+        self._rms.append(np.asarray(rms, dtype=np.float32))
+        self._ventanas.append((self._frame, float(voz.mean()) if voz.size else 0.0))
+
+        self._buffer = self._buffer[n_frames * HOP_LENGTH:]
+        self._frame += n_frames
+
+    def terminar(self) -> Tuple[Dict[str, float], List[Dict[str, float]]]:
+        """Devuelve (features agregadas, serie por ventana); ({}, []) si no hubo audio."""
+        import numpy as np
+
+        if not self._muestras:
+            return {}, []
+        self._pendientes.append(np.zeros(N_FFT // 2, dtype=np.float32))
+        self._consolidar()
+        total = 1 + self._muestras // HOP_LENGTH  # frames de una STFT centrada
+        while self._frame < total:
+            self._procesar(min(self.frames_por_ventana, total - self._frame))
+        return self._resultado()
+
+    def parcial(self) -> Tuple[Dict[str, float], List[Dict[str, float]]]:
+        """Features de las ventanas ya procesadas (sin vaciar el buffer); ({}, []) si ninguna.
+        Sirve para resultados provisionales mientras sigue llegando audio."""
+        if not self._rms:
+            return {}, []
+        return self._resultado()
+
+    def _resultado(self) -> Tuple[Dict[str, float], List[Dict[str, float]]]:
+        import numpy as np
+
+        rms = np.concatenate(self._rms)
+        energy_mean = float(np.mean(rms))
+        pausa = rms < energy_mean * 0.1
+        n, suma, suma2, p_min, p_max = self._pitch
+        mfcc_n, mfcc_s, mfcc_s2 = self._mfcc
+        mfcc_mean = mfcc_s / mfcc_n
+        features = {
+            "pitch_mean_hz": suma / n if n else 0.0,
+            "pitch_std_hz": float(np.sqrt(max(suma2 / n - (suma / n) ** 2, 0.0))) if n > 1 else 0.0,
+            "energy_mean_db": energy_mean,
+            "energy_std_db": float(np.std(rms)),
+            "spectral_centroid_hz": self._centroid[1] / self._centroid[0],
+            "mfcc_mean": mfcc_mean,
+            "mfcc_std": float(np.sqrt(max(mfcc_s2 / mfcc_n - mfcc_mean ** 2, 0.0))),
+            "pause_ratio": float(np.sum(pausa) / len(rms)),
+            "pitch_range_hz": p_max - p_min if n > 1 else 0.0,
+        }
+        serie = []
+        for inicio, pitch_medio in self._ventanas:
+            fin = inicio + self.frames_por_ventana
+            serie.append({
+                "t_sec": round(inicio * HOP_LENGTH / self.sr, 2),
+                "pitch_mean_hz": round(pitch_medio, 1),
+                "energy_mean": round(float(np.mean(rms[inicio:fin])), 5),
+                "pause_ratio": round(float(np.mean(pausa[inicio:fin])), 3),
+            })
+        return features, serie
+
+
+def calcular_features_stream(
+    bloques: Iterable, sr: int, window_sec: float = 10.0
+) -> Tuple[Dict[str, float], List[Dict[str, float]]]:
+    """Features de una secuencia de bloques PCM (p.ej. `decodificar_pcm` o un memmap troceado)."""
+    acumulador = AcumuladorProsodico(sr, window_sec)
+    for bloque in bloques:
+        acumulador.alimentar(bloque)
+    return acumulador.terminar()
+
+
+def bloques_de(y, sr: int, window_sec: float = 10.0) -> Iterable:
+    """Trocea un array (memmap) en vistas de una ventana; solo se paginan las que se procesan."""
+    paso = max(1, int(window_sec * sr))
+    for inicio in range(0, len(y), paso):
+        yield y[inicio:inicio + paso]
+
+
+__all__ = [
+    "MarcosProsodicos",
+    "marcos_prosodicos",
+    "agregar",
+    "calcular_features",
+    "AcumuladorProsodico",
+    "calcular_features_stream",
+    "bloques_de",
+    "calcular_features_lote",
+    "marcos_lote",
+    "serie_ventanas",
+]
@@ -44,13 +44,137 @@ class Settings(BaseSettings):
     transcription_model: str = os.getenv("TRANSCRIPTION_MODEL", "base")
     transcription_language: str = os.getenv("TRANSCRIPTION_LANGUAGE", "auto")  # auto, es, en, etc.
     transcription_cache_enabled: bool = os.getenv("TRANSCRIPTION_CACHE_ENABLED", "1") in {"1", "true", "True"}
+    # Caché de transcripciones (transcription_cache)
+    # sqlite | redis | off
+    transcription_cache_backend: str = os.getenv("TRANSCRIPTION_CACHE_BACKEND", "sqlite")
+    transcription_cache_path: str = (
+        os.getenv("TRANSCRIPTION_CACHE_PATH", os.path.join("uploads", ".transcriptions.sqlite"))
+    )
+    transcription_cache_max_mb: int = int(os.getenv("TRANSCRIPTION_CACHE_MAX_MB", "256"))
+    # 0 = sin caducidad
+    transcription_cache_ttl_days: float = float(os.getenv("TRANSCRIPTION_CACHE_TTL_DAYS", "30"))
+    # p.ej. large-v3=90,base=14
+    transcription_cache_ttl_by_model: str = os.getenv("TRANSCRIPTION_CACHE_TTL_BY_MODEL", "")
+    # "default" = precisión de los pesos (como antes); int8 solo vía perfil de autotune o explícito
+    transcription_compute_type: str = os.getenv("TRANSCRIPTION_COMPUTE_TYPE", "default")
+    # 0 = por defecto de CTranslate2
+    transcription_cpu_threads: int = int(os.getenv("TRANSCRIPTION_CPU_THREADS", "0"))
+    transcription_beam_size: int = int(os.getenv("TRANSCRIPTION_BEAM_SIZE", "1"))
+    # Lotes de transcripción (transcription_batch)
+    transcription_batch_enabled: bool = (
+        os.getenv("TRANSCRIPTION_BATCH_ENABLED", "1") in {"1", "true", "True"}
+    )
+    transcription_batch_size: int = int(os.getenv("TRANSCRIPTION_BATCH_SIZE", "16"))
+    transcription_batch_window_ms: int = int(os.getenv("TRANSCRIPTION_BATCH_WINDOW_MS", "500"))
+    transcription_batch_time_limit_sec: int = (
+        int(os.getenv("TRANSCRIPTION_BATCH_TIME_LIMIT_SEC", "600"))
+    )
+    # Transcripción por trozos en paralelo de grabaciones largas (transcription_parallel)
+    transcription_parallel_enabled: bool = (
+        os.getenv("TRANSCRIPTION_PARALLEL_ENABLED", "1") in {"1", "true", "True"}
+    )
+    transcription_parallel_min_sec: float = float(os.getenv("TRANSCRIPTION_PARALLEL_MIN_SEC", "90"))
+    transcription_segment_sec: float = float(os.getenv("TRANSCRIPTION_SEGMENT_SEC", "30"))
+    # 0 = núcleos físicos
+    transcription_parallel_workers: int = int(os.getenv("TRANSCRIPTION_PARALLEL_WORKERS", "0"))
+    # Modelos Whisper residentes por proceso (whisper_registry)
+    whisper_preload: bool = os.getenv("WHISPER_PRELOAD", "1") in {"1", "true", "True"}
+    whisper_memory_budget_mb: int = int(os.getenv("WHISPER_MEMORY_BUDGET_MB", "3072"))
+    # Perfil medido por `python -m backend.app.whisper_autotune` ("" = no usar perfil)
+    whisper_profile_path: str = (
+        os.getenv("WHISPER_PROFILE_PATH", os.path.join("uploads", ".whisper_profile.json"))
+    )
     ffmpeg_path: str = os.getenv("FFMPEG_PATH", "ffmpeg")
+    # pyav (en proceso) | ffmpeg (subproceso)
+    audio_codec_backend: str = os.getenv("AUDIO_CODEC_BACKEND", "pyav")
     allowed_audio_formats: list[str] = os.getenv("ALLOWED_AUDIO_FORMATS", "wav,mp3,webm,ogg,m4a").split(",")
+    # Almacenamiento de blobs (audio, derivados, caché de transcripción)
+    storage_backend: str = os.getenv("STORAGE_BACKEND", "local")  # local | s3
+    storage_local_root: str = os.getenv("STORAGE_LOCAL_ROOT", "uploads")
+    storage_tmp_dir: str = os.getenv("STORAGE_TMP_DIR", os.path.join("uploads", ".tmp"))
+    storage_s3_bucket: str = os.getenv("STORAGE_S3_BUCKET", "emotrack-audio")
+    storage_s3_prefix: str = os.getenv("STORAGE_S3_PREFIX", "")
+    storage_s3_endpoint_url: str | None = os.getenv("STORAGE_S3_ENDPOINT_URL")  # p.ej. http://minio:9000
+    storage_s3_region: str | None = os.getenv("STORAGE_S3_REGION")
+    storage_s3_access_key: str | None = os.getenv("STORAGE_S3_ACCESS_KEY")
+    storage_s3_secret_key: str | None = os.getenv("STORAGE_S3_SECRET_KEY")
+    # Subidas reanudables (/api/uploads)
+    upload_session_ttl_hours: float = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+    upload_chunk_max_mb: float = float(os.getenv("UPLOAD_CHUNK_MAX_MB", "8"))
+    # finalize caído: se puede reclamar de nuevo
+    upload_finalize_lease_sec: float = float(os.getenv("UPLOAD_FINALIZE_LEASE_SEC", "300"))
+    # Buffer PCM compartido entre análisis y transcripción (float32 16 kHz, memmap)
+    pcm_cache_dir: str = os.getenv("PCM_CACHE_DIR", os.path.join("uploads", ".pcm"))
     # Features prosódicas avanzadas
     enable_prosodic_features: bool = os.getenv("ENABLE_PROSODIC_FEATURES", "0") in {"1", "true", "True"}
+    # Extracción por ventanas sobre la grabación completa (memoria acotada) y serie por ventana
+    prosodic_window_sec: float = float(os.getenv("PROSODIC_WINDOW_SEC", "10"))
+    prosodic_series_enabled: bool = os.getenv("PROSODIC_SERIES", "1") in {"1", "true", "True"}
+    # VAD por energía: features y transcripción solo sobre regiones con voz
+    vad_enabled: bool = os.getenv("VAD_ENABLED", "1") in {"1", "true", "True"}
+    vad_frame_ms: int = int(os.getenv("VAD_FRAME_MS", "30"))
+    vad_margin_db: float = float(os.getenv("VAD_MARGIN_DB", "10"))
+    vad_floor_db: float = float(os.getenv("VAD_FLOOR_DB", "-55"))
+    vad_padding_ms: int = int(os.getenv("VAD_PADDING_MS", "200"))
+    vad_min_silence_ms: int = int(os.getenv("VAD_MIN_SILENCE_MS", "600"))
+    vad_min_speech_ms: int = int(os.getenv("VAD_MIN_SPEECH_MS", "120"))
+    # Etapa de features en su propia cola Celery (`features`, pool de procesos)
+    features_task_enabled: bool = os.getenv("FEATURES_TASK_ENABLED", "1") in {"1", "true", "True"}
+    features_task_timeout_sec: int = int(os.getenv("FEATURES_TASK_TIMEOUT_SEC", "45"))
+    # 0 = núcleos físicos
+    features_worker_concurrency: int = int(os.getenv("FEATURES_WORKER_CONCURRENCY", "0"))
+    features_worker_queues: str = os.getenv("FEATURES_WORKER_QUEUES", "features,transcription")
+    # Reciclado de procesos del worker de CPU (cada reinicio recarga el modelo Whisper)
+    features_worker_max_tasks_per_child: int = (
+        int(os.getenv("FEATURES_WORKER_MAX_TASKS_PER_CHILD", "1000"))
+    )
+    # Lotes de clips cortos (Redis): acumular durante una ventana y extraer juntos
+    features_batch_enabled: bool = os.getenv("FEATURES_BATCH_ENABLED", "1") in {"1", "true", "True"}
+    features_batch_max_sec: float = float(os.getenv("FEATURES_BATCH_MAX_SEC", "5"))
+    features_batch_window_ms: int = int(os.getenv("FEATURES_BATCH_WINDOW_MS", "300"))
+    features_batch_size: int = int(os.getenv("FEATURES_BATCH_SIZE", "32"))
+    # Ingesta en directo por WebSocket (/ws/audio)
+    stream_enabled: bool = os.getenv("STREAM_INGEST_ENABLED", "1") in {"1", "true", "True"}
+    stream_update_sec: float = float(os.getenv("STREAM_UPDATE_SEC", "2"))
+    stream_feature_window_sec: float = float(os.getenv("STREAM_FEATURE_WINDOW_SEC", "2"))
+    stream_transcribe_min_sec: float = float(os.getenv("STREAM_TRANSCRIBE_MIN_SEC", "3"))
+    stream_transcribe_max_sec: float = float(os.getenv("STREAM_TRANSCRIBE_MAX_SEC", "15"))
+    # Whisper en el proceso de la API (un modelo residente por proceso, ~150 MB con base int8 y
+    # ~1 GB+ con large): 0 = el worker transcribe al cerrar
+    stream_transcribe_enabled: bool = (
+        os.getenv("STREAM_TRANSCRIBE_ENABLED", "0") in {"1", "true", "True"}
+    )
+    # Emoción provisional (Grok): solo con texto nuevo o cada este intervalo de reloj, nunca en cola
+    stream_emotion_interval_sec: float = float(os.getenv("STREAM_EMOTION_INTERVAL_SEC", "20"))
+    stream_emotion_workers: int = int(os.getenv("STREAM_EMOTION_WORKERS", "4"))
+    stream_idle_timeout_sec: float = float(os.getenv("STREAM_IDLE_TIMEOUT_SEC", "30"))
+    # Huella acústica: reutilizar análisis de clips casi idénticos del mismo niño
+    fingerprint_enabled: bool = os.getenv("FINGERPRINT_ENABLED", "1") in {"1", "true", "True"}
+    fingerprint_min_similarity: float = float(os.getenv("FINGERPRINT_MIN_SIMILARITY", "0.85"))
+    fingerprint_lookback_days: int = int(os.getenv("FINGERPRINT_LOOKBACK_DAYS", "30"))
+    fingerprint_max_candidates: int = int(os.getenv("FINGERPRINT_MAX_CANDIDATES", "50"))
+    fingerprint_max_offset_frames: int = int(os.getenv("FINGERPRINT_MAX_OFFSET_FRAMES", "16"))
+    # Caché de features extraídas (clave: sha256 + sample rate + versión del extractor)
+    feature_cache_backend: str = os.getenv("FEATURE_CACHE_BACKEND", "disk")  # disk | redis | off
+    feature_cache_dir: str = os.getenv("FEATURE_CACHE_DIR", os.path.join("uploads", ".features"))
+    feature_cache_max_entries: int = int(os.getenv("FEATURE_CACHE_MAX_ENTRIES", "20000"))
     # Limpieza automática
     audio_cleanup_days: int = int(os.getenv("AUDIO_CLEANUP_DAYS", "7"))  # días antes de limpiar archivos
+    # filas por transacción
+    audio_cleanup_batch_size: int = int(os.getenv("AUDIO_CLEANUP_BATCH_SIZE", "200"))
+    # tope por ejecución
+    audio_cleanup_max_batches: int = int(os.getenv("AUDIO_CLEANUP_MAX_BATCHES", "25"))
+    # fragmentos ab/cd (de 65536) por ejecución
+    audio_orphan_scan_shards: int = int(os.getenv("AUDIO_ORPHAN_SCAN_SHARDS", "256"))
+    audio_orphan_grace_hours: float = float(os.getenv("AUDIO_ORPHAN_GRACE_HOURS", "24"))
     enable_audio_compression: bool = os.getenv("ENABLE_AUDIO_COMPRESSION", "0") in {"1", "true", "True"}
+    # Copia canónica en reposo: original | opus (Ogg/Opus mono 16 kHz;
+    # se descarta el upload verificado)
+    audio_storage_codec: str = os.getenv("AUDIO_STORAGE_CODEC", "original")
+    audio_opus_bitrate: str = os.getenv("AUDIO_OPUS_BITRATE", "24k")  # voz: 16-32k
+    audio_opus_source_formats: list[str] = (
+        os.getenv("AUDIO_OPUS_SOURCE_FORMATS", "wav,flac").split(",")
+    )
     # Cifrado en reposo (opcional)
     enable_encryption: bool = os.getenv("ENABLE_ENCRYPTION", "0") in {"1", "true", "True"}
     encryption_key: str | None = os.getenv("ENCRYPTION_KEY")
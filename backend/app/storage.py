@@ -0,0 +1,388 @@
+"""Almacenamiento de blobs (audio, derivados y caché de transcripción).
+
+Backends:
+ - `local`: directorio con layout fragmentado por hash (`<root>/<prefijo>/ab/cd/<nombre>`),
+   evita directorios planos con cientos de miles de entradas.
+ - `s3`: cualquier API compatible con S3 (AWS, MinIO). Permite que API y workers corran
+   en nodos distintos sin volumen compartido. Requiere `boto3` (import perezoso).
+
+Las claves son lógicas (`audio/<sha256>.webm`, `derived/norm_<sha256>.<ext>.16k1c_s16.wav`, ...); el
+fragmentado se aplica dentro del backend. `local_path(ref)` también acepta rutas de
+archivo existentes (filas antiguas con `uploads/resp_*.wav`).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+from .settings import settings
+
+_HEX = set("0123456789abcdef")
+
+
+def _shard(key: str) -> str:
+    """`audio/<sha>.wav` -> `audio/ab/cd/<sha>.wav` (nombres no hex se fragmentan por sha1)."""
+    prefix, _, name = key.rpartition("/")
+    head = name[:4].lower()
+    if len(head) < 4 or not set(head) <= _HEX:
+        head = hashlib.sha1(name.encode("utf-8")).hexdigest()[:4]
+    parts = [p for p in (prefix, head[:2], head[2:4], name) if p]
+    return "/".join(parts)
+
+
+class BlobStorage:
+    """Interfaz común de los backends."""
+
+    def put_file(self, key: str, local_path: str, move: bool = False) -> None:
+        raise NotImplementedError
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, key: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        """(bytes, mtime epoch) o None si no existe."""
+        raise NotImplementedError
+
+    def touch(self, key: str) -> bool:
+        """Renueva el mtime del blob (reutilización por deduplicación). False si no existe."""
+        raise NotImplementedError
+
+    def local_file(self, key: str) -> Optional[str]:
+        """Ruta local del blob sin copiarlo (None si el backend no es local)."""
+        return None
+
+    def iter_range(
+        self, key: str, start: int, length: int, chunk_size: int = 64 * 1024
+    ) -> Iterator[bytes]:
+        """Itera `length` bytes desde `start` sin cargar el blob completo en memoria."""
+        raise NotImplementedError
+
+    def list_shard(self, prefix: str, shard: str) -> Iterator[Tuple[str, int, float]]:
+        """Itera (clave, bytes, mtime epoch) de un fragmento `ab/cd` bajo `prefix`.
+        Permite recorridos incrementales (un fragmento por vez) sin listar todo el árbol."""
+        raise NotImplementedError
+
+    @contextmanager
+    def _materialize(self, key: str) -> Iterator[str]:
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    @contextmanager
+    def local_path(self, ref: str) -> Iterator[str]:
+        """Ruta local legible para herramientas que necesitan archivo (ffmpeg, librosa, whisper)."""
+        if os.path.isfile(ref):
+            yield ref  # ruta local o legada (antes del almacén)
+        elif self.exists(ref):
+            with self._materialize(ref) as path:
+                yield path
+        else:
+            raise FileNotFoundError(ref)
+
+
+def _tmp_junto(dest: str) -> str:
+    """Temporal único junto al destino (mismo sistema de archivos para el rename atómico);
+    el pid solo no basta con varios hilos escribiendo la misma clave."""
+    fd, tmp = tempfile.mkstemp(
+        prefix=f".{os.path.basename(dest)}.", suffix=".tmp", dir=os.path.dirname(dest)
+    )
+    os.close(fd)
+    os.chmod(tmp, 0o644)  # mkstemp crea 0600; los blobs conservan los permisos habituales
+    return tmp
+
+
+def _borrar_tmp(tmp: str) -> None:
+    try:
+        os.unlink(tmp)
+    except OSError:
+        pass
+
+
+class LocalShardedStorage(BlobStorage):
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, *_shard(key).split("/"))
+
+    def put_file(self, key: str, local_path: str, move: bool = False) -> None:
+        dest = self.path_for(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if move:
+            try:
+                os.replace(local_path, dest)
+                return
+            except OSError:
+                pass  # otro sistema de archivos: copia a temporal junto al destino + rename
+        tmp = _tmp_junto(dest)
+        try:
+            shutil.copyfile(local_path, tmp)
+            os.replace(tmp, dest)
+        except BaseException:
+            _borrar_tmp(tmp)
+            raise
+        if move:
+            os.unlink(local_path)
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        dest = self.path_for(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = _tmp_junto(dest)
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, dest)
+        except BaseException:
+            _borrar_tmp(tmp)
+            raise
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path_for(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path_for(key))
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path_for(key))
+        except OSError:
+            return None
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.unlink(self.path_for(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        try:
+            st = os.stat(self.path_for(key))
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def touch(self, key: str) -> bool:
+        try:
+            os.utime(self.path_for(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def local_file(self, key: str) -> Optional[str]:
+        path = self.path_for(key)
+        return path if os.path.isfile(path) else None
+
+    def iter_range(
+        self, key: str, start: int, length: int, chunk_size: int = 64 * 1024
+    ) -> Iterator[bytes]:
+        with open(self.path_for(key), "rb") as f:
+            f.seek(start)
+            while length > 0:
+                data = f.read(min(chunk_size, length))
+                if not data:
+                    return
+                length -= len(data)
+                yield data
+
+    def list_shard(self, prefix: str, shard: str) -> Iterator[Tuple[str, int, float]]:
+        directory = os.path.join(self.root, prefix, *shard.split("/"))
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                yield f"{prefix}/{entry.name}", st.st_size, st.st_mtime
+
+    @contextmanager
+    def _materialize(self, key: str) -> Iterator[str]:
+        yield self.path_for(key)  # sin copia
+
+
+class S3Storage(BlobStorage):
+    def __init__(self, bucket: str, client=None, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3  # type: ignore  # dependencia opcional
+
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=settings.storage_s3_endpoint_url or None,
+                region_name=settings.storage_s3_region or None,
+                aws_access_key_id=settings.storage_s3_access_key or None,
+                aws_secret_access_key=settings.storage_s3_secret_key or None,
+            )
+        return self._client
+
+    def _object_key(self, key: str) -> str:
+        sharded = _shard(key)
+        return f"{self.prefix}/{sharded}" if self.prefix else sharded
+
+    @staticmethod
+    def _is_not_found(exc: Exception) -> bool:
+        code = str(getattr(exc, "response", {}).get("Error", {}).get("Code", ""))
+        return code in {"404", "NoSuchKey", "NotFound"}
+
+    def put_file(self, key: str, local_path: str, move: bool = False) -> None:
+        self.client.upload_file(local_path, self.bucket, self._object_key(key))
+        if move:
+            try:
+                os.unlink(local_path)
+            except Exception:
+                pass
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._is_not_found(e):
+                return None
+            raise
+        return obj["Body"].read()
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._is_not_found(e):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> Optional[int]:
+        head = self._head(key)
+        return int(head["ContentLength"]) if head else None
+
+    def delete(self, key: str) -> bool:
+        existed = self.exists(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        return existed
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        head = self._head(key)
+        if head is None:
+            return None
+        modified = head.get("LastModified")
+        return int(head["ContentLength"]), modified.timestamp() if modified else 0.0
+
+    def touch(self, key: str) -> bool:
+        # Copia sobre sí mismo: S3 solo actualiza LastModified reescribiendo el objeto
+        object_key = self._object_key(key)
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=object_key,
+                CopySource={"Bucket": self.bucket, "Key": object_key},
+                MetadataDirective="REPLACE",
+            )
+            return True
+        except Exception as e:
+            if self._is_not_found(e):
+                return False
+            raise
+
+    def iter_range(
+        self, key: str, start: int, length: int, chunk_size: int = 64 * 1024
+    ) -> Iterator[bytes]:
+        if length <= 0:
+            return
+        obj = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Range=f"bytes={start}-{start + length - 1}",
+        )
+        body = obj["Body"]
+        try:
+            while True:
+                data = body.read(chunk_size)
+                if not data:
+                    return
+                yield data
+        finally:
+            close = getattr(body, "close", None)
+            if close:
+                close()
+
+    def list_shard(self, prefix: str, shard: str) -> Iterator[Tuple[str, int, float]]:
+        base = f"{self.prefix}/{prefix}/{shard}/" if self.prefix else f"{prefix}/{shard}/"
+        token = None
+        while True:
+            kwargs = {"Bucket": self.bucket, "Prefix": base}
+            if token:
+                kwargs["ContinuationToken"] = token
+            page = self.client.list_objects_v2(**kwargs)
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(base):]
+                modified = obj.get("LastModified")
+                yield (
+                    f"{prefix}/{name}",
+                    int(obj.get("Size", 0)),
+                    modified.timestamp() if modified else 0.0,
+                )
+            if not page.get("IsTruncated"):
+                return
+            token = page.get("NextContinuationToken")
+
+    @contextmanager
+    def _materialize(self, key: str) -> Iterator[str]:
+        os.makedirs(settings.storage_tmp_dir, exist_ok=True)
+        suffix = os.path.splitext(key)[1]
+        fd, tmp = tempfile.mkstemp(suffix=suffix, dir=settings.storage_tmp_dir)
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), tmp)
+            yield tmp
+        finally:
+            try:
+                os.unlink(tmp)
+            except Exception:
+                pass
+
+
+_storage: Optional[BlobStorage] = None
+
+
+def get_storage() -> BlobStorage:
+    """Backend configurado (`STORAGE_BACKEND=local|s3`), instanciado una vez por proceso."""
+    global _storage
+    if _storage is not None:
+        return _storage
+    if settings.storage_backend == "s3":
+        _storage = S3Storage(settings.storage_s3_bucket, prefix=settings.storage_s3_prefix)
+    else:
+        _storage = LocalShardedStorage(settings.storage_local_root)
+    return _storage
+
+
+__all__ = ["BlobStorage", "LocalShardedStorage", "S3Storage", "get_storage"]
@@ -12,131 +12,403 @@ from .alert_rules import evaluate_auto_alerts
 from .metrics import TASK_COUNTER
 from sqlalchemy import select  # (posible uso futuro, no estricto)
 from .settings import settings
-from .audio_utils import normalizar_audio, extraer_features_audio, transcribir_audio, comprimir_audio
-from .events import publish_event
+from .audio_codec import almacenar_canonico, requiere_canonico
+from .audio_utils import (
+    extraer_features_audio,
+    extraer_features_pcm,
+    transcribir_audio,
+    duracion_audio,
+)
+from .audio_pcm import SAMPLE_RATE as PCM_SAMPLE_RATE, liberar_pcm
+from .feature_batch import admite_lote, completar_clip, preparar_clip, procesar_lote, solicitar
+from .audio_store import buscar_derivados_previos
+from .audio_fingerprint import (
+    analisis_reutilizable,
+    contexto_huella,
+    hash_texto,
+    registrar as registrar_huella,
+)
+from .storage import get_storage
+from .events import publish_event, publish_events
+from .transcription_batch import (
+    confirmar as confirmar_transcripcion,
+    continuar as continuar_transcripcion,
+    devolver as devolver_transcripcion,
+    encolar as encolar_transcripcion,
+    tomar_lote as tomar_lote_transcripcion,
+)
 from .metrics import TRANSCRIPTION_REQUESTS, TRANSCRIPTION_LATENCY
 import os
-import wave
-import contextlib
 from .crypto_utils import encrypt_text
+import structlog
+
+logger = structlog.get_logger()
 
 
 def _extract_duration_seconds(path: str) -> float | None:
-    """Extracción simple de duración para WAV; otros formatos se omiten por ahora.
+    """Duración por sondeo de cabecera/índice (WAV, WebM, Ogg, MP3, M4A) sin decodificar.
     Devuelve None si no se puede determinar."""
-    if not path or not os.path.isfile(path):
-        return None
-    # Solo WAV rápido sin dependencias externas
-    if not path.lower().endswith(".wav"):
+    if not path:
         return None
+    return duracion_audio(path)
+
+
+def _guardar_transcripcion(s, response_id, transcript: str) -> None:
+    """Escribe la transcripción en la fila (y en su análisis) dentro de la sesión `s`."""
+    row = s.get(Response, response_id)
+    if row and row.analysis_json:
+        analysis = row.analysis_json.copy()
+        analysis["transcript"] = transcript
+        # Optional encryption path
+        if settings.enable_encryption:
+            row.analysis_json = None
+            row.analysis_json_enc = encrypt_text(json.dumps(analysis))
+            if not row.transcript or row.transcript == "<audio_pending_transcription>":
+                row.transcript = None
+                row.transcript_enc = encrypt_text(transcript)
+        else:
+            row.analysis_json = analysis
+            if not row.transcript or row.transcript == "<audio_pending_transcription>":
+                row.transcript = transcript
+        s.add(row)
+
+
+def _publicar_parcial(response_id):
+    """Callback de transcripción por trozos: cada trozo terminado como `transcription_partial`."""
+    def publicar(indice: int, total: int, inicio_sec: float, fin_sec: float, texto: str) -> None:
+        publish_event(
+            "transcription_partial",
+            response_id=response_id,
+            segment=indice,
+            segments=total,
+            start_sec=round(inicio_sec, 2),
+            end_sec=round(fin_sec, 2),
+            text=texto,
+        )
+    return publicar
+
+
+def _transcribir_payload(payload: dict) -> tuple[str | None, str | None]:
+    """(transcript, error) de un trabajo de transcripción; libera el buffer PCM."""
+    audio_path = payload.get("audio_path")
+    pcm_path = payload.get("pcm_path")
+    if not audio_path or not (get_storage().exists(audio_path) or os.path.isfile(audio_path)):
+        liberar_pcm(pcm_path)
+        return None, "audio_file_not_found"
+    start_time = datetime.now().timestamp()
+    TRANSCRIPTION_REQUESTS.labels("attempt").inc()
     try:
-        with contextlib.closing(wave.open(path, "rb")) as wf:
-            frames = wf.getnframes()
-            rate = wf.getframerate()
-            if rate > 0:
-                return frames / float(rate)
+        try:
+            transcript = transcribir_audio(
+                audio_path,
+                content_hash=payload.get("audio_sha256"),
+                pcm_path=pcm_path,
+                segmentos=payload.get("vad_segments"),
+                al_segmento=_publicar_parcial(payload.get("response_id")),
+            )
+        finally:
+            liberar_pcm(pcm_path)  # último consumidor del buffer compartido
+    except Exception as e:
+        try:
+            TRANSCRIPTION_REQUESTS.labels("error").inc()
+            TRANSCRIPTION_LATENCY.labels("error").observe(datetime.now().timestamp() - start_time)
+        except Exception:
+            pass
+        return None, str(e)
+    status = "success" if transcript else "failed"
+    try:
+        TRANSCRIPTION_REQUESTS.labels(status).inc()
+        TRANSCRIPTION_LATENCY.labels(status).observe(datetime.now().timestamp() - start_time)
     except Exception:
-        return None
-    return None
+        pass
+    return transcript, None if transcript else "transcription_failed"
 
 
 @celery_app.task(name="transcribe.audio")
 def transcribe_audio_task(payload: dict) -> dict:
     """Tarea dedicada para transcripción de audio."""
-    audio_path = payload.get("audio_path")
     response_id = payload.get("response_id")
-    
-    if not audio_path or not os.path.isfile(audio_path):
-        return {"error": "audio_file_not_found"}
-    
-    start_time = datetime.now().timestamp()
-    
+    transcript, error = _transcribir_payload(payload)
+    if not transcript:
+        return {"error": error}
+    # Actualizar response con transcript
+    if response_id:
+        try:
+            with session_scope() as s:
+                _guardar_transcripcion(s, response_id, transcript)
+        except Exception:
+            pass
+    # Emitir evento websocket (Redis pub/sub) de transcripción lista
+    publish_event("transcription_ready", response_id=response_id, status="COMPLETED")
+    return {"transcript": transcript, "status": "success"}
+
+
+@celery_app.task(
+    name="transcribe.audio_batch", time_limit=settings.transcription_batch_time_limit_sec
+)
+def transcribe_audio_batch_task() -> dict:
+    """Procesa un lote de transcripción (ver transcription_batch): un modelo residente para
+    todos los clips, una transacción por lote y los eventos publicados juntos. Los clips solo
+    se retiran de la cola tras confirmar la transacción."""
+    procesados = listos = 0
     try:
-        TRANSCRIPTION_REQUESTS.labels("attempt").inc()
-        transcript = transcribir_audio(audio_path)
-        
-        if transcript:
-            # Actualizar response con transcript
-            if response_id:
-                try:
-                    with session_scope() as s:
-                        row = s.get(Response, response_id)
-                        if row and row.analysis_json:
-                            analysis = row.analysis_json.copy()
-                            analysis["transcript"] = transcript
-                            # Optional encryption path
-                            if settings.enable_encryption:
-                                row.analysis_json = None
-                                row.analysis_json_enc = encrypt_text(json.dumps(analysis))
-                                if not row.transcript or row.transcript == "<audio_pending_transcription>":
-                                    row.transcript = None
-                                    row.transcript_enc = encrypt_text(transcript)
-                            else:
-                                row.analysis_json = analysis
-                                if not row.transcript or row.transcript == "<audio_pending_transcription>":
-                                    row.transcript = transcript
-                            s.add(row)
-                except Exception:
-                    pass
-            # Emitir evento websocket (Redis pub/sub) de transcripción lista
-            publish_event("transcription_ready", response_id=response_id, status="COMPLETED")
-            
-            try:
-                TRANSCRIPTION_REQUESTS.labels("success").inc()
-                TRANSCRIPTION_LATENCY.labels("success").observe(datetime.now().timestamp() - start_time)
-            except Exception:
-                pass
-            
-            return {"transcript": transcript, "status": "success"}
-        else:
+        crudos = tomar_lote_transcripcion()
+        lote = [(c, json.loads(c)) for c in crudos]
+        resultados = [(c, p.get("response_id"), _transcribir_payload(p)[0]) for c, p in lote]
+        hechos = [(c, rid, t) for c, rid, t in resultados if t and rid]
+        if hechos:
             try:
-                TRANSCRIPTION_REQUESTS.labels("failed").inc()
-                TRANSCRIPTION_LATENCY.labels("failed").observe(datetime.now().timestamp() - start_time)
-            except Exception:
-                pass
-            return {"error": "transcription_failed"}
-            
+                with session_scope() as s:
+                    for _, rid, transcript in hechos:
+                        _guardar_transcripcion(s, rid, transcript)
+            except Exception as e:
+                # Nada confirmado: se reencolan (el texto queda en la caché de transcripciones)
+                devolver_transcripcion([c for c, _, _ in hechos])
+                confirmar_transcripcion([c for c, rid, t in resultados if not (t and rid)])
+                TASK_COUNTER.labels("transcribe.audio_batch", "error").inc()
+                return {"error": str(e), "processed": len(resultados)}
+        confirmar_transcripcion(crudos)
+        publish_events(
+            [
+                ("transcription_ready", {"response_id": rid, "status": "COMPLETED"})
+                for _, rid, _ in hechos
+            ]
+        )
+        procesados, listos = len(resultados), len(hechos)
+        TASK_COUNTER.labels("transcribe.audio_batch", "success").inc()
     except Exception as e:
+        TASK_COUNTER.labels("transcribe.audio_batch", "error").inc()
+        return {"error": str(e), "processed": procesados}
+    finally:
+        continuar_transcripcion(_programar_lote_transcripcion)
+    return {"processed": procesados, "transcribed": listos}
+
+
+def _programar_lote_transcripcion(countdown: float) -> None:
+    transcribe_audio_batch_task.apply_async(countdown=countdown)
+
+
+def _encolar_transcripcion(payload: dict) -> None:
+    """Al lote de transcripción si hay Redis; si no, una tarea por clip."""
+    if not encolar_transcripcion(payload, _programar_lote_transcripcion):
+        transcribe_audio_task.delay(payload)
+
+
+def _extraer_features(
+    audio_path: str, audio_sha256: str | None, huella_ctx: dict | None = None
+) -> dict:
+    """Etapa de features de un clip (ver feature_batch.preparar_clip) con las prosódicas
+    por ventanas sobre las regiones de voz; si falla, librosa sobre el archivo."""
+    try:
+        resultado, pcm = preparar_clip(audio_path, audio_sha256, huella_ctx)
+        if pcm is not None:
+            feats = extraer_features_pcm(pcm, PCM_SAMPLE_RATE, segmentos=resultado["vad_segments"])
+            completar_clip(resultado, audio_sha256, feats)
+        return resultado
+    except Exception:
         try:
-            TRANSCRIPTION_REQUESTS.labels("error").inc()
-            TRANSCRIPTION_LATENCY.labels("error").observe(datetime.now().timestamp() - start_time)
+            feats = extraer_features_audio(audio_path)
         except Exception:
-            pass
+            feats = {}
+        return {"features": feats, "pcm_path": None, "vad_segments": None}
+
+
+@celery_app.task(name="features.extract", time_limit=settings.features_task_timeout_sec + 15)
+def extract_features_task(payload: dict) -> dict:
+    """Extracción de features (CPU) en su propia cola `features`, atendida por un pool de
+    procesos dimensionado a los núcleos físicos (`python -m backend.app.features_worker`)."""
+    try:
+        resultado = _extraer_features(
+            payload["audio_path"], payload.get("audio_sha256"), payload.get("huella")
+        )
+        TASK_COUNTER.labels("features.extract", "success").inc()
+        return resultado
+    except Exception:
+        TASK_COUNTER.labels("features.extract", "error").inc()
+        return {"features": {}, "pcm_path": None, "vad_segments": None}
+
+
+@celery_app.task(name="features.extract_batch", time_limit=settings.features_task_timeout_sec + 15)
+def extract_features_batch_task() -> dict:
+    """Procesa de una vez los clips cortos acumulados en la ventana (ver feature_batch)."""
+    try:
+        procesados = procesar_lote()
+        TASK_COUNTER.labels("features.extract_batch", "success").inc()
+        return {"processed": procesados}
+    except Exception as e:
+        TASK_COUNTER.labels("features.extract_batch", "error").inc()
         return {"error": str(e)}
 
 
+@celery_app.task(name="audio.canonical", time_limit=settings.features_task_timeout_sec)
+def canonical_audio_task(payload: dict) -> dict:
+    """Copia canónica Opus (codificación + verificación, CPU) en la cola `features`."""
+    try:
+        ref = almacenar_canonico(
+            payload["audio_path"],
+            payload.get("audio_sha256"),
+            response_id=payload.get("response_id"),
+        )
+        TASK_COUNTER.labels("audio.canonical", "success").inc()
+        return {"audio_path": ref}
+    except Exception:
+        TASK_COUNTER.labels("audio.canonical", "error").inc()
+        return {"audio_path": payload["audio_path"]}
+
+
+def _canonico_en_cola(audio_path: str, audio_sha256: str, response_id: int | None) -> str:
+    """Delega la copia canónica en `audio.canonical` (el pool del análisis es de hilos para
+    I/O) y devuelve la clave a usar. La tarea caduca si no empieza en `FEATURES_TASK_TIMEOUT_SEC`
+    y ese es también su límite de ejecución: pasada la espera ya no puede borrar el original
+    que usan las etapas siguientes. Sin cola se hace aquí mismo."""
+    if settings.features_task_enabled:
+        limite = settings.features_task_timeout_sec
+        try:
+            async_result = canonical_audio_task.apply_async(
+                (
+                    {
+                        "audio_path": audio_path,
+                        "audio_sha256": audio_sha256,
+                        "response_id": response_id,
+                    },
+                ),
+                expires=limite,
+            )
+        except Exception:
+            async_result = None
+        if async_result is not None:
+            try:
+                hecho = async_result.get(timeout=2 * limite + 5, disable_sync_subtasks=False)
+                return hecho["audio_path"]
+            except Exception as exc:
+                logger.warning(
+                    "canonical_task_unavailable", audio_path=audio_path, error=type(exc).__name__
+                )
+                TASK_COUNTER.labels("audio.canonical", "timeout").inc()
+                return audio_path
+    return almacenar_canonico(audio_path, audio_sha256, response_id=response_id)
+
+
+def _features_en_cola(audio_path: str, audio_sha256: str | None, duracion: float | None = None,
+                      huella_ctx: dict | None = None) -> dict:
+    """Delega en `features.extract` y espera el resultado como mucho
+    `FEATURES_TASK_TIMEOUT_SEC`; si vence, el análisis sigue sin features de audio.
+    Los clips cortos se agrupan en lotes (`features.extract_batch`) si hay Redis.
+    Si la cola no está disponible (o `FEATURES_TASK_ENABLED=0`) se extraen aquí mismo."""
+    if settings.features_task_enabled and admite_lote(duracion):
+        resultado = solicitar(
+            audio_path,
+            audio_sha256,
+            lambda countdown: extract_features_batch_task.apply_async(countdown=countdown),
+            huella_ctx=huella_ctx,
+        )
+        if resultado is not None:
+            return resultado
+    if settings.features_task_enabled:
+        try:
+            async_result = extract_features_task.apply_async(
+                ({"audio_path": audio_path, "audio_sha256": audio_sha256, "huella": huella_ctx},)
+            )
+        except Exception:
+            async_result = None
+        if async_result is not None:
+            try:
+                # La espera no bloquea el pool de features: son workers distintos
+                return async_result.get(
+                    timeout=settings.features_task_timeout_sec, disable_sync_subtasks=False
+                )
+            except Exception as exc:
+                logger.warning(
+                    "features_task_unavailable", audio_path=audio_path, error=type(exc).__name__
+                )
+                TASK_COUNTER.labels("features.extract", "timeout").inc()
+                return {"features": {}, "pcm_path": None, "vad_segments": None}
+    return _extraer_features(audio_path, audio_sha256, huella_ctx)
+
+
 @celery_app.task(name="analyze.text")
 def analyze_text_task(payload: dict) -> dict:
     """Tarea simulada de análisis de texto (mock)."""
     text = payload.get("text", "")
     audio_path = payload.get("audio_path")
+    audio_sha256 = payload.get("audio_sha256")
     audio_duration = _extract_duration_seconds(audio_path) if audio_path else None
     audio_features_extra = {}
-    normalized_path = audio_path
+    # Copia canónica Opus (AUDIO_STORAGE_CODEC=opus): las etapas siguientes decodifican bajo demanda
+    if requiere_canonico(audio_path, audio_sha256):
+        audio_path = _canonico_en_cola(audio_path, audio_sha256, payload.get("response_id"))
+    pcm_path = None
+    vad_segments = None
     # Emitir evento de inicio de análisis
     publish_event("analysis_started", response_id=payload.get("response_id"))
-    if audio_path and settings.enable_audio_features:
+    # Stream en directo (audio_stream): features calculadas de forma incremental al grabar
+    stream_feats = payload.get("stream_audio_features")
+    # Mismo audio ya analizado (reenvío idéntico): reutilizar features en vez de
+    # decodificar + librosa
+    previos: dict = {}
+    if audio_sha256 and settings.enable_audio_features and stream_feats is None:
         try:
-            normalized_path = normalizar_audio(audio_path)
-            # Comprimir si está habilitado
-            if settings.enable_audio_compression:
-                normalized_path = comprimir_audio(normalized_path)
-            feats = extraer_features_audio(normalized_path)
-            audio_features_extra.update(feats)
+            with session_scope() as s:
+                previos = buscar_derivados_previos(
+                    s, audio_sha256, exclude_id=payload.get("response_id")
+                )
         except Exception:
-            pass
-    transcript_added = False
-    if normalized_path and settings.enable_transcription:
+            previos = {}
+    reutilizado = None
+    por_huella: dict = {}
+    if stream_feats is not None:
+        audio_features_extra.update(stream_feats)
+        if audio_duration is None and stream_feats.get("duration_sec") is not None:
+            audio_duration = stream_feats["duration_sec"]
+    elif previos:
+        audio_features_extra.update(previos["audio_features"])
+        if audio_duration is None and previos.get("audio_duration_sec") is not None:
+            audio_duration = previos["audio_duration_sec"]
+    elif audio_path and settings.enable_audio_features:
+        # La huella (casi-duplicados) se calcula en la etapa de features, tras un miss de caché
+        huella_ctx = contexto_huella(payload.get("child_id"), text, payload.get("response_id"))
+        etapa = _features_en_cola(audio_path, audio_sha256, audio_duration, huella_ctx)
+        feats = etapa["features"]
+        pcm_path = etapa.get("pcm_path")
+        vad_segments = etapa.get("vad_segments")
+        por_huella = etapa
+        if etapa.get("near_duplicate_of") is not None:
+            # Casi-duplicado acústico (recodificado, recortado, otro dispositivo):
+            # reutilizar análisis
+            try:
+                with session_scope() as s:
+                    reutilizado = analisis_reutilizable(s, etapa["near_duplicate_of"])
+            except Exception:
+                reutilizado = None
+        if reutilizado is not None:
+            TASK_COUNTER.labels("analyze.text", "near_duplicate").inc()
+        else:
+            audio_features_extra.update(feats)
+        if audio_duration is None and feats.get("duration_sec") is not None:
+            audio_duration = feats["duration_sec"]
+    if (
+        audio_path
+        and settings.enable_transcription
+        and reutilizado is None
+        and "stream_transcript" not in payload
+    ):
         # Enviar a cola separada de transcripción (no bloquear análisis principal)
         try:
-            transcribe_audio_task.delay({
-                "audio_path": normalized_path,
-                "response_id": payload.get("response_id")
+            _encolar_transcripcion({
+                "audio_path": audio_path,
+                "response_id": payload.get("response_id"),
+                "audio_sha256": audio_sha256,
+                "pcm_path": pcm_path,
+                "vad_segments": vad_segments,
             })
         except Exception:
-            pass
+            liberar_pcm(pcm_path)
         # Publicar evento de progreso
+    else:
+        liberar_pcm(pcm_path)
     publish_event("transcription_queued", response_id=payload.get("response_id"))
+    # La serie por ventana se guarda con el análisis pero no se envía al modelo
+    serie_prosodica = audio_features_extra.pop("prosodic_series", None)
     response_id = payload.get("response_id")
     payload_child_id = payload.get("child_id")
     # Allow forcing intensity (test support) else mock default 0.2 / 0.9 for high text tokens
@@ -144,7 +416,14 @@ def analyze_text_task(payload: dict) -> dict:
     auto_intensity = 0.9 if "ALTO" in text.upper() else 0.2
     intensity_value = forced if isinstance(forced, (int, float)) else auto_intensity
     # Si Grok habilitado delegar (manteniendo compatibilidad con force_intensity para tests)
-    if forced is not None:  # forzamos stub para pruebas deterministas
+    if reutilizado is not None:
+        result = dict(reutilizado)
+        af = dict(result.get("audio_features") or {})
+        af.update(near_duplicate_of=por_huella["near_duplicate_of"],
+                  near_duplicate_similarity=por_huella["near_duplicate_similarity"])
+        result["audio_features"] = af
+        result["analysis_timestamp"] = datetime.now(timezone.utc).isoformat()
+    elif forced is not None:  # forzamos stub para pruebas deterministas
         result = {
             "primary_emotion": "Neutral" if not text else "Mixto",
             "intensity": intensity_value,
@@ -176,6 +455,8 @@ def analyze_text_task(payload: dict) -> dict:
             }
     # Normalizar contrato (rellenar campos faltantes)
     result = _ensure_contract(result)
+    if payload.get("stream_transcript"):
+        result["transcript"] = payload["stream_transcript"]
     # Mantener placeholder si no hay transcript inmediato
     if audio_path and not result.get("transcript"):
         result["transcript"] = "<audio_pending_transcription>"
@@ -184,6 +465,8 @@ def analyze_text_task(payload: dict) -> dict:
         if audio_duration is not None:
             af["duration_sec"] = audio_duration
         af.update(audio_features_extra)
+        if serie_prosodica:
+            af["prosodic_series"] = serie_prosodica
         result["audio_features"] = af
     task_name = "analyze.text"
     status_label = "success"
@@ -225,6 +508,18 @@ def analyze_text_task(payload: dict) -> dict:
                         except Exception:
                             pass
                     child_id = row.child_id
+                    if por_huella.get("fingerprint") and audio_duration is not None:
+                        try:
+                            registrar_huella(
+                                s,
+                                response_id,
+                                child_id,
+                                bytes.fromhex(por_huella["fingerprint"]),
+                                audio_duration,
+                                hash_texto(text),
+                            )
+                        except Exception:
+                            pass
                     # Evaluate alert rules (intensity_high, streak, avg) centrally
                     if child_id:
                         try:
@@ -268,15 +563,26 @@ def analyze_text_task(payload: dict) -> dict:
 def cleanup_old_audio_task() -> dict:
     """Tarea de limpieza periódica de archivos de audio antiguos."""
     try:
-        from .audio_utils import limpiar_archivos_antiguos
-        cleaned_count = limpiar_archivos_antiguos()
-        return {"status": "success", "cleaned_files": cleaned_count}
+        from .audio_pcm import limpiar_pcm_antiguos
+        from .audio_retention import aplicar_retencion
+        from .upload_sessions import expirar_sesiones
+        stats = aplicar_retencion()
+        return {
+            "status": "success",
+            "cleaned_files": stats["files"],
+            "reclaimed_bytes": stats["bytes"],
+            "expired_rows": stats["rows"],
+            "orphans": stats["orphan"],
+            "expired_uploads": expirar_sesiones(),
+            "stale_pcm_buffers": limpiar_pcm_antiguos(),
+        }
     except Exception as e:
         return {"status": "error", "error": str(e)}
 
 
-def enqueue_analysis_task(payload: dict) -> str:
-    res = analyze_text_task.delay(payload)
+def enqueue_analysis_task(payload: dict, task_id: str | None = None) -> str:
+    """Encola el análisis; con `task_id` la tarea usa ese id (ya guardado en la fila)."""
+    res = analyze_text_task.apply_async((payload,), task_id=task_id)
     return res.id
 
 
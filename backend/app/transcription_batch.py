@@ -0,0 +1,133 @@
+"""Lotes de transcripción.
+
+Con muchos clips cortos, una tarea `transcribe.audio` por clip paga en cada uno la cola,
+una sesión de BD y una publicación en Redis. Con `TRANSCRIPTION_BATCH_ENABLED=1` el
+análisis deja el trabajo en `emotrack:transcription:lote` y una única tarea
+`transcribe.audio_batch` (cola `transcription`) lo procesa: hasta
+`TRANSCRIPTION_BATCH_SIZE` clips por lote, esperando como mucho
+`TRANSCRIPTION_BATCH_WINDOW_MS` desde el primero. Los clips comparten el modelo residente
+(`whisper_registry`), las transcripciones se guardan en una sola transacción y los eventos
+`transcription_ready` se publican juntos.
+
+Mismo protocolo que `feature_batch` (lista + marca de líder con caducidad + countdown),
+pero el análisis no espera el resultado. Sin Redis, `encolar` devuelve False y se usa la
+tarea por clip.
+
+Cada invocación procesa un solo lote: `tomar_lote` mueve los clips con LMOVE a
+`emotrack:transcription:lote:procesando` y solo se retiran (`confirmar`) tras guardar la
+transacción; si falla vuelven a la cola (`devolver`, hasta `MAX_INTENTOS`). Si quedan clips
+pendientes la tarea programa la siguiente (`continuar`). Una tarea que muere a mitad (time
+limit, worker caído) deja sus clips en la lista de proceso; la concesión
+`...:procesando:concesion` caduca con el time limit y la siguiente tarea los recupera.
+"""
+from __future__ import annotations
+
+import json
+from typing import Callable, List
+
+from .settings import settings
+
+LISTA = "emotrack:transcription:lote"
+LIDER = "emotrack:transcription:lote:lider"
+PROCESANDO = "emotrack:transcription:lote:procesando"
+CONCESION = PROCESANDO + ":concesion"
+MAX_INTENTOS = 3
+
+_redis_client = None
+
+
+def _get_client():  # lazy init
+    global _redis_client
+    if _redis_client is not None:
+        return _redis_client
+    try:
+        import redis
+
+        _redis_client = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+    except Exception:
+        _redis_client = None
+    return _redis_client
+
+
+def encolar(payload: dict, programar: Callable[[float], None]) -> bool:
+    """Añade el clip al lote en curso; el primero programa la tarea de lote con
+    `programar(countdown_sec)`. False si el lote no está disponible."""
+    if not settings.transcription_batch_enabled:
+        return False
+    client = _get_client()
+    if client is None:
+        return False
+    try:
+        client.rpush(LISTA, json.dumps(payload))
+        if client.set(LIDER, "1", nx=True, px=int(settings.transcription_batch_window_ms * 4)):
+            programar(settings.transcription_batch_window_ms / 1000.0)
+    except Exception:
+        return False
+    return True
+
+
+def _recuperar(client) -> None:
+    """Devuelve a la cola los clips de tareas muertas (sin concesión vigente)."""
+    if client.exists(CONCESION):
+        return
+    while client.lmove(PROCESANDO, LISTA, "RIGHT", "LEFT") is not None:
+        pass
+
+
+def tomar_lote() -> List[str]:
+    """Mueve hasta `TRANSCRIPTION_BATCH_SIZE` clips a la lista de proceso. Devuelve los
+    elementos crudos (para `confirmar` / `devolver`). La marca de líder se borra antes: lo que
+    llegue durante el proceso programa otro lote."""
+    client = _get_client()
+    if client is None:
+        return []
+    client.delete(LIDER)
+    _recuperar(client)
+    client.set(CONCESION, "1", px=int(settings.transcription_batch_time_limit_sec * 1000))
+    pipe = client.pipeline(transaction=False)
+    for _ in range(max(1, settings.transcription_batch_size)):
+        pipe.lmove(LISTA, PROCESANDO, "LEFT", "RIGHT")
+    return [c for c in pipe.execute() if c is not None]
+
+
+def confirmar(crudos: List[str]) -> None:
+    """Retira de la lista de proceso los clips ya guardados (o descartados)."""
+    client = _get_client()
+    if client is None or not crudos:
+        return
+    pipe = client.pipeline(transaction=False)
+    for crudo in crudos:
+        pipe.lrem(PROCESANDO, 1, crudo)
+    pipe.execute()
+
+
+def devolver(crudos: List[str]) -> None:
+    """Reencola clips cuyo guardado falló; tras `MAX_INTENTOS` se descartan."""
+    client = _get_client()
+    if client is None or not crudos:
+        return
+    pipe = client.pipeline(transaction=False)
+    for crudo in crudos:
+        pipe.lrem(PROCESANDO, 1, crudo)
+        payload = json.loads(crudo)
+        payload["intentos"] = int(payload.get("intentos") or 0) + 1
+        if payload["intentos"] < MAX_INTENTOS:
+            pipe.rpush(LISTA, json.dumps(payload))
+    pipe.execute()
+
+
+def continuar(programar: Callable[[float], None]) -> None:
+    """Programa otro lote si quedan clips y nadie lo ha hecho ya."""
+    client = _get_client()
+    if client is None:
+        return
+    try:
+        if client.llen(LISTA) and client.set(
+            LIDER, "1", nx=True, px=int(settings.transcription_batch_window_ms * 4)
+        ):
+            programar(0)
+    except Exception:
+        pass
+
+
+__all__ = ["encolar", "tomar_lote", "confirmar", "devolver", "continuar"]
@@ -0,0 +1,358 @@
+"""Caché de transcripciones.
+
+Antes era un JSON por clave en `transcription_cache/` del almacén: sin límite de tamaño,
+sin caducidad ni métricas, y la clave de una ruta sin hash obligaba a leer el archivo
+entero en memoria. Ahora:
+ - clave `<sha256>:<modelo>:<compute_type>:b<beam_size>:<idioma>` con los parámetros
+   efectivos de `whisper_registry`; sin hash de ingesta, el sha256 se calcula leyendo el
+   archivo por bloques (`sha256_archivo`);
+ - caducidad por modelo: `TRANSCRIPTION_CACHE_TTL_DAYS` (0 = sin caducidad) salvo lo que
+   diga `TRANSCRIPTION_CACHE_TTL_BY_MODEL` (`large-v3=90,base=14`); cambiar de modelo, de
+   compute_type o de beam_size no reutiliza entradas: envejecen y se expulsan;
+ - límite en bytes de texto (`TRANSCRIPTION_CACHE_MAX_MB`) con expulsión LRU.
+
+Backends (`TRANSCRIPTION_CACHE_BACKEND`):
+ - `sqlite` (por defecto): una tabla indexada en `TRANSCRIPTION_CACHE_PATH` (WAL), una
+   conexión por hilo y proceso; el total de bytes lo mantienen triggers en
+   `transcripts_meta`, así que comprobar el límite no recorre la tabla;
+ - `redis`: valores con EX, sorted sets de último acceso y de caducidad y un set de claves
+   por sha256 (borrado por retención), compartido entre hosts (p.ej. con
+   `STORAGE_BACKEND=s3`); si Redis no responde se usa `sqlite`;
+ - `off` (o `TRANSCRIPTION_CACHE_ENABLED=0`): sin caché.
+Métricas: `emotrack_transcription_cache_requests_total{backend,result}`,
+`emotrack_transcription_cache_evictions_total{backend,reason}` (lru|ttl) y
+`emotrack_transcription_cache_bytes`. Un fallo del backend cuenta como miss.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .metrics import (
+    TRANSCRIPTION_CACHE_BYTES,
+    TRANSCRIPTION_CACHE_EVICTIONS,
+    TRANSCRIPTION_CACHE_REQUESTS,
+)
+from .settings import settings
+
+REDIS_PREFIX = "emotrack:transcripts:"
+REDIS_LRU = REDIS_PREFIX + "lru"
+REDIS_EXP = REDIS_PREFIX + "exp"
+REDIS_SIZES = REDIS_PREFIX + "sizes"
+REDIS_BYTES = REDIS_PREFIX + "bytes"
+
+
+def _redis_sha(sha256: str) -> str:
+    """Set con las claves de un audio (borrado por retención sin recorrer el LRU)."""
+    return REDIS_PREFIX + "sha:" + sha256
+
+
+def sha256_archivo(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def clave_transcripcion(sha256: str, model: str, language: str) -> str:
+    """compute_type y beam_size son los del modelo que realmente corre (perfil de autotune
+    incluido, ver whisper_registry) y Whisper solo recibe la voz que selecciona el VAD: todo
+    ello cambia el texto transcrito."""
+    from .audio_vad import firma as firma_vad
+    from .whisper_registry import beam_size, clave_modelo
+
+    compute_type = clave_modelo(model)[1]
+    return f"{sha256}:{model}:{compute_type}:b{beam_size()}:{firma_vad()}:{language}"
+
+
+def _ttls_por_modelo() -> Dict[str, float]:
+    ttls = {}
+    for par in settings.transcription_cache_ttl_by_model.split(","):
+        modelo, _, dias = par.partition("=")
+        try:
+            ttls[modelo.strip()] = float(dias)
+        except ValueError:
+            continue
+    return ttls
+
+
+def ttl_segundos(model: str) -> Optional[float]:
+    """Caducidad de las entradas del modelo; None = sin caducidad."""
+    dias = _ttls_por_modelo().get(model, settings.transcription_cache_ttl_days)
+    return dias * 86400 if dias > 0 else None
+
+
+class SQLiteTranscriptionCache:
+    name = "sqlite"
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por hilo; tras un fork (pool prefork) se abre otra
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts (key TEXT PRIMARY KEY, "
+                "sha256 TEXT NOT NULL, transcript TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_transcripts_accessed ON transcripts (accessed_at)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_transcripts_expires ON transcripts (expires_at)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_transcripts_sha ON transcripts (sha256)")
+            # Total de bytes mantenido por triggers: la expulsión no recorre la tabla en cada put
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts_meta "
+                "(k TEXT PRIMARY KEY, v INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO transcripts_meta (k, v) "
+                "SELECT 'bytes', COALESCE(SUM(size), 0) FROM transcripts"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS tr_transcripts_ins AFTER INSERT ON transcripts BEGIN "
+                "UPDATE transcripts_meta SET v = v + NEW.size WHERE k = 'bytes'; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS tr_transcripts_del AFTER DELETE ON transcripts BEGIN "
+                "UPDATE transcripts_meta SET v = v - OLD.size WHERE k = 'bytes'; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS tr_transcripts_upd "
+                "AFTER UPDATE OF size ON transcripts BEGIN "
+                "UPDATE transcripts_meta SET v = v - OLD.size + NEW.size WHERE k = 'bytes'; END"
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._conn()
+        fila = conn.execute(
+            "SELECT transcript, expires_at FROM transcripts WHERE key = ?", (key,)
+        ).fetchone()
+        if fila is None:
+            return None
+        ahora = time.time()
+        if fila[1] is not None and fila[1] <= ahora:
+            conn.execute("DELETE FROM transcripts WHERE key = ?", (key,))
+            TRANSCRIPTION_CACHE_EVICTIONS.labels(self.name, "ttl").inc()
+            return None
+        conn.execute("UPDATE transcripts SET accessed_at = ? WHERE key = ?", (ahora, key))
+        return fila[0]
+
+    def put(self, key: str, transcript: str, ttl: Optional[float]) -> None:
+        ahora = time.time()
+        conn = self._conn()
+        # UPSERT (no REPLACE): el borrado implícito de REPLACE no dispara los triggers
+        conn.execute(
+            "INSERT INTO transcripts (key, sha256, transcript, size, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+            "transcript = excluded.transcript, size = excluded.size, "
+            "expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+            (
+                key,
+                key.split(":", 1)[0],
+                transcript,
+                len(transcript.encode("utf-8")),
+                ahora + ttl if ttl else None,
+                ahora,
+            ),
+        )
+        self._expulsar(ahora)
+
+    def _expulsar(self, ahora: float) -> None:
+        conn = self._conn()
+        caducadas = conn.execute(
+            "DELETE FROM transcripts WHERE expires_at IS NOT NULL AND expires_at <= ?", (ahora,)
+        ).rowcount
+        if caducadas > 0:
+            TRANSCRIPTION_CACHE_EVICTIONS.labels(self.name, "ttl").inc(caducadas)
+        total = int(conn.execute("SELECT v FROM transcripts_meta WHERE k = 'bytes'").fetchone()[0])
+        exceso = total - self.max_bytes
+        while exceso > 0:
+            filas = conn.execute(
+                "SELECT key, size FROM transcripts ORDER BY accessed_at LIMIT 256"
+            ).fetchall()
+            if not filas:
+                break
+            viejas = []
+            for key, size in filas:
+                viejas.append((key,))
+                exceso -= size
+                total -= size
+                if exceso <= 0:
+                    break
+            conn.executemany("DELETE FROM transcripts WHERE key = ?", viejas)
+            TRANSCRIPTION_CACHE_EVICTIONS.labels(self.name, "lru").inc(len(viejas))
+        TRANSCRIPTION_CACHE_BYTES.labels(self.name).set(total)
+
+    def borrar(self, sha256: str) -> None:
+        self._conn().execute("DELETE FROM transcripts WHERE sha256 = ?", (sha256,))
+
+
+class RedisTranscriptionCache:
+    name = "redis"
+
+    def __init__(self, client, max_bytes: int):
+        self.client = client
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> Optional[str]:
+        valor = self.client.get(REDIS_PREFIX + "v:" + key)
+        if valor is None:
+            return None
+        self.client.zadd(REDIS_LRU, {key: time.time()})
+        return valor
+
+    def put(self, key: str, transcript: str, ttl: Optional[float]) -> None:
+        ahora = time.time()
+        size = len(transcript.encode("utf-8"))
+        anterior = int(self.client.hget(REDIS_SIZES, key) or 0)
+        pipe = self.client.pipeline()
+        pipe.set(REDIS_PREFIX + "v:" + key, transcript, ex=int(ttl) if ttl else None)
+        pipe.zadd(REDIS_LRU, {key: ahora})
+        if ttl:
+            pipe.zadd(REDIS_EXP, {key: ahora + ttl})
+        else:
+            pipe.zrem(REDIS_EXP, key)
+        pipe.hset(REDIS_SIZES, key, size)
+        pipe.incrby(REDIS_BYTES, size - anterior)
+        pipe.sadd(_redis_sha(key.split(":", 1)[0]), key)
+        pipe.execute()
+        self._expulsar(ahora)
+
+    def _quitar(self, keys: List[str]) -> None:
+        if not keys:
+            return
+        sizes = self.client.hmget(REDIS_SIZES, keys)
+        pipe = self.client.pipeline()
+        pipe.delete(*[REDIS_PREFIX + "v:" + k for k in keys])
+        pipe.zrem(REDIS_LRU, *keys)
+        pipe.zrem(REDIS_EXP, *keys)
+        pipe.hdel(REDIS_SIZES, *keys)
+        pipe.decrby(REDIS_BYTES, sum(int(s or 0) for s in sizes))
+        for key in keys:
+            pipe.srem(_redis_sha(key.split(":", 1)[0]), key)
+        pipe.execute()
+
+    def _expulsar(self, ahora: float) -> None:
+        # Las caducadas ya no están (EX); solo falta descontar sus bytes
+        caducadas = self.client.zrangebyscore(REDIS_EXP, "-inf", ahora)
+        if caducadas:
+            self._quitar(caducadas)
+            TRANSCRIPTION_CACHE_EVICTIONS.labels(self.name, "ttl").inc(len(caducadas))
+        total = int(self.client.get(REDIS_BYTES) or 0)
+        while total > self.max_bytes:
+            viejas = self.client.zrange(REDIS_LRU, 0, 63)
+            if not viejas:
+                break
+            self._quitar(viejas)
+            TRANSCRIPTION_CACHE_EVICTIONS.labels(self.name, "lru").inc(len(viejas))
+            total = int(self.client.get(REDIS_BYTES) or 0)
+        TRANSCRIPTION_CACHE_BYTES.labels(self.name).set(total)
+
+    def borrar(self, sha256: str) -> None:
+        self._quitar(list(self.client.smembers(_redis_sha(sha256))))
+        self.client.delete(_redis_sha(sha256))
+
+
+_cache = None
+
+
+def _sqlite() -> SQLiteTranscriptionCache:
+    return SQLiteTranscriptionCache(
+        settings.transcription_cache_path, settings.transcription_cache_max_mb * 1024 * 1024
+    )
+
+
+def get_transcription_cache():
+    """Backend configurado (None si la caché está desactivada)."""
+    global _cache
+    if _cache is None:
+        backend = settings.transcription_cache_backend.lower()
+        if not settings.transcription_cache_enabled or backend == "off":
+            _cache = False
+        elif backend == "redis":
+            try:
+                import redis
+
+                client = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+                client.ping()
+                _cache = RedisTranscriptionCache(
+                    client, settings.transcription_cache_max_mb * 1024 * 1024
+                )
+            except Exception:
+                _cache = _sqlite()
+        else:
+            _cache = _sqlite()
+    return _cache or None
+
+
+def obtener(key: str) -> Optional[str]:
+    cache = get_transcription_cache()
+    if cache is None:
+        return None
+    try:
+        transcript = cache.get(key)
+    except Exception:
+        TRANSCRIPTION_CACHE_REQUESTS.labels(cache.name, "error").inc()
+        return None
+    TRANSCRIPTION_CACHE_REQUESTS.labels(cache.name, "hit" if transcript else "miss").inc()
+    return transcript
+
+
+def guardar(key: str, model: str, transcript: str) -> None:
+    cache = get_transcription_cache()
+    if cache is None or not transcript:
+        return
+    try:
+        cache.put(key, transcript, ttl_segundos(model))
+    except Exception:
+        pass
+
+
+def borrar(sha256: Optional[str]) -> None:
+    """Elimina las transcripciones de un audio (retención: se borra con el blob)."""
+    cache = get_transcription_cache()
+    if cache is None or not sha256:
+        return
+    try:
+        cache.borrar(sha256)
+    except Exception:
+        pass
+
+
+__all__ = [
+    "SQLiteTranscriptionCache",
+    "RedisTranscriptionCache",
+    "borrar",
+    "clave_transcripcion",
+    "get_transcription_cache",
+    "guardar",
+    "obtener",
+    "sha256_archivo",
+    "ttl_segundos",
+]
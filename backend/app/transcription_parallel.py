@@ -0,0 +1,114 @@
+"""Transcripción de grabaciones largas por trozos en paralelo.
+
+Una grabación de varios minutos se transcribía en una sola llamada a Whisper (un núcleo)
+y no se publicaba nada hasta el final. Desde `TRANSCRIPTION_PARALLEL_MIN_SEC` de voz:
+ - las regiones del VAD se agrupan en trozos de ~`TRANSCRIPTION_SEGMENT_SEC` (la ventana
+   de Whisper), cortando solo entre regiones; una región más larga se parte en el frame de
+   menor energía cerca del corte;
+ - los trozos se transcriben a la vez en `TRANSCRIPTION_PARALLEL_WORKERS` hilos (0 = núcleos
+   físicos) sobre el modelo residente: CTranslate2 libera el GIL y el modelo se carga con
+   el mismo número de réplicas (`num_workers`), que comparten los pesos;
+ - cada trozo terminado se notifica con `al_segmento` (la tarea publica
+   `transcription_partial`) y el texto final se une en orden.
+Con varias réplicas conviene `TRANSCRIPTION_CPU_THREADS` bajo (1-2) para no sobresuscribir.
+"""
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
+
+from .settings import settings
+
+Segmento = Tuple[int, int]
+Trozo = List[Segmento]
+
+
+def trabajadores() -> int:
+    """Transcripciones simultáneas por proceso (réplicas del modelo)."""
+    if not settings.transcription_parallel_enabled:
+        return 1
+    from .whisper_registry import perfil
+
+    if perfil().get("num_workers"):
+        return int(perfil()["num_workers"])
+    if settings.transcription_parallel_workers > 0:
+        return settings.transcription_parallel_workers
+    from .features_worker import nucleos_fisicos
+
+    return nucleos_fisicos()
+
+
+def _punto_de_corte(y, inicio: int, fin: int, sr: int) -> int:
+    """Frame de 20 ms de menor energía en el último segundo antes de `fin`."""
+    import numpy as np
+
+    frame = max(1, sr // 50)
+    desde = max(inicio + frame, fin - sr)
+    tramo = np.asarray(y[desde:fin], dtype=np.float32)
+    n = len(tramo) // frame
+    if n < 2:
+        return fin
+    energia = (tramo[: n * frame].reshape(n, frame) ** 2).sum(axis=1)
+    return desde + int(np.argmin(energia)) * frame
+
+
+def planificar(y, segmentos: List[Segmento], sr: int = 16000,
+               objetivo_sec: Optional[float] = None) -> List[Trozo]:
+    """Agrupa las regiones de voz en trozos consecutivos de ~`objetivo_sec` de voz."""
+    objetivo = int((objetivo_sec or settings.transcription_segment_sec) * sr)
+    regiones: List[Segmento] = []
+    for inicio, fin in segmentos:
+        # Regiones más largas que el objetivo: partir en pausas cortas
+        while fin - inicio > objetivo:
+            corte = _punto_de_corte(y, inicio, inicio + objetivo, sr)
+            regiones.append((inicio, corte))
+            inicio = corte
+        if fin > inicio:
+            regiones.append((inicio, fin))
+    trozos: List[Trozo] = []
+    acumulado = 0
+    for region in regiones:
+        largo = region[1] - region[0]
+        if trozos and acumulado + largo <= objetivo:
+            trozos[-1].append(region)
+            acumulado += largo
+        else:
+            trozos.append([region])
+            acumulado = largo
+    return trozos
+
+
+def transcribir_paralelo(
+    y,
+    trozos: List[Trozo],
+    transcribir: Callable[[object], Optional[str]],
+    sr: int = 16000,
+    al_segmento: Optional[Callable[[int, int, float, float, str], None]] = None,
+) -> Optional[str]:
+    """Transcribe cada trozo (voz concatenada) con `transcribir` en paralelo y une el texto
+    en orden. `al_segmento(indice, total, inicio_sec, fin_sec, texto)` se llama al terminar
+    cada trozo con texto, en el orden en que terminan."""
+    from .audio_vad import audio_voz
+
+    textos: List[Optional[str]] = [None] * len(trozos)
+    with ThreadPoolExecutor(max_workers=max(1, min(trabajadores(), len(trozos)))) as pool:
+        futuros = {
+            pool.submit(transcribir, audio_voz(y, trozo)): i for i, trozo in enumerate(trozos)
+        }
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            try:
+                textos[i] = futuro.result()
+            except Exception:
+                textos[i] = None
+            if textos[i] and al_segmento is not None:
+                try:
+                    al_segmento(
+                        i, len(trozos), trozos[i][0][0] / sr, trozos[i][-1][1] / sr, textos[i]
+                    )
+                except Exception:
+                    pass
+    return " ".join(t for t in textos if t).strip() or None
+
+
+__all__ = ["trabajadores", "planificar", "transcribir_paralelo"]
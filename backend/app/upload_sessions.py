@@ -0,0 +1,333 @@
+"""Subidas reanudables de audio (`/api/uploads`).
+
+Protocolo:
+ 1. `POST /api/uploads` crea la sesión (tamaño total y campos del formulario).
+ 2. `PATCH /api/uploads/{id}` con `Upload-Offset` añade una parte; el cuerpo se escribe por
+    bloques a un temporal y se sube al almacén como `upload_parts/<id>/<offset>`. Si la
+    conexión se corta a mitad de parte se conservan los bytes recibidos.
+ 3. `GET /api/uploads/{id}` devuelve el offset confirmado para reanudar.
+ 4. `POST /api/uploads/{id}/finalize` lee las partes en streaming a través de la ingesta
+    normal (`ingerir_audio_streaming`: magic bytes, duración, hash, almacén por contenido)
+    y crea la respuesta igual que `/api/submit-responses`. Es idempotente: la sesión pasa a
+    `finalizing` con un UPDATE condicional (solo una petición concurrente ensambla el audio,
+    las demás reciben 409 `upload_finalizing`) y, al crear la respuesta, a `finalized` con su
+    `response_id`/`task_id`; un reintento devuelve esa misma respuesta. La reclamación es una
+    concesión (`claimed_at`, `UPLOAD_FINALIZE_LEASE_SEC`): si el proceso que finalizaba cae,
+    pasado ese tiempo otro finalize la retoma.
+
+Las sesiones abandonadas caducan (`UPLOAD_SESSION_TTL_HOURS`) y sus partes se borran en
+`expirar_sesiones` (tarea `cleanup.audio`); las finalizadas se conservan sin partes hasta
+caducar, para responder a reintentos.
+"""
+from __future__ import annotations
+
+import os
+import secrets
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Iterator, Optional
+
+from sqlalchemy import and_, or_, update
+from sqlmodel import select
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+from .audio_ingest import AudioIngestado, ingerir_audio_streaming
+from .audio_utils import AudioValidationError
+from .db import session_scope
+from .models import UploadSession
+from .settings import settings
+from .storage import get_storage
+
+ABIERTA = "open"
+FINALIZANDO = "finalizing"
+FINALIZADA = "finalized"
+
+
+class UploadSessionError(Exception):
+    """Error de protocolo; `status_code` indica la respuesta HTTP."""
+
+    def __init__(self, status_code: int, detail: str, offset: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.offset = offset
+
+
+def _clave_parte(upload_id: str, offset: int) -> str:
+    return f"upload_parts/{upload_id}/{offset:012d}"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _vigente(sesion: Optional[UploadSession]) -> UploadSession:
+    if sesion is None:
+        raise UploadSessionError(404, "upload_not_found")
+    expires = sesion.expires_at
+    if expires.tzinfo is None:  # SQLite no conserva la zona horaria
+        expires = expires.replace(tzinfo=timezone.utc)
+    if expires <= _now():
+        raise UploadSessionError(410, "upload_expired")
+    return sesion
+
+
+def crear_sesion(session, filename: str, total_size: int, **campos) -> UploadSession:
+    max_size = int(settings.max_audio_file_size_mb * 1024 * 1024)
+    if total_size <= 0:
+        raise UploadSessionError(400, "upload_size_invalid")
+    if total_size > max_size:
+        raise UploadSessionError(413, f"Archivo muy grande: >{settings.max_audio_file_size_mb}MB")
+    sesion = UploadSession(
+        id=secrets.token_urlsafe(24),
+        filename=filename or "audio",
+        total_size=total_size,
+        expires_at=_now() + timedelta(hours=settings.upload_session_ttl_hours),
+        **campos,
+    )
+    session.add(sesion)
+    session.flush()
+    return sesion
+
+
+def obtener_sesion(upload_id: str) -> UploadSession:
+    with session_scope() as s:
+        return _vigente(s.get(UploadSession, upload_id))
+
+
+def _descartar_tmp(fh, tmp_path: str) -> None:
+    try:
+        fh.close()
+    except Exception:
+        pass
+    try:
+        os.unlink(tmp_path)
+    except Exception:
+        pass
+
+
+async def recibir_parte(upload_id: str, offset: int, body: AsyncIterator[bytes]) -> int:
+    """Escribe una parte que empieza en `offset`. Devuelve el nuevo offset confirmado."""
+    sesion = obtener_sesion(upload_id)
+    if sesion.status != ABIERTA:
+        raise UploadSessionError(409, "upload_finalized", offset=sesion.offset)
+    if offset != sesion.offset:
+        raise UploadSessionError(409, "offset_mismatch", offset=sesion.offset)
+    limite = min(sesion.total_size - offset, int(settings.upload_chunk_max_mb * 1024 * 1024))
+    os.makedirs(settings.storage_tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".part_", dir=settings.storage_tmp_dir)
+    fh = os.fdopen(fd, "wb")
+    recibidos = 0
+    try:
+        try:
+            async for chunk in body:
+                recibidos += len(chunk)
+                if recibidos > limite:
+                    raise UploadSessionError(413, "chunk_too_large", offset=sesion.offset)
+                await run_in_threadpool(fh.write, chunk)
+        except ClientDisconnect:
+            pass  # conexión cortada: se confirma lo recibido y el cliente reanuda desde ahí
+        await run_in_threadpool(fh.close)
+        if recibidos == 0:
+            _descartar_tmp(fh, tmp_path)
+            return sesion.offset
+        key = _clave_parte(upload_id, offset)
+        await run_in_threadpool(get_storage().put_file, key, tmp_path, True)
+    except BaseException:
+        _descartar_tmp(fh, tmp_path)
+        raise
+    nuevo_offset = offset + recibidos
+    with session_scope() as s:
+        # Confirmación optimista: otra petición pudo avanzar el offset mientras tanto
+        result = s.exec(
+            update(UploadSession)
+            .where(
+                UploadSession.id == upload_id,
+                UploadSession.offset == offset,
+                UploadSession.status == ABIERTA,
+            )
+            .values(
+                offset=nuevo_offset,
+                parts=list(sesion.parts or []) + [[offset, recibidos]],
+                expires_at=_now() + timedelta(hours=settings.upload_session_ttl_hours),
+            )
+        )
+        confirmado = bool(result.rowcount)
+    if not confirmado:
+        get_storage().delete(_clave_parte(upload_id, offset))
+        actual = obtener_sesion(upload_id)
+        raise UploadSessionError(409, "offset_mismatch", offset=actual.offset)
+    return nuevo_offset
+
+
+class _LectorPartes:
+    """Expone las partes almacenadas como un upload (`read(n)` asíncrono) para la ingesta."""
+
+    def __init__(self, sesion: UploadSession):
+        self.filename = sesion.filename
+        self.size = sesion.total_size
+        self._chunks = self._iterar(list(sesion.parts or []), sesion.id)
+        self._buffer = b""
+
+    @staticmethod
+    def _iterar(parts: list, upload_id: str) -> Iterator[bytes]:
+        storage = get_storage()
+        for offset, length in parts:
+            yield from storage.iter_range(_clave_parte(upload_id, offset), 0, length)
+
+    def _siguiente(self) -> bytes:
+        return next(self._chunks, b"")
+
+    async def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = await run_in_threadpool(self._siguiente)
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        out, self._buffer = self._buffer[:size], self._buffer[size:]
+        return out
+
+
+def borrar_partes(upload_id: str, parts: list) -> None:
+    storage = get_storage()
+    for offset, _length in parts or []:
+        try:
+            storage.delete(_clave_parte(upload_id, offset))
+        except Exception:
+            pass
+
+
+def _borrar_sesion(upload_id: str) -> None:
+    with session_scope() as s:
+        sesion = s.get(UploadSession, upload_id)
+        if sesion is None:
+            return
+        borrar_partes(upload_id, sesion.parts)
+        s.delete(sesion)
+
+
+def _reclamar(upload_id: str) -> Optional[datetime]:
+    """open -> finalizing, o retoma una reclamación con la concesión vencida (proceso caído).
+    Devuelve el `claimed_at` de esta reclamación, o None si otra petición la tiene."""
+    ahora = _now()
+    vencida = ahora - timedelta(seconds=settings.upload_finalize_lease_sec)
+    with session_scope() as s:
+        result = s.exec(
+            update(UploadSession)
+            .where(
+                UploadSession.id == upload_id,
+                UploadSession.offset == UploadSession.total_size,
+                or_(
+                    UploadSession.status == ABIERTA,
+                    and_(
+                        UploadSession.status == FINALIZANDO,
+                        or_(
+                            UploadSession.claimed_at.is_(None), UploadSession.claimed_at <= vencida
+                        ),
+                    ),
+                ),
+            )
+            .values(status=FINALIZANDO, claimed_at=ahora)
+        )
+        return ahora if result.rowcount else None
+
+
+def liberar(upload_id: str) -> None:
+    """Devuelve a `open` una sesión reclamada cuyo finalize falló (las partes siguen)."""
+    with session_scope() as s:
+        s.exec(
+            update(UploadSession)
+            .where(UploadSession.id == upload_id, UploadSession.status == FINALIZANDO)
+            .values(status=ABIERTA, claimed_at=None)
+        )
+
+
+async def finalizar(upload_id: str) -> tuple[UploadSession, Optional[AudioIngestado]]:
+    """Reclama la sesión y ensambla y valida el audio.
+
+    Si la sesión ya estaba finalizada devuelve `(sesion, None)` con su `response_id`. Con audio
+    inválido se elimina la sesión; con éxito queda en `finalizing` hasta `marcar_finalizada`,
+    con `sesion.claimed_at` identificando esta reclamación.
+    """
+    sesion = obtener_sesion(upload_id)
+    if sesion.status == FINALIZADA:
+        return sesion, None
+    if sesion.offset != sesion.total_size:
+        raise UploadSessionError(409, "upload_incomplete", offset=sesion.offset)
+    # UPDATE condicional: solo una petición concurrente pasa de open a finalizing
+    reclamada = await run_in_threadpool(_reclamar, upload_id)
+    if reclamada is None:
+        actual = obtener_sesion(upload_id)
+        if actual.status == FINALIZADA:
+            return actual, None
+        raise UploadSessionError(409, "upload_finalizing", offset=actual.offset)
+    sesion.claimed_at = reclamada
+    try:
+        ingested = await ingerir_audio_streaming(_LectorPartes(sesion))
+    except AudioValidationError:
+        await run_in_threadpool(_borrar_sesion, upload_id)
+        raise
+    except BaseException:
+        await run_in_threadpool(liberar, upload_id)
+        raise
+    return sesion, ingested
+
+
+def marcar_finalizada(
+    session, sesion: UploadSession, response_id: int, task_id: Optional[str]
+) -> None:
+    """Guarda la respuesta creada en la misma transacción que la fila Response.
+    Lanza 409 `upload_finalizing` si otra petición retomó la reclamación (concesión vencida)."""
+    result = session.exec(
+        update(UploadSession)
+        .where(
+            UploadSession.id == sesion.id,
+            UploadSession.status == FINALIZANDO,
+            UploadSession.claimed_at == sesion.claimed_at,
+        )
+        .values(
+            status=FINALIZADA,
+            response_id=response_id,
+            task_id=task_id,
+            expires_at=_now() + timedelta(hours=settings.upload_session_ttl_hours),
+        )
+    )
+    if not result.rowcount:
+        raise UploadSessionError(409, "upload_finalizing", offset=sesion.offset)
+
+
+def deshacer_finalizada(session, upload_id: str) -> None:
+    """finalized -> finalizing cuando el análisis no se pudo encolar (ver `liberar`)."""
+    session.exec(
+        update(UploadSession)
+        .where(UploadSession.id == upload_id, UploadSession.status == FINALIZADA)
+        .values(status=FINALIZANDO, response_id=None, task_id=None)
+    )
+
+
+def expirar_sesiones(limit: int = 500) -> int:
+    """Elimina sesiones caducadas y sus partes. Devuelve cuántas se eliminaron."""
+    with session_scope() as s:
+        ids = list(
+            s.exec(select(UploadSession.id).where(UploadSession.expires_at <= _now()).limit(limit))
+        )
+    for upload_id in ids:
+        _borrar_sesion(upload_id)
+    return len(ids)
+
+
+__all__ = [
+    "UploadSessionError",
+    "crear_sesion",
+    "obtener_sesion",
+    "recibir_parte",
+    "finalizar",
+    "marcar_finalizada",
+    "deshacer_finalizada",
+    "liberar",
+    "borrar_partes",
+    "expirar_sesiones",
+]
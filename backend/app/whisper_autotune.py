@@ -0,0 +1,263 @@
+"""Autoajuste de la inferencia Whisper en CPU.
+
+Uso:
+    python -m backend.app.whisper_autotune --clips ruta/clips
+        [--compute-types int8,int8_float32,float32] [--threads 1,2,4] [--workers 1,2]
+        [--beams 1,5] [--procesos N] [--max-wer-drift 0.02] [--repeat 1] [--dry-run]
+
+Transcribe el conjunto de referencia (audios de `--clips`; si hay `<clip>.txt` es su
+transcripción de referencia) con cada combinación de compute_type, `cpu_threads`, réplicas
+(`num_workers`, clips en paralelo) y `beam_size`, e informa:
+ - throughput: segundos de audio por segundo de reloj (un proceso);
+ - latencia por clip (p50 / p95);
+ - deriva de WER frente a la configuración de referencia (float32 con el mayor beam); sin
+   `.txt` la referencia es la salida de esa configuración.
+Solo se prueban combinaciones con `threads × workers` ≤ núcleos físicos / `--procesos`
+(por defecto los procesos del worker de CPU, ver features_worker): más hilos compiten con
+los demás procesos del pool. Elige la de mayor throughput con deriva ≤ `--max-wer-drift` y
+la escribe en `WHISPER_PROFILE_PATH`, que `whisper_registry` lee al arrancar cada proceso.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .settings import settings
+
+COMPUTE_TYPES = ("int8", "int8_float32", "float32")
+
+Combinacion = Tuple[str, int, int, int]  # (compute_type, cpu_threads, num_workers, beam_size)
+
+
+@dataclass
+class Clip:
+    nombre: str
+    audio: object  # float32 mono 16 kHz
+    referencia: Optional[str] = None
+
+    @property
+    def duracion_sec(self) -> float:
+        return len(self.audio) / 16000.0
+
+
+@dataclass
+class Resultado:
+    compute_type: str
+    cpu_threads: int
+    num_workers: int
+    beam_size: int
+    throughput: float
+    latency_p50_ms: float
+    latency_p95_ms: float
+    wer: float
+    wer_drift: float = 0.0
+
+
+def _palabras(texto: Optional[str]) -> List[str]:
+    return re.sub(r"[^\w\s']", " ", (texto or "").lower()).split()
+
+
+def wer(referencia: Optional[str], hipotesis: Optional[str]) -> float:
+    """Word error rate (distancia de edición por palabras / palabras de la referencia)."""
+    ref, hip = _palabras(referencia), _palabras(hipotesis)
+    if not ref:
+        return 0.0 if not hip else 1.0
+    fila = list(range(len(hip) + 1))
+    for i, r in enumerate(ref, 1):
+        anterior, fila[0] = fila[0], i
+        for j, h in enumerate(hip, 1):
+            actual = min(fila[j] + 1, fila[j - 1] + 1, anterior + (r != h))
+            anterior, fila[j] = fila[j], actual
+    return fila[-1] / len(ref)
+
+
+def presupuesto_hilos(procesos: Optional[int] = None) -> int:
+    """Núcleos por proceso del worker de CPU."""
+    from .features_worker import nucleos_fisicos
+
+    nucleos = nucleos_fisicos()
+    procesos = procesos or settings.features_worker_concurrency or nucleos
+    return max(1, nucleos // max(1, procesos))
+
+
+def combinaciones(compute_types: Sequence[str], threads: Sequence[int], workers: Sequence[int],
+                  beams: Sequence[int], presupuesto: int) -> List[Combinacion]:
+    return [
+        (ct, t, w, b)
+        for ct in compute_types for t in threads for w in workers for b in beams
+        if t * w <= presupuesto
+    ]
+
+
+def cargar_clips(ruta: str) -> List[Clip]:
+    from .audio_codec import cargar_pcm
+
+    extensiones = {f".{ext.strip().lower()}" for ext in settings.allowed_audio_formats}
+    clips = []
+    for nombre in sorted(os.listdir(ruta)):
+        stem, ext = os.path.splitext(nombre)
+        if ext.lower() not in extensiones:
+            continue
+        referencia = None
+        txt = os.path.join(ruta, stem + ".txt")
+        if os.path.isfile(txt):
+            with open(txt, encoding="utf-8") as f:
+                referencia = f.read().strip()
+        clips.append(Clip(nombre, cargar_pcm(os.path.join(ruta, nombre)), referencia))
+    return clips
+
+
+def _cargar_modelo(model: str, compute_type: str, cpu_threads: int, num_workers: int):
+    from faster_whisper import WhisperModel  # type: ignore
+
+    return WhisperModel(model, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads,
+                        num_workers=num_workers)
+
+
+def _transcribir(modelo, audio, beam_size: int) -> str:
+    language = (
+        None if settings.transcription_language == "auto" else settings.transcription_language
+    )
+    segments, _ = modelo.transcribe(audio, beam_size=beam_size, language=language)
+    return " ".join(s.text.strip() for s in segments if getattr(s, "text", "").strip())
+
+
+def medir(modelo, clips: List[Clip], num_workers: int, beam_size: int,
+          repeat: int = 1) -> Tuple[List[str], List[float], float]:
+    """(textos por clip, latencias en s, segundos de reloj) con `num_workers` clips a la vez."""
+    _transcribir(modelo, clips[0].audio, beam_size)  # calentamiento
+    latencias: List[float] = []
+    textos: List[str] = [""] * len(clips)
+
+    def uno(i: int) -> None:
+        inicio = time.perf_counter()
+        textos[i] = _transcribir(modelo, clips[i].audio, beam_size)
+        latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        list(pool.map(uno, [i for _ in range(repeat) for i in range(len(clips))]))
+    return textos, latencias, time.perf_counter() - inicio
+
+
+def _percentil(valores: List[float], q: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+def autotune(clips: List[Clip], combos: List[Combinacion], model: Optional[str] = None,
+             max_wer_drift: float = 0.02, repeat: int = 1,
+             cargar: Callable = _cargar_modelo) -> Tuple[List[Resultado], Optional[Resultado]]:
+    """Mide cada combinación; devuelve los resultados y la elegida (None si ninguna cumple)."""
+    model = model or settings.transcription_model
+    audio_sec = sum(c.duracion_sec for c in clips) * repeat
+    # Referencia: float32, mayor beam y todos los núcleos del presupuesto en una réplica
+    base = ("float32", max(t * w for _, t, w, _ in combos), 1, max(b for *_, b in combos))
+    orden = [base] + [c for c in combos if c != base]
+    salidas: Dict[Combinacion, List[str]] = {}
+    resultados: List[Resultado] = []
+    for combo in orden:
+        compute_type, cpu_threads, num_workers, beam_size = combo
+        modelo = cargar(model, compute_type, cpu_threads, num_workers)
+        textos, latencias, reloj = medir(modelo, clips, num_workers, beam_size, repeat)
+        del modelo
+        salidas[combo] = textos
+        referencias = [
+            c.referencia if c.referencia is not None else salidas[base][i]
+            for i, c in enumerate(clips)
+        ]
+        error = statistics.mean(wer(r, t) for r, t in zip(referencias, textos))
+        resultados.append(Resultado(
+            compute_type, cpu_threads, num_workers, beam_size,
+            throughput=audio_sec / reloj if reloj > 0 else 0.0,
+            latency_p50_ms=_percentil(latencias, 0.5) * 1000,
+            latency_p95_ms=_percentil(latencias, 0.95) * 1000,
+            wer=error,
+        ))
+    wer_base = resultados[0].wer
+    for r in resultados:
+        r.wer_drift = r.wer - wer_base
+    validos = [
+        r
+        for r in resultados
+        if r.wer_drift <= max_wer_drift
+        and (r.compute_type, r.cpu_threads, r.num_workers, r.beam_size) in combos
+    ]
+    return resultados, max(validos, key=lambda r: r.throughput) if validos else None
+
+
+def escribir_perfil(elegido: Resultado, path: Optional[str] = None, model: Optional[str] = None,
+                    procesos: Optional[int] = None) -> str:
+    path = path or settings.whisper_profile_path
+    perfil = {"model": model or settings.transcription_model, **asdict(elegido),
+              "procesos": procesos, "created_at": datetime.now(timezone.utc).isoformat()}
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(perfil, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def _enteros(valor: str) -> List[int]:
+    return [int(v) for v in valor.split(",") if v.strip()]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--clips", required=True, help="directorio con los audios de referencia")
+    parser.add_argument("--model", default=settings.transcription_model)
+    parser.add_argument("--compute-types", default=",".join(COMPUTE_TYPES))
+    parser.add_argument("--threads", default="1,2,4,8")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--beams", default="1,5")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos Whisper por nodo")
+    parser.add_argument("--max-wer-drift", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", default=settings.whisper_profile_path)
+    parser.add_argument("--dry-run", action="store_true", help="no escribir el perfil")
+    args = parser.parse_args(argv)
+
+    clips = cargar_clips(args.clips)
+    if not clips:
+        parser.error(f"sin audios en {args.clips}")
+    presupuesto = presupuesto_hilos(args.procesos)
+    combos = combinaciones(
+        args.compute_types.split(","),
+        _enteros(args.threads),
+        _enteros(args.workers),
+        _enteros(args.beams),
+        presupuesto,
+    )
+    if not combos:
+        parser.error(f"ninguna combinación cabe en {presupuesto} núcleos por proceso")
+    print(f"{len(clips)} clips ({sum(c.duracion_sec for c in clips):.0f} s), modelo {args.model}, "
+          f"{presupuesto} núcleos por proceso, {len(combos)} combinaciones")
+    resultados, elegido = autotune(clips, combos, args.model, args.max_wer_drift, args.repeat)
+    print(f"\n{'compute_type':<14}{'hilos':>6}{'réplicas':>9}{'beam':>6}{'x t.real':>10}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'WER':>7}{'deriva':>8}")
+    for r in sorted(resultados, key=lambda r: -r.throughput):
+        marca = "  <-" if r is elegido else ""
+        print(f"{r.compute_type:<14}{r.cpu_threads:>6}{r.num_workers:>9}{r.beam_size:>6}{r.throughput:>10.2f}"
+              f"{r.latency_p50_ms:>9.0f}{r.latency_p95_ms:>9.0f}{r.wer:>7.3f}{r.wer_drift:>+8.3f}{marca}")
+    if elegido is None:
+        print(f"\nninguna combinación con deriva de WER <= {args.max_wer_drift}")
+        return
+    if not args.dry_run:
+        path = escribir_perfil(elegido, args.output, args.model, args.procesos)
+        print(f"\nperfil escrito en {path} (se aplica al reiniciar los workers)")
+
+
+if __name__ == "__main__":
+    main()
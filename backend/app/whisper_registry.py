@@ -0,0 +1,160 @@
+"""Modelos Whisper residentes por proceso.
+
+Construir `WhisperModel` lee los pesos de disco e inicializa CTranslate2: con clips cortos
+cuesta más que la propia transcripción. El registro mantiene los modelos cargados por
+(modelo, compute_type, cpu_threads) y los reutiliza entre tareas del mismo proceso:
+ - se precargan al arrancar cada proceso del pool prefork (`worker_process_init`,
+   `WHISPER_PRELOAD=1` con `ENABLE_TRANSCRIPTION=1`); los workers de análisis (pool de
+   hilos) no disparan esa señal y no cargan nada;
+ - la memoria de cada modelo se mide como el RSS que añade su carga y, si al cargar otro se
+   supera `WHISPER_MEMORY_BUDGET_MB`, se expulsan los menos usados (LRU) — nunca el único;
+ - métricas: `emotrack_whisper_model_load_seconds` y `emotrack_whisper_model_resident_bytes`.
+Si existe el perfil de `python -m backend.app.whisper_autotune` (`WHISPER_PROFILE_PATH`) y
+es del modelo configurado, sus compute_type, cpu_threads, num_workers y beam_size sustituyen
+a `TRANSCRIPTION_COMPUTE_TYPE`, `TRANSCRIPTION_CPU_THREADS`,
+`TRANSCRIPTION_PARALLEL_WORKERS` y `TRANSCRIPTION_BEAM_SIZE`.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import structlog
+
+from .metrics import (
+    WHISPER_MODEL_EVICTIONS,
+    WHISPER_MODEL_LOAD_SECONDS,
+    WHISPER_MODEL_RESIDENT_BYTES,
+)
+from .settings import settings
+
+logger = structlog.get_logger()
+
+Clave = Tuple[str, str, int]
+
+_modelos: "OrderedDict[Clave, Tuple[object, int]]" = OrderedDict()  # clave -> (modelo, bytes)
+_lock = threading.Lock()
+
+
+def _rss_bytes() -> int:
+    """RSS del proceso (Linux: /proc/self/statm); 0 si no se puede medir."""
+    try:
+        import resource
+
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except Exception:
+        return 0
+
+
+_perfil: Optional[dict] = None
+
+
+def perfil() -> dict:
+    """Perfil de inferencia medido en este nodo ({} si no hay o es de otro modelo)."""
+    global _perfil
+    if _perfil is None:
+        _perfil = {}
+        if settings.whisper_profile_path:
+            try:
+                with open(settings.whisper_profile_path, encoding="utf-8") as f:
+                    datos = json.load(f)
+                if datos.get("model") == settings.transcription_model:
+                    _perfil = datos
+            except FileNotFoundError:
+                pass
+            except Exception as exc:  # noqa: BLE001
+                logger.warning(
+                    "whisper_profile_invalid", path=settings.whisper_profile_path, error=str(exc)
+                )
+    return _perfil
+
+
+def beam_size() -> int:
+    return int(perfil().get("beam_size") or settings.transcription_beam_size)
+
+
+def clave_modelo(model: Optional[str] = None, compute_type: Optional[str] = None,
+                 cpu_threads: Optional[int] = None) -> Clave:
+    p = perfil()
+    if cpu_threads is None:
+        cpu_threads = int(p.get("cpu_threads", settings.transcription_cpu_threads))
+    return (
+        model or settings.transcription_model,
+        compute_type or p.get("compute_type") or settings.transcription_compute_type,
+        cpu_threads,
+    )
+
+
+def _cargar(clave: Clave):
+    from faster_whisper import WhisperModel  # type: ignore
+
+    from .transcription_parallel import trabajadores
+
+    model, compute_type, cpu_threads = clave
+    # Réplicas para transcribir trozos en paralelo (comparten los pesos)
+    return WhisperModel(model, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads,
+                        num_workers=trabajadores())
+
+
+def _expulsar_hasta(presupuesto: int) -> None:
+    while len(_modelos) > 1 and sum(b for _, b in _modelos.values()) > presupuesto:
+        clave, (_, _bytes) = _modelos.popitem(last=False)
+        WHISPER_MODEL_RESIDENT_BYTES.labels(clave[0], clave[1]).set(0)
+        WHISPER_MODEL_EVICTIONS.inc()
+        logger.info("whisper_model_evicted", model=clave[0], compute_type=clave[1], bytes=_bytes)
+
+
+def obtener_modelo(model: Optional[str] = None, compute_type: Optional[str] = None,
+                   cpu_threads: Optional[int] = None):
+    """Modelo residente para la clave (lo carga la primera vez). Lanza ImportError si
+    faster-whisper no está instalado."""
+    clave = clave_modelo(model, compute_type, cpu_threads)
+    with _lock:
+        if clave in _modelos:
+            _modelos.move_to_end(clave)
+            return _modelos[clave][0]
+        antes = _rss_bytes()
+        inicio = time.perf_counter()
+        modelo = _cargar(clave)
+        duracion = time.perf_counter() - inicio
+        residente = max(0, _rss_bytes() - antes)
+        _modelos[clave] = (modelo, residente)
+        WHISPER_MODEL_LOAD_SECONDS.labels(clave[0], clave[1]).observe(duracion)
+        WHISPER_MODEL_RESIDENT_BYTES.labels(clave[0], clave[1]).set(residente)
+        logger.info("whisper_model_loaded", model=clave[0], compute_type=clave[1],
+                    cpu_threads=clave[2], seconds=round(duracion, 2), bytes=residente)
+        if settings.whisper_memory_budget_mb > 0:
+            _expulsar_hasta(settings.whisper_memory_budget_mb * 1024 * 1024)
+        return modelo
+
+
+def precargar() -> bool:
+    """Carga el modelo configurado (arranque del worker). False si no procede o falla."""
+    if not (settings.enable_transcription and settings.whisper_preload):
+        return False
+    if perfil():
+        campos = ("compute_type", "cpu_threads", "num_workers", "beam_size")
+        logger.info("whisper_profile_applied", path=settings.whisper_profile_path,
+                    **{k: perfil().get(k) for k in campos})
+    try:
+        obtener_modelo()
+        return True
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("whisper_preload_failed", error=str(exc))
+        return False
+
+
+def vaciar() -> None:
+    global _perfil
+    _perfil = None
+    with _lock:
+        for clave in list(_modelos):
+            WHISPER_MODEL_RESIDENT_BYTES.labels(clave[0], clave[1]).set(0)
+        _modelos.clear()
+
+
+__all__ = ["beam_size", "clave_modelo", "obtener_modelo", "perfil", "precargar", "vaciar"]
@@ -0,0 +1,91 @@
+"""Benchmark de decodificación a PCM 16 kHz: PyAV en proceso vs subproceso ffmpeg.
+
+Uso (desde la raíz del repo):
+    python scripts/bench_audio_decode.py [--repeat 20] [--long-sec 300]
+
+Genera clips sintéticos (WAV 48 kHz y Ogg/Opus) cortos (3 s) y largos, y mide el tiempo
+medio por archivo de `audio_codec.cargar_pcm` con cada backend. Si ffmpeg no está en
+PATH (o en FFMPEG_PATH) esa columna se omite.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app import audio_codec  # noqa: E402
+from backend.app.settings import settings  # noqa: E402
+
+
+def _generar(path: str, fmt: str, codec: str, seconds: float, rate: int = 48000) -> str:
+    import av
+
+    out = av.open(path, "w", format=fmt)
+    stream = out.add_stream(codec, rate=rate)
+    stream.layout = "mono"
+    n = int(rate * seconds)
+    t = np.arange(n) / rate
+    signal = (0.3 * np.sin(2 * np.pi * (180 + 40 * np.sin(2 * np.pi * 0.7 * t)) * t)).astype(np.float32)
+    block = 4800
+    for i in range(0, n, block):
+        frame = av.AudioFrame.from_ndarray(signal[i:i + block].reshape(1, -1), format="flt", layout="mono")
+        frame.sample_rate = rate
+        frame.pts = i
+        for packet in stream.encode(frame):
+            out.mux(packet)
+    for packet in stream.encode(None):
+        out.mux(packet)
+    out.close()
+    return path
+
+
+def _medir(path: str, backend: str, repeat: int) -> float:
+    settings.audio_codec_backend = backend
+    tiempos = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        audio_codec.cargar_pcm(path, 16000)
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--long-sec", type=float, default=300.0)
+    args = parser.parse_args()
+
+    tiene_ffmpeg = shutil.which(settings.ffmpeg_path) is not None
+    workdir = tempfile.mkdtemp(prefix="bench_decode_")
+    casos = [
+        ("wav corto (3 s)", _generar(os.path.join(workdir, "short.wav"), "wav", "pcm_s16le", 3.0)),
+        ("opus corto (3 s)", _generar(os.path.join(workdir, "short.ogg"), "ogg", "libopus", 3.0)),
+        (f"wav largo ({args.long_sec:.0f} s)", _generar(os.path.join(workdir, "long.wav"), "wav", "pcm_s16le", args.long_sec)),
+        (f"opus largo ({args.long_sec:.0f} s)", _generar(os.path.join(workdir, "long.ogg"), "ogg", "libopus", args.long_sec)),
+    ]
+    print(f"{'clip':<22}{'pyav ms':>12}{'ffmpeg ms':>12}{'speedup':>10}")
+    try:
+        for nombre, path in casos:
+            repeat = args.repeat if "corto" in nombre else max(1, args.repeat // 10)
+            pyav_ms = _medir(path, "pyav", repeat)
+            if tiene_ffmpeg:
+                ffmpeg_ms = _medir(path, "ffmpeg", repeat)
+                print(f"{nombre:<22}{pyav_ms:>12.1f}{ffmpeg_ms:>12.1f}{ffmpeg_ms / pyav_ms:>9.1f}x")
+            else:
+                print(f"{nombre:<22}{pyav_ms:>12.1f}{'n/d':>12}{'':>10}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if not tiene_ffmpeg:
+        print(f"\n(ffmpeg no encontrado en '{settings.ffmpeg_path}': solo se midió PyAV)")
+
+
+if __name__ == "__main__":
+    main()
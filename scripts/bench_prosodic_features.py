@@ -0,0 +1,91 @@
+"""Benchmark de features prosódicas: STFT compartida vs una STFT por feature.
+
+Uso (desde la raíz del repo):
+    python scripts/bench_prosodic_features.py [--repeat 5] [--seconds 30] [--clips 48]
+
+Compara `prosodic_features.calcular_features` con la implementación anterior (piptrack,
+centroide y MFCC recalculando cada uno su STFT, y selección de pitch con bucle Python)
+sobre una señal sintética, e informa la diferencia máxima entre ambas salidas. Después
+mide `--clips` clips cortos (1-5 s) uno a uno frente a `calcular_features_lote`.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app.prosodic_features import calcular_features, calcular_features_lote  # noqa: E402
+
+
+def _anterior(y, sr):
+    import librosa
+
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr, threshold=0.1)
+    pitch_values = []
+    for t in range(pitches.shape[1]):
+        pitch = pitches[magnitudes[:, t].argmax(), t]
+        if pitch > 0:
+            pitch_values.append(pitch)
+    rms = librosa.feature.rms(y=y)[0]
+    energy_mean = float(np.mean(rms))
+    mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+    return {
+        "pitch_mean_hz": float(np.mean(pitch_values)) if pitch_values else 0.0,
+        "pitch_std_hz": float(np.std(pitch_values)) if len(pitch_values) > 1 else 0.0,
+        "energy_mean_db": energy_mean,
+        "energy_std_db": float(np.std(rms)),
+        "spectral_centroid_hz": float(np.mean(librosa.feature.spectral_centroid(y=y, sr=sr)[0])),
+        "mfcc_mean": float(np.mean(mfccs)),
+        "mfcc_std": float(np.std(mfccs)),
+        "pause_ratio": float(np.sum(rms < energy_mean * 0.1) / len(rms)),
+        "pitch_range_hz": float(np.max(pitch_values) - np.min(pitch_values)) if len(pitch_values) > 1 else 0.0,
+    }
+
+
+def _medir(fn, y, sr, repeat):
+    tiempos = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        resultado = fn(y, sr)
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos) * 1000, resultado
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--clips", type=int, default=48)
+    args = parser.parse_args()
+
+    sr = 16000
+    t = np.arange(int(sr * args.seconds)) / sr
+    y = (0.3 * np.sin(2 * np.pi * (200 + 50 * np.sin(2 * np.pi * 0.5 * t)) * t)).astype(np.float32)
+    _anterior(y[:sr], sr)  # calentar cachés de librosa (filtros mel, numba)
+    calcular_features(y[:sr], sr)
+
+    viejo_ms, viejo = _medir(_anterior, y, sr, args.repeat)
+    nuevo_ms, nuevo = _medir(calcular_features, y, sr, args.repeat)
+    diff = max(abs(nuevo[k] - viejo[k]) / max(abs(viejo[k]), 1e-9) for k in viejo)
+    print(f"señal: {args.seconds:.0f} s @ {sr} Hz")
+    print(f"{'anterior':<20}{viejo_ms:>10.1f} ms")
+    print(f"{'stft compartida':<20}{nuevo_ms:>10.1f} ms   ({viejo_ms / nuevo_ms:.1f}x)")
+    print(f"diferencia relativa máxima: {diff:.2e}")
+
+    rng = np.random.default_rng(0)
+    clips = [y[: int(sr * d)] for d in rng.uniform(1.0, 5.0, args.clips)]
+    uno_ms, _ = _medir(lambda cs, s: [calcular_features(c, s) for c in cs], clips, sr, args.repeat)
+    lote_ms, _ = _medir(calcular_features_lote, clips, sr, args.repeat)
+    print(f"\n{args.clips} clips de 1-5 s")
+    print(f"{'uno a uno':<20}{uno_ms:>10.1f} ms")
+    print(f"{'en lote':<20}{lote_ms:>10.1f} ms   ({uno_ms / lote_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@ from typing import Iterator
 # Forzar uso de SQLite para pruebas ANTES de importar settings/engine
 os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
 os.environ.setdefault("SECRET_KEY", "test-secret-key")
+# Caché de features desactivada salvo en sus propios tests (evita hits entre ejecuciones)
+os.environ.setdefault("FEATURE_CACHE_BACKEND", "off")
+os.environ.setdefault("TRANSCRIPTION_CACHE_BACKEND", "off")
 
 # Asegura root en sys.path
 root = os.path.abspath(os.path.dirname(__file__) + '/..')
@@ -26,6 +29,10 @@ def _isolate_db() -> Iterator[None]:
     init_db()  # asegura esquema
     with engine.begin() as conn:
         # Orden: response -> child -> user
+        try:
+            conn.execute(text("DELETE FROM audiofingerprint"))
+        except Exception:
+            pass
         try:
             conn.execute(text("DELETE FROM response"))
         except Exception:
@@ -53,6 +60,29 @@ def _isolate_db() -> Iterator[None]:
     yield
 
 
+@pytest.fixture(autouse=True)
+def _isolate_storage(tmp_path, monkeypatch) -> Iterator[None]:
+    """Almacén, buffers PCM y caché de features en `tmp_path`:
+    los tests no escriben en `uploads/`."""
+    from backend.app import feature_cache, storage
+
+    # test_encryption recarga `settings`: algunos módulos conservan la instancia anterior
+    instancias = {
+        id(m.settings): m.settings
+        for nombre, m in list(sys.modules.items())
+        if nombre.startswith("backend.app")
+        and hasattr(getattr(m, "settings", None), "storage_local_root")
+    }
+    for settings in instancias.values():
+        monkeypatch.setattr(settings, "storage_local_root", str(tmp_path / "uploads"))
+        monkeypatch.setattr(settings, "storage_tmp_dir", str(tmp_path / "uploads" / ".tmp"))
+        monkeypatch.setattr(settings, "pcm_cache_dir", str(tmp_path / "uploads" / ".pcm"))
+        monkeypatch.setattr(settings, "feature_cache_dir", str(tmp_path / "uploads" / ".features"))
+    monkeypatch.setattr(storage, "_storage", None)
+    monkeypatch.setattr(feature_cache, "_cache", None)
+    yield
+
+
 @pytest.fixture
 def parent_token() -> str:
     """Registra y retorna un token de un parent nuevo por test."""
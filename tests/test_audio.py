@@ -46,3 +46,35 @@ def test_audio_upload_and_duration():
         af = analysis['audio_features']
         # Duración aproximada (50ms) puede no estar si no es WAV válido; solo validar tipo si existe
         assert isinstance(af, dict)
+
+
+
+def test_resubmitted_audio_reuses_blob_and_features(monkeypatch):
+    from backend.app import tasks
+    from backend.app.db import session_scope
+    from backend.app.models import Response, ResponseStatus
+    client = TestClient(app)
+    wav_bytes = _gen_wav(duration_sec=0.1).getvalue()
+    ids = []
+    for _ in range(2):
+        files = {'audio_file': ('retry.wav', io.BytesIO(wav_bytes), 'audio/wav')}
+        r = client.post(
+            '/api/submit-responses', data={'child_id': 'RetryKid', 'text': 'hola'}, files=files
+        )
+        assert r.status_code == 202, r.text
+        ids.append(r.json()['response_id'])
+    with session_scope() as s:
+        first, second = s.get(Response, ids[0]), s.get(Response, ids[1])
+        assert first.audio_sha256 and first.audio_sha256 == second.audio_sha256
+        assert first.audio_path == second.audio_path
+        sha, path = first.audio_sha256, first.audio_path
+        first.status = ResponseStatus.COMPLETED
+        first.analysis_json = {'audio_features': {'duration_sec': 0.1, 'pitch_mean_hz': 440.0}}
+    # Reanálisis del reenvío: no debe volver a extraer features
+    def _no_extraction(path):
+        raise AssertionError('features recomputed')
+    monkeypatch.setattr(tasks, 'extraer_features_audio', _no_extraction)
+    result = tasks.analyze_text_task(
+        {'text': 'hola', 'response_id': ids[1], 'audio_path': path, 'audio_sha256': sha}
+    )
+    assert result['audio_features']['pitch_mean_hz'] == 440.0
@@ -0,0 +1,197 @@
+import hashlib
+import io
+import tempfile
+import wave
+
+import numpy as np
+import pytest
+
+from backend.app import audio_codec
+from backend.app import storage as storage_module
+from backend.app.audio_store import clave_blob, guardar_blob
+from backend.app.db import session_scope
+from backend.app.models import Response
+from backend.app.settings import settings
+from backend.app.storage import LocalShardedStorage
+
+av = pytest.importorskip("av")
+
+
+def _wav_bytes(seconds=2.0, rate=16000):
+    t = np.arange(int(rate * seconds)) / rate
+    pcm = (0.3 * np.sin(2 * np.pi * 200 * t) * 32767).astype('<i2')
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def _truncated_opus(src_path, dst_path):
+    """Codificación que "termina bien" pero pierde la mitad del audio (p.ej. disco lleno)."""
+    with wave.open(src_path, 'rb') as wf:
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype='<i2').astype(np.float32) / 32768
+    pcm = pcm[:len(pcm) // 2]
+    out = av.open(dst_path, 'w', format='ogg')
+    stream = out.add_stream('libopus', rate=16000)
+    stream.layout = 'mono'
+    for i in range(0, len(pcm), 320):
+        frame = av.AudioFrame.from_ndarray(
+            pcm[i:i + 320].reshape(1, -1), format='flt', layout='mono'
+        )
+        frame.sample_rate = 16000
+        frame.pts = i
+        for packet in stream.encode(frame):
+            out.mux(packet)
+    for packet in stream.encode(None):
+        out.mux(packet)
+    out.close()
+    return audio_codec.ResultadoCodec(True, 'test')
+
+
+@pytest.fixture
+def store(monkeypatch):
+    backend = LocalShardedStorage(tempfile.mkdtemp())
+    monkeypatch.setattr(storage_module, '_storage', backend)
+    monkeypatch.setattr(settings, 'audio_storage_codec', 'opus')
+    monkeypatch.setattr(settings, 'audio_codec_backend', 'pyav')
+    return backend
+
+
+def _stored_wav(store, body):
+    sha = hashlib.sha256(body).hexdigest()
+    key = clave_blob(sha, 'wav')
+    store.put_bytes(key, body)
+    with session_scope() as s:
+        row = Response(child_name='Opus', audio_path=key, audio_format='wav', audio_sha256=sha)
+        s.add(row)
+        s.flush()
+        return sha, key, row.id
+
+
+def test_canonical_opus_replaces_verified_original(store):
+    body = _wav_bytes()
+    sha, key, rid = _stored_wav(store, body)
+    canonical = audio_codec.almacenar_canonico(key, sha, response_id=rid)
+    assert canonical == f'audio/{sha}.ogg'
+    assert not store.exists(key)
+    assert store.size(canonical) * 5 < len(body)
+    with session_scope() as s:
+        row = s.get(Response, rid)
+        assert row.audio_path == canonical and row.audio_format == 'ogg'
+    # Reenvío idéntico: se reutiliza la copia canónica sin volver a guardar el WAV
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
+    tmp.write(body)
+    tmp.close()
+    assert guardar_blob(tmp.name, sha, 'wav') == (canonical, False)
+    assert not store.exists(key)
+
+
+def test_failed_verification_keeps_original(store, monkeypatch):
+    monkeypatch.setattr(audio_codec, '_codificar_opus', _truncated_opus)
+    sha, key, rid = _stored_wav(store, _wav_bytes())
+    assert audio_codec.almacenar_canonico(key, sha, response_id=rid) == key
+    assert store.exists(key)
+    assert not store.exists(f'audio/{sha}.ogg')
+    with session_scope() as s:
+        assert s.get(Response, rid).audio_path == key
+
+
+def test_original_kept_while_row_not_visible(store):
+    body = _wav_bytes(seconds=0.5)
+    sha = hashlib.sha256(body).hexdigest()
+    key = clave_blob(sha, 'wav')
+    store.put_bytes(key, body)
+    # Tarea ejecutada antes del commit de la fila: copia creada, original intacto
+    assert audio_codec.almacenar_canonico(key, sha, response_id=10**9).endswith('.ogg')
+    assert store.exists(key)
+
+
+def test_canonical_copy_runs_on_features_queue(store, monkeypatch):
+    from backend.app import tasks
+
+    sha, key, rid = _stored_wav(store, _wav_bytes(seconds=0.5))
+    monkeypatch.setattr(settings, 'enable_audio_features', False)
+    monkeypatch.setattr(settings, 'enable_transcription', False)
+    encolado = []
+    original = tasks.canonical_audio_task.apply_async
+
+    def apply_async(args, **kwargs):
+        encolado.append(kwargs)
+        return original(args, **kwargs)
+
+    monkeypatch.setattr(tasks.canonical_audio_task, 'apply_async', apply_async)
+    monkeypatch.setattr(
+        tasks, 'almacenar_canonico', lambda ref, sha, response_id=None: f'audio/{sha}.ogg'
+    )
+    tasks.analyze_text_task(
+        {
+            'text': 'hola',
+            'audio_path': key,
+            'audio_sha256': sha,
+            'response_id': rid,
+            'force_intensity': 0.2,
+        }
+    )
+    assert encolado == [{'expires': settings.features_task_timeout_sec}]
+    assert tasks.celery_app.conf.task_routes['audio.canonical'] == {'queue': 'features'}
+
+
+def test_decode_backends_and_structured_errors(tmp_path, monkeypatch):
+    src = tmp_path / 'a.wav'
+    src.write_bytes(_wav_bytes(seconds=1.0))
+    y = audio_codec.cargar_pcm(str(src), 16000)
+    assert y.dtype == np.float32 and len(y) == pytest.approx(16000, abs=50)
+    assert len(audio_codec.cargar_pcm(str(src), 16000, max_sec=0.25)) == 4000
+
+    bad = tmp_path / 'bad.wav'
+    bad.write_bytes(b'RIFF' + b'\x00' * 200)
+    monkeypatch.setattr(settings, 'ffmpeg_path', str(tmp_path / 'no-ffmpeg'))
+    result = audio_codec.decodificar_a_archivo(str(bad), str(tmp_path / 'out.f32'))
+    assert not result.ok
+    # Último backend intentado (subproceso) y causa concreta, no un fallo silencioso
+    assert result.backend == 'ffmpeg' and result.error == 'not_installed'
+    monkeypatch.setattr(settings, 'audio_codec_backend', 'pyav')
+    wav_out = tmp_path / 'norm.wav'
+    converted = audio_codec.convertir_wav(str(src), str(wav_out))
+    assert converted.ok and converted.backend == 'pyav'
+    with wave.open(str(wav_out), 'rb') as wf:
+        assert (wf.getnchannels(), wf.getframerate()) == (1, 16000)
+
+
+def test_normalization_is_cached_pure_and_single_flight(store, monkeypatch):
+    import threading
+
+    from backend.app import audio_utils
+
+    monkeypatch.setattr(settings, 'enable_audio_normalization', True)
+    monkeypatch.setattr(settings, 'storage_tmp_dir', tempfile.mkdtemp())
+    body = _wav_bytes(rate=8000)  # no es 16 kHz: requiere normalizar
+    sha = hashlib.sha256(body).hexdigest()
+    key = clave_blob(sha, 'wav')
+    store.put_bytes(key, body)
+    llamadas = []
+    original = audio_utils.convertir_wav
+
+    def contar(src, dst):
+        llamadas.append(dst)
+        return original(src, dst)
+
+    monkeypatch.setattr(audio_utils, 'convertir_wav', contar)
+    resultados = []
+    hilos = [
+        threading.Thread(target=lambda: resultados.append(audio_utils.normalizar_audio(key)))
+        for _ in range(4)
+    ]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert len(llamadas) == 1
+    assert set(resultados) == {audio_utils.clave_normalizada(f'{sha}.wav')}
+    assert audio_utils.normalizar_audio(key) == resultados[0] and len(llamadas) == 1
+    assert store.get_bytes(key) == body  # el original no cambia
+    with wave.open(io.BytesIO(store.get_bytes(resultados[0])), 'rb') as wf:
+        assert (wf.getframerate(), wf.getnchannels()) == (16000, 1)
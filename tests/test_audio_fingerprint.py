@@ -0,0 +1,146 @@
+import io
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from backend.app import audio_fingerprint, audio_pcm, tasks
+from backend.app import storage as storage_module
+from backend.app.audio_fingerprint import huella, similitud
+from backend.app.db import session_scope
+from backend.app.models import AudioFingerprint, Response, ResponseStatus
+from backend.app.settings import settings
+from backend.app.storage import LocalShardedStorage
+
+SR = 16000
+
+
+def _voz(f0_base, mod_hz, seconds=6.0, seed=0):
+    t = np.arange(int(SR * seconds)) / SR
+    f0 = f0_base + 50 * np.sin(2 * np.pi * 0.6 * t)
+    fase = 2 * np.pi * np.cumsum(f0) / SR
+    y = (
+        sum((0.3 / k) * np.sin(k * fase) for k in range(1, 8))
+        * (0.5 + 0.5 * np.sin(2 * np.pi * mod_hz * t)) ** 2
+    )
+    return (y + 0.01 * np.random.default_rng(seed).standard_normal(len(t))).astype(np.float32)
+
+
+def _wav(y):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SR)
+        wf.writeframes((np.clip(y, -1, 1) * 32767).astype('<i2').tobytes())
+    return buf.getvalue()
+
+
+def test_fingerprint_matches_trimmed_copy_and_is_fast():
+    y = _voz(180, 3.0)
+    # Recorte de 13 ms, otra ganancia y ruido (otro dispositivo / recodificación)
+    ruido = np.random.default_rng(1).standard_normal(len(y) - 208).astype(np.float32)
+    copia = y[208:] * 0.7 + 0.003 * ruido
+    a, b, otro = huella(y, SR), huella(copia, SR), huella(_voz(230, 2.1), SR)
+    assert similitud(a, b) >= settings.fingerprint_min_similarity
+    assert similitud(a, otro) < 0.7
+    inicio = time.perf_counter()
+    for _ in range(200):
+        similitud(a, b)
+    assert (time.perf_counter() - inicio) / 200 < 1e-3
+
+
+def test_long_clip_comparison_is_sub_millisecond():
+    y = _voz(180, 3.0, seconds=60.0)
+    ruido = np.random.default_rng(1).standard_normal(len(y) - 208).astype(np.float32)
+    copia = y[208:] * 0.7 + 0.003 * ruido
+    a, b, otro = huella(y, SR), huella(copia, SR), huella(_voz(230, 2.1, seconds=60.0), SR)
+    umbral = settings.fingerprint_min_similarity
+    # El barrido grueso + refinado da lo mismo que medir todos los desplazamientos
+    x, z = np.frombuffer(a, dtype='<u2'), np.frombuffer(b, dtype='<u2')
+    popcount = audio_fingerprint._popcount16()
+    completo = 1.0 - min(audio_fingerprint._ber(popcount, x, z, d) for d in range(-16, 17))
+    assert similitud(a, b, max_offset=16) == completo >= umbral
+    assert similitud(a, otro, umbral=umbral) < umbral
+    for par, kwargs in [((a, b), {}), ((a, otro), {'umbral': umbral})]:
+        inicio = time.perf_counter()
+        for _ in range(100):
+            similitud(*par, **kwargs)
+        assert (time.perf_counter() - inicio) / 100 < 0.5e-3
+
+
+def test_candidates_prefiltered_by_text_and_duration(monkeypatch):
+    fp = huella(_voz(180, 3.0), SR)
+    with session_scope() as s:
+        filas = [
+            Response(child_name='Ana', child_id=9, status=ResponseStatus.COMPLETED)
+            for _ in range(3)
+        ]
+        for fila in filas:
+            s.add(fila)
+        s.flush()
+        for fila, (duracion, texto) in zip(filas, [(6.0, 'otro'), (9.0, 'hola'), (6.1, 'hola')]):
+            audio_fingerprint.registrar(
+                s, fila.id, 9, fp, duracion, audio_fingerprint.hash_texto(texto)
+            )
+        comparados = []
+        original = audio_fingerprint.similitud
+        monkeypatch.setattr(audio_fingerprint, 'similitud',
+                            lambda a, b, **kw: comparados.append(b) or original(a, b, **kw))
+        encontrado = audio_fingerprint.buscar_casi_duplicado(
+            s, 9, fp, 6.0, audio_fingerprint.hash_texto('hola')
+        )
+    assert encontrado is not None and encontrado[0] == filas[2].id
+    assert len(comparados) == 1
+
+
+def test_near_duplicate_reuses_previous_analysis(monkeypatch):
+    monkeypatch.setattr(storage_module, '_storage', LocalShardedStorage(tempfile.mkdtemp()))
+    monkeypatch.setattr(settings, 'pcm_cache_dir', tempfile.mkdtemp())
+    monkeypatch.setattr(settings, 'enable_transcription', False)
+    y = _voz(180, 3.0)
+    storage = storage_module.get_storage()
+    storage.put_bytes('audio/a.wav', _wav(y))
+    storage.put_bytes('audio/b.wav', _wav(y[400:] * 0.8))
+    with session_scope() as s:
+        filas = [
+            Response(child_name='Ana', child_id=7, status=ResponseStatus.QUEUED) for _ in range(2)
+        ]
+        for fila in filas:
+            s.add(fila)
+        s.flush()
+        ids = [fila.id for fila in filas]
+    base = {'text': 'hola', 'child_id': 7}
+    primero = tasks.analyze_text_task({**base, 'audio_path': 'audio/a.wav', 'audio_sha256': 'aa',
+                                       'response_id': ids[0], 'force_intensity': 0.9})
+
+    def no_pipeline(*args, **kwargs):
+        raise AssertionError('no debería extraer features')
+
+    # La huella se calcula en la etapa de features, que no llega a pasar por librosa
+    monkeypatch.setattr(tasks, 'extraer_features_pcm', no_pipeline)
+    segundo = tasks.analyze_text_task({**base, 'audio_path': 'audio/b.wav', 'audio_sha256': 'bb',
+                                       'response_id': ids[1]})
+    assert segundo['audio_features']['near_duplicate_of'] == ids[0]
+    assert segundo['intensity'] == primero['intensity'] and segundo['transcript'] == 'hola'
+    with session_scope() as s:
+        assert s.get(AudioFingerprint, ids[1]) is not None
+        assert s.get(Response, ids[1]).status == ResponseStatus.COMPLETED
+
+
+def test_fingerprint_skipped_without_audio_features(monkeypatch):
+    monkeypatch.setattr(storage_module, '_storage', LocalShardedStorage(tempfile.mkdtemp()))
+    monkeypatch.setattr(settings, 'pcm_cache_dir', tempfile.mkdtemp())
+    monkeypatch.setattr(settings, 'enable_transcription', False)
+    monkeypatch.setattr(settings, 'enable_audio_features', False)
+    storage_module.get_storage().put_bytes('audio/c.wav', _wav(_voz(180, 3.0)))
+
+    def no_huella(*args, **kwargs):
+        raise AssertionError('no debería decodificar ni calcular la huella')
+
+    monkeypatch.setattr(audio_fingerprint, 'etapa_huella', no_huella)
+    monkeypatch.setattr(audio_pcm, 'decodificar_compartido', no_huella)
+    result = tasks.analyze_text_task({'text': 'hola', 'child_id': 7, 'audio_path': 'audio/c.wav',
+                                      'audio_sha256': 'cc', 'force_intensity': 0.2})
+    assert 'near_duplicate_of' not in (result['audio_features'] or {})
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import io
+import os
+import struct
+import tempfile
+
+import pytest
+from starlette.datastructures import UploadFile
+
+from backend.app import storage as storage_module
+from backend.app.audio_ingest import ingerir_audio_streaming
+from backend.app.audio_probe import probe_header
+from backend.app.audio_utils import AudioValidationError
+from backend.app.settings import settings
+from backend.app.storage import LocalShardedStorage
+
+
+def _wav_header(duration_sec: float, rate: int = 16000) -> bytes:
+    data_size = int(duration_sec * rate) * 2
+    fmt = struct.pack('<HHIIHH', 1, 1, rate, rate * 2, 2, 16)
+    return (b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+            + b'fmt ' + struct.pack('<I', 16) + fmt
+            + b'data' + struct.pack('<I', data_size))
+
+
+def test_wav_header_duration():
+    assert probe_header(_wav_header(2.0), 'wav').duration_sec == pytest.approx(2.0)
+    assert probe_header(b'not a wav', 'wav') is None
+
+
+@pytest.fixture
+def store(monkeypatch):
+    backend = LocalShardedStorage(tempfile.mkdtemp())
+    monkeypatch.setattr(storage_module, '_storage', backend)
+    return backend
+
+
+def _stored_files(backend):
+    return [os.path.join(d, f) for d, _, files in os.walk(backend.root) for f in files]
+
+
+def test_streaming_ingest_writes_file_and_hash(store):
+    target = tempfile.mkdtemp()
+    body = _wav_header(0.5) + b'\x00\x01' * 8000
+    upload = UploadFile(file=io.BytesIO(body), filename='clip.wav')
+    result = asyncio.run(ingerir_audio_streaming(upload, target_dir=target))
+    assert result.ext == 'wav'
+    assert result.size_bytes == len(body)
+    assert result.sha256 == hashlib.sha256(body).hexdigest()
+    assert result.key == f'audio/{result.sha256}.wav'
+    # Layout fragmentado: audio/ab/cd/<sha>.wav
+    sha = result.sha256
+    assert store.path_for(result.key) == os.path.join(
+        store.root, 'audio', sha[:2], sha[2:4], f'{sha}.wav'
+    )
+    assert store.get_bytes(result.key) == body
+    # El temporal de ingesta no queda en el directorio de trabajo
+    assert os.listdir(target) == []
+
+
+def test_identical_uploads_share_one_blob(store):
+    body = _wav_header(0.25) + b'\x00\x02' * 4000
+    first = asyncio.run(
+        ingerir_audio_streaming(UploadFile(file=io.BytesIO(body), filename='a.wav'))
+    )
+    second = asyncio.run(
+        ingerir_audio_streaming(UploadFile(file=io.BytesIO(body), filename='b.wav'))
+    )
+    assert first.nuevo is True
+    assert second.nuevo is False
+    assert first.key == second.key
+    assert _stored_files(store) == [store.path_for(first.key)]
+
+
+def test_streaming_ingest_rejects_long_wav_before_persisting(store):
+    target = tempfile.mkdtemp()
+    header = _wav_header(settings.max_audio_duration_sec + 10)
+    upload = UploadFile(file=io.BytesIO(header + b'\x00' * 1024), filename='long.wav')
+    with pytest.raises(AudioValidationError) as exc:
+        asyncio.run(ingerir_audio_streaming(upload, target_dir=target))
+    assert 'muy largo' in str(exc.value)
+    assert not os.path.exists(target) or os.listdir(target) == []
+
+
+def test_streaming_ingest_aborts_over_size_limit(store):
+    target = tempfile.mkdtemp()
+    original = settings.max_audio_file_size_mb
+    settings.max_audio_file_size_mb = 0.1  # ~100KB
+    try:
+        body = _wav_header(1.0) + b'\x00' * (300 * 1024)
+        upload = UploadFile(file=io.BytesIO(body), filename='big.wav')
+        with pytest.raises(AudioValidationError) as exc:
+            asyncio.run(ingerir_audio_streaming(upload, target_dir=target))
+        assert 'muy grande' in str(exc.value)
+        assert os.listdir(target) == []
+    finally:
+        settings.max_audio_file_size_mb = original
+
+
+def test_mislabelled_upload_stored_with_sniffed_format(store):
+    body = _wav_header(0.25) + b'\x00\x03' * 4000
+    upload = UploadFile(file=io.BytesIO(body), filename='clip.mp3')
+    result = asyncio.run(ingerir_audio_streaming(upload))
+    assert result.ext == 'wav'
+    assert result.key.endswith('.wav')
+
+
+def test_non_audio_upload_rejected_before_writing(store):
+    target = tempfile.mkdtemp()
+    upload = UploadFile(file=io.BytesIO(b'<html>not audio</html>' * 100), filename='clip.wav')
+    with pytest.raises(AudioValidationError) as exc:
+        asyncio.run(ingerir_audio_streaming(upload, target_dir=target))
+    assert 'no reconocido' in str(exc.value)
+    assert os.listdir(target) == []
+    assert _stored_files(store) == []
@@ -0,0 +1,72 @@
+import io
+import os
+import tempfile
+import wave
+
+import numpy as np
+import pytest
+
+from backend.app import audio_pcm, audio_utils, tasks
+from backend.app import storage as storage_module
+from backend.app.settings import settings
+from backend.app.storage import LocalShardedStorage
+
+
+def _wav_bytes(seconds=1.0, rate=16000):
+    t = np.arange(int(rate * seconds)) / rate
+    pcm = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype('<i2')
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    backend = LocalShardedStorage(tempfile.mkdtemp())
+    monkeypatch.setattr(storage_module, '_storage', backend)
+    monkeypatch.setattr(settings, 'pcm_cache_dir', tempfile.mkdtemp())
+    return backend
+
+
+def test_shared_buffer_decoded_once_and_reused(store, monkeypatch):
+    store.put_bytes('audio/abcd.wav', _wav_bytes())
+    calls = []
+    original = audio_pcm._escribir_pcm
+    monkeypatch.setattr(
+        audio_pcm, '_escribir_pcm', lambda src, dst: (calls.append(src), original(src, dst))
+    )
+    path = audio_pcm.decodificar_compartido('audio/abcd.wav', 'abcd')
+    otra = audio_pcm.decodificar_compartido('audio/abcd.wav', 'abcd')
+    assert otra != path
+    assert len(calls) == 1
+    # Liberar una referencia no afecta a la otra respuesta con el mismo audio
+    audio_pcm.liberar_pcm(path)
+    y = audio_pcm.abrir_pcm(otra)
+    assert isinstance(y, np.memmap) and y.dtype == np.float32
+    assert len(y) == pytest.approx(16000, abs=50)
+    assert audio_utils.extraer_features_pcm(y)['duration_sec'] == pytest.approx(1.0, abs=0.01)
+    del y
+    audio_pcm.liberar_pcm(otra)
+    assert os.listdir(settings.pcm_cache_dir) == []
+
+
+def test_analysis_hands_buffer_to_transcription(store, monkeypatch):
+    store.put_bytes('audio/beef.wav', _wav_bytes(0.5))
+    monkeypatch.setattr(settings, 'enable_transcription', True)
+    seen = {}
+
+    def fake_transcribe(path, content_hash, audio=None):
+        seen['audio'] = None if audio is None else np.array(audio)
+        return 'hola'
+
+    monkeypatch.setattr(audio_utils, '_transcribir_local', fake_transcribe)
+    tasks.analyze_text_task(
+        {'text': 'hola', 'audio_path': 'audio/beef.wav', 'audio_sha256': 'beef'}
+    )
+    # Whisper recibe las muestras ya decodificadas y el buffer se libera al terminar
+    assert seen['audio'] is not None and len(seen['audio']) == pytest.approx(8000, abs=50)
+    assert os.listdir(settings.pcm_cache_dir) == []
@@ -0,0 +1,95 @@
+import asyncio
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.app import storage as storage_module
+from backend.app.audio_playback import AudioRangeResponse, parse_range
+from backend.app.db import session_scope
+from backend.app.main import app
+from backend.app.models import Response
+from backend.app.storage import LocalShardedStorage
+
+client = TestClient(app)
+
+SHA = 'ab' * 32
+KEY = f'audio/{SHA}.ogg'
+DATA = bytes(range(256)) * 400
+
+
+def _token(email, role):
+    client.post('/api/auth/register', json={'email': email, 'password': 'pass123', 'role': role})
+    login = client.post('/api/auth/login', json={'email': email, 'password': 'pass123'})
+    return {'Authorization': f"Bearer {login.json()['access_token']}"}
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    backend = LocalShardedStorage(tempfile.mkdtemp())
+    monkeypatch.setattr(storage_module, '_storage', backend)
+    backend.put_bytes(KEY, DATA)
+    with session_scope() as s:
+        row = Response(child_name='Play', audio_path=KEY, audio_format='ogg', audio_sha256=SHA)
+        s.add(row)
+        s.flush()
+        return row.id
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-9', 100) == (0, 9)
+    assert parse_range('bytes=90-', 100) == (90, 99)
+    assert parse_range('bytes=-10', 100) == (90, 99)
+    assert parse_range('bytes=50-500', 100) == (50, 99)
+    assert parse_range('bytes=0-1,5-6', 100) is None
+    assert parse_range('items=0-1', 100) is None
+
+
+def test_audio_endpoint_full_range_and_conditional(stored):
+    headers = _token('psy_audio@example.com', 'psychologist')
+    url = f'/api/responses/{stored}/audio'
+    full = client.get(url, headers=headers)
+    assert full.status_code == 200
+    assert full.content == DATA
+    assert full.headers['content-type'] == 'audio/ogg'
+    assert full.headers['accept-ranges'] == 'bytes'
+    etag = full.headers['etag']
+    assert etag == f'"{SHA}"'
+
+    part = client.get(url, headers={**headers, 'Range': 'bytes=1000-1999'})
+    assert part.status_code == 206
+    assert part.content == DATA[1000:2000]
+    assert part.headers['content-range'] == f'bytes 1000-1999/{len(DATA)}'
+
+    assert client.get(url, headers={**headers, 'If-None-Match': etag}).status_code == 304
+    stale = client.get(url, headers={**headers, 'Range': 'bytes=0-9', 'If-Range': '"otro"'})
+    assert stale.status_code == 200 and len(stale.content) == len(DATA)
+    fresh = client.get(url, headers={**headers, 'Range': 'bytes=0-9', 'If-Range': etag})
+    assert fresh.status_code == 206 and fresh.content == DATA[:10]
+    bad = client.get(url, headers={**headers, 'Range': f'bytes={len(DATA)}-'})
+    assert bad.status_code == 416
+    assert bad.headers['content-range'] == f'bytes */{len(DATA)}'
+
+
+def test_audio_endpoint_access(stored):
+    assert client.get(f'/api/responses/{stored}/audio').status_code == 401
+    parent = _token('parent_audio@example.com', 'parent')
+    # La respuesta no pertenece a un hijo del padre
+    assert client.get(f'/api/responses/{stored}/audio', headers=parent).status_code == 404
+
+
+def test_zerocopy_extension_used_for_local_files(stored):
+    path = storage_module._storage.local_file(KEY)
+    response = AudioRangeResponse(
+        206, {'content-length': '100'}, file_path=path, start=500, length=100
+    )
+    messages = []
+
+    async def send(message):
+        messages.append(dict(message))
+
+    scope = {'type': 'http', 'extensions': {'http.response.zerocopysend': {}}}
+    asyncio.run(response(scope, None, send))
+    assert messages[0]['status'] == 206
+    assert messages[1]['type'] == 'http.response.zerocopysend'
+    assert (messages[1]['offset'], messages[1]['count']) == (500, 100)
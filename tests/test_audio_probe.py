@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+from backend.app.audio_probe import probe_audio, probe_header
+from backend.app.audio_utils import AudioValidationError, validar_audio
+from backend.app.settings import settings
+
+av = pytest.importorskip("av")
+
+
+def _encode(path, fmt, codec, rate=48000, seconds=3.0, options=None):
+    out = av.open(str(path), 'w', format=fmt, options=options or {})
+    stream = out.add_stream(codec, rate=rate)
+    stream.layout = 'mono'
+    n = int(rate * seconds)
+    signal = (0.3 * np.sin(2 * np.pi * 220 * np.arange(n) / rate)).astype(np.float32)
+    for i in range(0, n, 1024):
+        frame = av.AudioFrame.from_ndarray(
+            signal[i:i + 1024].reshape(1, -1), format='flt', layout='mono'
+        )
+        frame.sample_rate = rate
+        frame.pts = i
+        for packet in stream.encode(frame):
+            out.mux(packet)
+    for packet in stream.encode(None):
+        out.mux(packet)
+    out.close()
+    return str(path)
+
+
+@pytest.mark.parametrize("name,fmt,codec,rate,options", [
+    ("a.webm", "webm", "libopus", 48000, None),
+    ("live.webm", "webm", "libopus", 48000, {"live": "1"}),  # sin Duration, como MediaRecorder
+    ("a.ogg", "ogg", "libopus", 48000, None),
+    ("v.ogg", "ogg", "libvorbis", 44100, None),
+    ("a.mp3", "mp3", "libmp3lame", 44100, None),
+    ("noxing.mp3", "mp3", "libmp3lame", 16000, {"write_xing": "0"}),  # recorrido de frames
+    ("a.m4a", "ipod", "aac", 44100, None),
+])
+def test_probe_containers(tmp_path, name, fmt, codec, rate, options):
+    path = _encode(tmp_path / name, fmt, codec, rate=rate, options=options)
+    info = probe_audio(path)
+    assert info is not None
+    assert info.sample_rate == rate
+    assert info.channels == 1
+    assert info.duration_sec == pytest.approx(3.0, abs=0.15)
+
+
+def test_probe_header_only_skips_tail_dependent_duration(tmp_path):
+    path = _encode(tmp_path / "a.ogg", "ogg", "libopus")
+    with open(path, 'rb') as f:
+        info = probe_header(f.read(4096), "ogg")
+    # La duración de Ogg depende de la última página: no se estima con la cabecera
+    assert info is not None and info.duration_sec is None and info.sample_rate == 48000
+
+
+def test_probe_unknown_content_returns_none(tmp_path):
+    path = tmp_path / "junk.webm"
+    path.write_bytes(os.urandom(2048))
+    assert probe_audio(str(path)) is None
+
+
+def test_validation_enforces_duration_for_webm(tmp_path, monkeypatch):
+    path = _encode(tmp_path / "long.webm", "webm", "libopus", seconds=4.0, options={"live": "1"})
+    monkeypatch.setattr(settings, "max_audio_duration_sec", 2.0)
+    with pytest.raises(AudioValidationError) as exc:
+        validar_audio(path, os.path.getsize(path))
+    assert "muy largo" in str(exc.value)
+
+
+@pytest.mark.parametrize("name,fmt,codec,expected", [
+    ("a.webm", "webm", "libopus", "webm"),
+    ("a.ogg", "ogg", "libopus", "ogg"),
+    ("a.mp3", "mp3", "libmp3lame", "mp3"),
+    ("a.m4a", "ipod", "aac", "m4a"),
+])
+def test_sniff_format_from_magic_bytes(tmp_path, name, fmt, codec, expected):
+    from backend.app.audio_probe import sniff_format
+    rate = 44100 if codec in ("libmp3lame", "aac") else 48000
+    path = _encode(tmp_path / name, fmt, codec, rate=rate, seconds=0.5)
+    with open(path, 'rb') as f:
+        assert sniff_format(f.read(64)) == expected
+
+
+def test_sniff_format_rejects_non_audio():
+    from backend.app.audio_probe import sniff_format
+    assert sniff_format(b'%PDF-1.4 fake document') is None
+    assert sniff_format(b'') is None
@@ -0,0 +1,69 @@
+import io
+import tempfile
+import wave
+
+import numpy as np
+import pytest
+
+from backend.app import audio_utils, tasks
+from backend.app import storage as storage_module
+from backend.app.audio_vad import audio_voz, detectar_voz
+from backend.app.settings import settings
+from backend.app.storage import LocalShardedStorage
+
+SR = 16000
+
+
+def _grabacion():
+    """1 s silencio, 1 s voz, 0.3 s pausa, 1 s voz, 2 s silencio (con ruido de fondo)."""
+    rng = np.random.default_rng(1)
+    tono = 0.3 * np.sin(2 * np.pi * 220 * np.arange(SR) / SR)
+    partes = [np.zeros(SR), tono, np.zeros(int(0.3 * SR)), tono, np.zeros(2 * SR)]
+    y = np.concatenate(partes) + 0.001 * rng.standard_normal(int(5.3 * SR))
+    return y.astype(np.float32)
+
+
+def test_energy_vad_segments():
+    y = _grabacion()
+    vad = detectar_voz(y, SR)
+    # La pausa corta queda dentro del segmento; silencios inicial/final fuera (+ relleno)
+    assert len(vad.segmentos) == 1
+    inicio, fin = vad.segmentos[0]
+    assert inicio / SR == pytest.approx(0.8, abs=0.05)
+    assert fin / SR == pytest.approx(3.5, abs=0.05)
+    resumen = vad.as_dict()
+    assert resumen['speech_sec'] == pytest.approx(2.7, abs=0.1)
+    assert resumen['speech_ratio'] == pytest.approx(2.7 / 5.3, abs=0.02)
+    assert len(audio_voz(y, vad.segmentos)) == fin - inicio
+    assert detectar_voz(np.zeros(SR, dtype=np.float32), SR).segmentos == []
+
+
+def test_only_voiced_audio_reaches_whisper(monkeypatch):
+    monkeypatch.setattr(storage_module, '_storage', LocalShardedStorage(tempfile.mkdtemp()))
+    monkeypatch.setattr(settings, 'pcm_cache_dir', tempfile.mkdtemp())
+    monkeypatch.setattr(settings, 'enable_transcription', True)
+    monkeypatch.setattr(settings, 'vad_enabled', True)
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SR)
+        wf.writeframes((_grabacion() * 32767).astype('<i2').tobytes())
+    storage_module.get_storage().put_bytes('audio/dada.wav', buf.getvalue())
+    seen = {}
+
+    def fake_transcribe(path, content_hash, audio=None):
+        seen['n'] = len(audio)
+        return 'hola'
+
+    monkeypatch.setattr(audio_utils, '_transcribir_local', fake_transcribe)
+    result = tasks.analyze_text_task(
+        {
+            'text': 'hola',
+            'audio_path': 'audio/dada.wav',
+            'audio_sha256': 'dada',
+            'force_intensity': 0.2,
+        }
+    )
+    assert result['audio_features']['speech_ratio'] == pytest.approx(2.7 / 5.3, abs=0.02)
+    assert seen['n'] == pytest.approx(2.7 * SR, abs=0.1 * SR)
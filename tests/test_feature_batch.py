@@ -0,0 +1,129 @@
+import io
+import json
+import tempfile
+import wave
+
+import numpy as np
+import pytest
+
+from backend.app import feature_batch, prosodic_features, tasks
+from backend.app import storage as storage_module
+from backend.app.prosodic_features import calcular_features, calcular_features_lote
+from backend.app.settings import settings
+from backend.app.storage import LocalShardedStorage
+
+SR = 16000
+
+
+class FakeRedis:
+    def __init__(self):
+        self.lists = {}
+        self.kv = {}
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value)
+
+    def lpop(self, key, count):
+        items = self.lists.get(key, [])
+        taken, self.lists[key] = items[:count], items[count:]
+        return taken or None
+
+    def blpop(self, key, timeout=0):
+        items = self.lists.get(key)
+        return (key, items.pop(0)) if items else None
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.kv:
+            return None
+        self.kv[key] = value
+        return True
+
+    def delete(self, key):
+        self.kv.pop(key, None)
+
+    def expire(self, key, seconds):
+        pass
+
+
+def _clip(seconds, freq=220.0, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SR * seconds)) / SR
+    y = 0.3 * np.sin(2 * np.pi * freq * t) + 0.01 * rng.standard_normal(len(t))
+    return y.astype(np.float32)
+
+
+def _wav(y):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SR)
+        wf.writeframes((y * 32767).astype('<i2').tobytes())
+    return buf.getvalue()
+
+
+def test_batch_matches_per_clip_features():
+    clips = [
+        _clip(1.0, seed=1),
+        _clip(3.2, 180, seed=2),
+        np.zeros(0, dtype=np.float32),
+        _clip(1.1, 260, seed=3),
+    ]
+    lote = calcular_features_lote(clips, SR)
+    assert lote[2] == ({}, [])
+    for clip, (feats, serie) in zip(clips, lote):
+        if not len(clip):
+            continue
+        esperado = calcular_features(clip, SR)
+        for key in esperado:
+            assert feats[key] == pytest.approx(esperado[key], rel=1e-4, abs=1e-5), key
+        assert serie[0]['t_sec'] == 0.0
+
+
+@pytest.fixture
+def batch_env(monkeypatch):
+    monkeypatch.setattr(storage_module, '_storage', LocalShardedStorage(tempfile.mkdtemp()))
+    monkeypatch.setattr(settings, 'pcm_cache_dir', tempfile.mkdtemp())
+    monkeypatch.setattr(settings, 'enable_prosodic_features', True)
+    monkeypatch.setattr(settings, 'enable_transcription', False)
+    fake = FakeRedis()
+    monkeypatch.setattr(feature_batch, '_redis_client', fake)
+    return fake
+
+
+def test_collected_clips_run_as_one_batch(batch_env, monkeypatch):
+    store = storage_module.get_storage()
+    llamadas = []
+    original = prosodic_features.calcular_features_lote
+    monkeypatch.setattr(
+        prosodic_features,
+        'calcular_features_lote',
+        lambda clips, *a, **kw: (llamadas.append(len(clips)), original(clips, *a, **kw))[1],
+    )
+    for i in range(3):
+        store.put_bytes(f'audio/c{i}.wav', _wav(_clip(1.0 + 0.2 * i, seed=i)))
+        batch_env.rpush(
+            feature_batch.LISTA,
+            json.dumps({'id': f'r{i}', 'audio_path': f'audio/c{i}.wav', 'audio_sha256': f'c{i}'}),
+        )
+    assert feature_batch.procesar_lote() == 3
+    assert llamadas == [3]
+    for i in range(3):
+        resultado = json.loads(batch_env.lists[feature_batch.RESULTADO.format(f'r{i}')][0])
+        assert resultado['features']['duration_sec'] == pytest.approx(1.0 + 0.2 * i, abs=0.01)
+        assert resultado['features']['pitch_mean_hz'] > 0
+
+
+def test_short_clip_analysis_goes_through_batch(batch_env, monkeypatch):
+    storage_module.get_storage().put_bytes('audio/corto.wav', _wav(_clip(1.5)))
+    monkeypatch.setattr(tasks, 'extract_features_task', None)  # la ruta por clip no debe usarse
+    result = tasks.analyze_text_task(
+        {
+            'text': 'hola',
+            'audio_path': 'audio/corto.wav',
+            'audio_sha256': 'corto',
+            'force_intensity': 0.2,
+        }
+    )
+    assert result['audio_features']['pitch_mean_hz'] > 0
+    assert feature_batch.LIDER not in batch_env.kv
@@ -0,0 +1,134 @@
+import io
+import os
+import tempfile
+import wave
+
+import numpy as np
+
+from backend.app import audio_pcm, feature_cache, tasks
+from backend.app import storage as storage_module
+from backend.app.feature_cache import DiskFeatureCache, RedisFeatureCache
+from backend.app.settings import settings
+from backend.app.storage import LocalShardedStorage
+
+
+class FakeRedis:
+    def __init__(self):
+        self.kv = {}
+        self.z = {}
+
+    def get(self, key):
+        return self.kv.get(key)
+
+    def set(self, key, value):
+        self.kv[key] = value
+
+    def delete(self, *keys):
+        for k in keys:
+            self.kv.pop(k, None)
+
+    def zadd(self, name, mapping):
+        self.z.update(mapping)
+
+    def zcard(self, name):
+        return len(self.z)
+
+    def zrange(self, name, start, end):
+        return sorted(self.z, key=self.z.get)[start:end + 1]
+
+    def zrem(self, name, *members):
+        for m in members:
+            self.z.pop(m, None)
+
+    def pipeline(self):
+        cliente = self
+
+        class _Pipe:
+            def __init__(self):
+                self.ops = []
+
+            def __getattr__(self, name):
+                return lambda *a, **kw: self.ops.append((name, a, kw))
+
+            def execute(self):
+                return [getattr(cliente, n)(*a, **kw) for n, a, kw in self.ops]
+
+        return _Pipe()
+
+
+def _wav_bytes(seconds=0.5, rate=16000):
+    t = np.arange(int(rate * seconds)) / rate
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes((0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype('<i2').tobytes())
+    return buf.getvalue()
+
+
+def test_lru_eviction_and_version_key(monkeypatch):
+    for cache in (
+        DiskFeatureCache(tempfile.mkdtemp(), max_entries=3),
+        RedisFeatureCache(FakeRedis(), max_entries=3),
+    ):
+        for i in range(3):
+            cache.put(f'k{i}', {'i': i})
+            if cache.name == 'disk':
+                os.utime(cache._path(f'k{i}'), (1000 + i, 1000 + i))
+        assert cache.get('k0') == {'i': 0}  # acceso reciente: k1 pasa a ser el más antiguo
+        cache.put('k3', {'i': 3})
+        assert cache.get('k1') is None
+        assert [cache.get(k) for k in ('k0', 'k2', 'k3')] == [{'i': 0}, {'i': 2}, {'i': 3}]
+    monkeypatch.setattr(settings, 'enable_prosodic_features', False)
+    base = feature_cache.clave_features('abc', 16000)
+    monkeypatch.setattr(settings, 'enable_prosodic_features', True)
+    assert feature_cache.clave_features('abc', 16000) != base
+
+
+def test_reanalysis_served_from_cache(monkeypatch):
+    monkeypatch.setattr(storage_module, '_storage', LocalShardedStorage(tempfile.mkdtemp()))
+    monkeypatch.setattr(settings, 'pcm_cache_dir', tempfile.mkdtemp())
+    monkeypatch.setattr(settings, 'enable_transcription', False)
+    monkeypatch.setattr(
+        feature_cache, '_cache', DiskFeatureCache(tempfile.mkdtemp(), max_entries=100)
+    )
+    storage_module.get_storage().put_bytes('audio/cafe.wav', _wav_bytes())
+    payload = {
+        'text': 'hola',
+        'audio_path': 'audio/cafe.wav',
+        'audio_sha256': 'cafe',
+        'force_intensity': 0.2,
+    }
+    primero = tasks.analyze_text_task(payload)
+    assert primero['audio_features']['duration_sec'] > 0
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError('no debería decodificar')
+
+    monkeypatch.setattr(audio_pcm, 'decodificar_compartido', no_decode)
+    monkeypatch.setattr(tasks, 'extraer_features_audio', no_decode)
+    assert tasks.analyze_text_task(payload)['audio_features'] == primero['audio_features']
+
+
+def test_features_stage_runs_as_own_task_with_timeout(monkeypatch):
+    from backend.app.celery_app import celery_app
+    from backend.app.features_worker import argumentos_worker, nucleos_fisicos
+
+    assert celery_app.conf.task_routes['features.extract'] == {'queue': 'features'}
+    args = argumentos_worker()
+    assert args[args.index('-P') + 1] == 'prefork'
+    assert args[args.index('-c') + 1] == str(nucleos_fisicos())
+
+    class SlowResult:
+        def get(self, timeout=None, **kwargs):
+            raise TimeoutError(timeout)
+
+    monkeypatch.setattr(tasks.extract_features_task, 'apply_async', lambda *a, **kw: SlowResult())
+    monkeypatch.setattr(settings, 'enable_transcription', False)
+    result = tasks.analyze_text_task(
+        {'text': 'hola', 'audio_path': 'audio/nada.wav', 'force_intensity': 0.2}
+    )
+    # Sin features de audio pero el análisis termina
+    assert result['primary_emotion']
+    assert not (result.get('audio_features') or {}).get('pitch_mean_hz')
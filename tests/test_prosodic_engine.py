@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from backend.app import audio_utils
+from backend.app.prosodic_features import (
+    calcular_features,
+    calcular_features_stream,
+    marcos_prosodicos,
+)
+from backend.app.settings import settings
+
+librosa = pytest.importorskip("librosa")
+
+
+def _referencia(y, sr):
+    """Implementación anterior (una STFT por feature y bucle por frame)."""
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr, threshold=0.1)
+    pitch_values = []
+    for t in range(pitches.shape[1]):
+        pitch = pitches[magnitudes[:, t].argmax(), t]
+        if pitch > 0:
+            pitch_values.append(pitch)
+    rms = librosa.feature.rms(y=y)[0]
+    energy_mean = float(np.mean(rms))
+    mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+    return {
+        "pitch_mean_hz": float(np.mean(pitch_values)) if pitch_values else 0.0,
+        "pitch_std_hz": float(np.std(pitch_values)) if len(pitch_values) > 1 else 0.0,
+        "energy_mean_db": energy_mean,
+        "energy_std_db": float(np.std(rms)),
+        "spectral_centroid_hz": float(np.mean(librosa.feature.spectral_centroid(y=y, sr=sr)[0])),
+        "mfcc_mean": float(np.mean(mfccs)),
+        "mfcc_std": float(np.std(mfccs)),
+        "pause_ratio": float(np.sum(rms < energy_mean * 0.1) / len(rms)),
+        "pitch_range_hz": (
+            float(np.max(pitch_values) - np.min(pitch_values)) if len(pitch_values) > 1 else 0.0
+        ),
+    }
+
+
+def _senal(seconds=3.0, sr=16000):
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sr * seconds)) / sr
+    y = 0.3 * np.sin(2 * np.pi * (200 + 50 * np.sin(2 * np.pi * 0.5 * t)) * t)
+    y[int(sr * 1.0):int(sr * 1.5)] = 0.0  # pausa
+    return (y + 0.005 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def test_shared_stft_matches_previous_implementation():
+    y = _senal()
+    nuevo = calcular_features(y, 16000)
+    viejo = _referencia(y, 16000)
+    assert nuevo.keys() == viejo.keys()
+    for key in viejo:
+        assert nuevo[key] == pytest.approx(viejo[key], rel=1e-4, abs=1e-5), key
+    marcos = marcos_prosodicos(y, 16000)
+    assert marcos.mfcc.shape == (13, len(marcos.rms)) == (13, len(marcos.pitch_hz))
+    assert calcular_features(np.zeros(0, dtype=np.float32), 16000) == {}
+
+
+def test_windowed_stream_matches_whole_signal():
+    y = _senal(seconds=2.53)
+    completo = calcular_features(y, 16000)
+    # Bloques de tamaño arbitrario, ventanas que no coinciden con los bloques
+    stream, serie = calcular_features_stream(
+        (y[i:i + 777] for i in range(0, len(y), 777)), 16000, window_sec=0.7
+    )
+    for key in completo:
+        assert stream[key] == pytest.approx(completo[key], rel=1e-5, abs=1e-6), key
+    assert [w["t_sec"] for w in serie] == [0.0, 0.67, 1.34, 2.02]
+    # La ventana con la pausa (1.0-1.5 s) concentra los frames de baja energía
+    assert max(serie, key=lambda w: w["pause_ratio"])["t_sec"] == 0.67
+
+
+def test_pcm_features_cover_full_recording(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'enable_prosodic_features', True)
+    monkeypatch.setattr(settings, 'prosodic_window_sec', 10.0)
+    sr = 16000
+    y = np.zeros(sr * 45, dtype=np.float32)
+    t = np.arange(sr * 5) / sr
+    y[sr * 38:sr * 43] = 0.3 * np.sin(2 * np.pi * 220 * t)  # solo hay voz pasados los 30 s
+    path = tmp_path / 'a.f32'
+    y.tofile(path)
+    feats = audio_utils.extraer_features_pcm(np.memmap(path, dtype=np.float32, mode='r'), sr)
+    assert feats['duration_sec'] == pytest.approx(45.0)
+    assert feats['pitch_mean_hz'] > 0
+    serie = feats['prosodic_series']
+    assert len(serie) == 5 and serie[3]['energy_mean'] > 0 and serie[0]['energy_mean'] == 0
@@ -0,0 +1,139 @@
+import os
+import tempfile
+
+import pytest
+
+from backend.app.storage import LocalShardedStorage, S3Storage, _shard
+
+
+class _NotFound(Exception):
+    def __init__(self):
+        super().__init__("not found")
+        self.response = {"Error": {"Code": "404"}}
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self, amt=None):
+        if amt is None:
+            amt = len(self._data)
+        chunk, self._data = self._data[:amt], self._data[amt:]
+        return chunk
+
+
+class FakeS3Client:
+    """Subconjunto de la API boto3 usada por S3Storage (sustituto de MinIO en tests)."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise _NotFound()
+        data = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = Range.removeprefix("bytes=").split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": _Body(data)}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise _NotFound()
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective=None):
+        origen = self.get_object(CopySource["Bucket"], CopySource["Key"])
+        self.objects[(Bucket, Key)] = origen["Body"].read()
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, "rb") as f:
+            self.objects[(Bucket, Key)] = f.read()
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        return {
+            "Contents": [{"Key": k, "Size": len(self.objects[(Bucket, k)])} for k in keys],
+            "IsTruncated": False,
+        }
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, "wb") as f:
+            f.write(self.get_object(Bucket, Key)["Body"].read())
+
+
+def test_shard_layout():
+    sha = "abcdef" + "0" * 58
+    assert _shard(f"audio/{sha}.wav") == f"audio/ab/cd/{sha}.wav"
+    # Nombres no hexadecimales se fragmentan por sha1 del nombre (estable)
+    assert _shard("derived/norm_x.wav") == _shard("derived/norm_x.wav")
+    assert _shard("derived/norm_x.wav").count("/") == 3
+
+
+@pytest.mark.parametrize("kind", ["local", "s3"])
+def test_storage_roundtrip(kind):
+    if kind == "local":
+        backend = LocalShardedStorage(tempfile.mkdtemp())
+    else:
+        backend = S3Storage("bucket", client=FakeS3Client(), prefix="emotrack")
+    key = "audio/0123abcd.wav"
+    assert not backend.exists(key)
+    backend.put_bytes(key, b"RIFF-data")
+    assert backend.exists(key)
+    assert backend.size(key) == 9
+    assert backend.get_bytes(key) == b"RIFF-data"
+    assert backend.touch(key) is True
+    assert backend.touch("audio/ffff0000.wav") is False
+    with backend.local_path(key) as path:
+        with open(path, "rb") as f:
+            assert f.read() == b"RIFF-data"
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        tmp.write(b"moved")
+    backend.put_file("derived/norm_0123abcd.wav", tmp.name, move=True)
+    assert not os.path.exists(tmp.name)
+    assert backend.get_bytes("derived/norm_0123abcd.wav") == b"moved"
+    assert backend.delete(key) is True
+    assert backend.get_bytes(key) is None
+    with pytest.raises(FileNotFoundError):
+        with backend.local_path(key):
+            pass
+
+
+def test_s3_object_keys_are_prefixed_and_sharded():
+    client = FakeS3Client()
+    backend = S3Storage("bucket", client=client, prefix="emotrack")
+    backend.put_bytes("audio/ffee0011.webm", b"x")
+    assert ("bucket", "emotrack/audio/ff/ee/ffee0011.webm") in client.objects
+
+
+@pytest.mark.parametrize("kind", ["local", "s3"])
+def test_list_shard(kind):
+    if kind == "local":
+        backend = LocalShardedStorage(tempfile.mkdtemp())
+    else:
+        backend = S3Storage("bucket", client=FakeS3Client(), prefix="emotrack")
+    backend.put_bytes("audio/abcd01.wav", b"123")
+    backend.put_bytes("audio/abce02.wav", b"4")
+    listed = list(backend.list_shard("audio", "ab/cd"))
+    assert [(k, size) for k, size, _ in listed] == [("audio/abcd01.wav", 3)]
+    assert list(backend.list_shard("audio", "ff/ff")) == []
+
+
+@pytest.mark.parametrize("kind", ["local", "s3"])
+def test_iter_range_and_stat(kind):
+    if kind == "local":
+        backend = LocalShardedStorage(tempfile.mkdtemp())
+    else:
+        backend = S3Storage("bucket", client=FakeS3Client())
+    data = bytes(range(256)) * 4
+    backend.put_bytes("audio/abcd.wav", data)
+    assert backend.stat("audio/abcd.wav")[0] == len(data)
+    assert backend.stat("audio/missing.wav") is None
+    assert b"".join(backend.iter_range("audio/abcd.wav", 100, 300, chunk_size=64)) == data[100:400]
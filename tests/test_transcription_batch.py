@@ -0,0 +1,164 @@
+import json
+
+from backend.app import events, tasks, transcription_batch
+from backend.app.db import session_scope
+from backend.app.models import Response, ResponseStatus
+from backend.app.settings import settings
+
+
+class FakeRedis:
+    def __init__(self):
+        self.lists = {}
+        self.kv = {}
+        self.published = []
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value)
+
+    def lmove(self, src, dst, wherefrom, whereto):
+        items = self.lists.get(src, [])
+        if not items:
+            return None
+        value = items.pop(0 if wherefrom == 'LEFT' else -1)
+        dest = self.lists.setdefault(dst, [])
+        dest.insert(0 if whereto == 'LEFT' else len(dest), value)
+        return value
+
+    def lrem(self, key, count, value):
+        items = self.lists.get(key, [])
+        if value in items:
+            items.remove(value)
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def exists(self, key):
+        return int(key in self.kv)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.kv:
+            return None
+        self.kv[key] = value
+        return True
+
+    def delete(self, key):
+        self.kv.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+        self.pending = []
+
+    def publish(self, channel, message):
+        self.pending.append(json.loads(message))
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        if self.pending:
+            self.redis.published.append(self.pending)
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+def _pendientes(n):
+    ids = []
+    with session_scope() as s:
+        for _ in range(n):
+            row = Response(child_name='c', emotion='Unknown', status=ResponseStatus.COMPLETED,
+                           transcript='<audio_pending_transcription>',
+                           analysis_json={'transcript': '<audio_pending_transcription>'})
+            s.add(row)
+            s.flush()
+            ids.append(row.id)
+    return ids
+
+
+def test_queued_clips_are_transcribed_in_one_batch(monkeypatch, tmp_path):
+    fake = FakeRedis()
+    monkeypatch.setattr(transcription_batch, '_redis_client', fake)
+    monkeypatch.setattr(events, '_redis_client', fake)
+    monkeypatch.setattr(settings, 'transcription_batch_window_ms', 10_000)  # que no se dispare solo
+    transcritos = []
+    monkeypatch.setattr(tasks, 'transcribir_audio',
+                        lambda path, **kw: (transcritos.append(path), f'texto {path[-5]}')[1])
+    programadas = []
+    ids = _pendientes(3)
+    for i, rid in enumerate(ids):
+        audio = tmp_path / f'clip{i}.wav'
+        audio.write_bytes(b'RIFF')
+        assert transcription_batch.encolar(
+            {'audio_path': str(audio), 'response_id': rid}, programadas.append
+        )
+    assert programadas == [10.0]  # solo el primero programa el lote
+
+    assert tasks.transcribe_audio_batch_task() == {'processed': 3, 'transcribed': 3}
+    assert len(transcritos) == 3
+    assert transcription_batch.LIDER not in fake.kv
+    assert fake.lists[transcription_batch.PROCESANDO] == []
+    assert [[e['response_id'] for e in lote] for lote in fake.published] == [ids]
+    with session_scope() as s:
+        for i, rid in enumerate(ids):
+            row = s.get(Response, rid)
+            assert row.transcript == f'texto {i}'
+            assert row.analysis_json['transcript'] == f'texto {i}'
+
+
+def test_without_redis_falls_back_to_per_clip_task(monkeypatch):
+    monkeypatch.setattr(transcription_batch, '_get_client', lambda: None)
+    assert transcription_batch.encolar({'audio_path': 'x'}, lambda c: None) is False
+
+
+def _fake(monkeypatch, tmp_path, n):
+    fake = FakeRedis()
+    monkeypatch.setattr(transcription_batch, '_redis_client', fake)
+    monkeypatch.setattr(events, '_redis_client', fake)
+    monkeypatch.setattr(settings, 'transcription_batch_window_ms', 10_000)
+    monkeypatch.setattr(tasks, 'transcribir_audio', lambda path, **kw: 'texto')
+    ids = _pendientes(n)
+    for i, rid in enumerate(ids):
+        audio = tmp_path / f'clip{i}.wav'
+        audio.write_bytes(b'RIFF')
+        transcription_batch.encolar({'audio_path': str(audio), 'response_id': rid}, lambda c: None)
+    return fake, ids
+
+
+def test_one_batch_per_invocation_and_next_is_scheduled(monkeypatch, tmp_path):
+    fake, ids = _fake(monkeypatch, tmp_path, 3)
+    monkeypatch.setattr(settings, 'transcription_batch_size', 2)
+    programadas = []
+    monkeypatch.setattr(tasks, '_programar_lote_transcripcion', programadas.append)
+    assert tasks.transcribe_audio_batch_task() == {'processed': 2, 'transcribed': 2}
+    assert programadas == [0]
+    assert len(fake.lists[transcription_batch.LISTA]) == 1
+
+
+def test_failed_commit_requeues_and_publishes_nothing(monkeypatch, tmp_path):
+    fake, ids = _fake(monkeypatch, tmp_path, 2)
+
+    def falla(s, rid, transcript):
+        raise RuntimeError('db caída')
+
+    monkeypatch.setattr(tasks, '_guardar_transcripcion', falla)
+    monkeypatch.setattr(tasks, '_programar_lote_transcripcion', lambda c: None)
+    assert 'error' in tasks.transcribe_audio_batch_task()
+    assert fake.published == []
+    assert fake.lists[transcription_batch.PROCESANDO] == []
+    pendientes = [json.loads(c) for c in fake.lists[transcription_batch.LISTA]]
+    assert [p['response_id'] for p in pendientes] == ids
+    assert all(p['intentos'] == 1 for p in pendientes)
+
+
+def test_clips_of_a_killed_task_are_recovered(monkeypatch, tmp_path):
+    fake, ids = _fake(monkeypatch, tmp_path, 2)
+    # Una tarea tomó el lote y murió: los clips siguen en la lista de proceso
+    assert len(transcription_batch.tomar_lote()) == 2
+    assert tasks.transcribe_audio_batch_task() == {'processed': 0, 'transcribed': 0}
+    fake.kv.pop(transcription_batch.CONCESION)  # la concesión caduca con el time limit
+    assert tasks.transcribe_audio_batch_task() == {'processed': 2, 'transcribed': 2}
+    assert [e['response_id'] for e in fake.published[-1]] == ids
@@ -0,0 +1,140 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from backend.app import audio_utils, audio_vad, transcription_cache
+from backend.app.metrics import TRANSCRIPTION_CACHE_REQUESTS
+from backend.app.settings import settings
+from backend.app.transcription_cache import SQLiteTranscriptionCache
+
+
+class Reloj:
+    def __init__(self):
+        self.t = 1000.0
+
+    def time(self):
+        self.t += 1
+        return self.t
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(transcription_cache, 'time', reloj)
+    return reloj
+
+
+def test_byte_cap_evicts_least_recently_used(tmp_path, reloj):
+    cache = SQLiteTranscriptionCache(str(tmp_path / 'c.sqlite'), max_bytes=100)
+    cache.put('a:base', 'x' * 40, ttl=None)
+    cache.put('b:base', 'y' * 40, ttl=None)
+    assert cache.get('a:base') == 'x' * 40  # 'a' pasa a ser la más reciente
+    cache.put('c:base', 'z' * 40, ttl=None)  # 120 bytes > 100: sale 'b'
+    assert cache.get('b:base') is None
+    assert cache.get('a:base') == 'x' * 40
+    assert cache.get('c:base') == 'z' * 40
+
+
+def test_byte_total_tracked_without_scans(tmp_path, reloj):
+    cache = SQLiteTranscriptionCache(str(tmp_path / 'c.sqlite'), max_bytes=10_000)
+
+    def total():
+        conn = cache._conn()
+        guardado = conn.execute("SELECT v FROM transcripts_meta WHERE k = 'bytes'").fetchone()[0]
+        assert (
+            guardado == conn.execute('SELECT COALESCE(SUM(size), 0) FROM transcripts').fetchone()[0]
+        )
+        return guardado
+
+    cache.put('a:base', 'x' * 40, ttl=None)
+    cache.put('a:base', 'x' * 10, ttl=None)  # reemplazo: descuenta el tamaño anterior
+    cache.put('b:base', 'y' * 30, ttl=5)
+    assert total() == 40
+    reloj.t += 10
+    assert cache.get('b:base') is None  # caducada
+    assert total() == 10
+    cache.borrar('a')
+    assert total() == 0
+    # Una base creada antes de la tabla de totales se inicializa con la suma existente
+    conn = cache._conn()
+    conn.execute("INSERT INTO transcripts VALUES ('c:base', 'c', 'zz', 2, NULL, 0)")
+    conn.execute('DROP TABLE transcripts_meta')
+    assert SQLiteTranscriptionCache(cache.path, 10_000)._conn().execute(
+        "SELECT v FROM transcripts_meta WHERE k = 'bytes'").fetchone()[0] == 2
+
+
+def test_ttl_per_model(tmp_path, reloj, monkeypatch):
+    monkeypatch.setattr(settings, 'transcription_cache_ttl_days', 1)
+    monkeypatch.setattr(settings, 'transcription_cache_ttl_by_model', 'large-v3=90, tiny=0')
+    assert transcription_cache.ttl_segundos('base') == 86400
+    assert transcription_cache.ttl_segundos('large-v3') == 90 * 86400
+    assert transcription_cache.ttl_segundos('tiny') is None
+    cache = SQLiteTranscriptionCache(str(tmp_path / 'c.sqlite'), max_bytes=10_000)
+    cache.put('a:base', 'hola', ttl=transcription_cache.ttl_segundos('base'))
+    cache.put('b:tiny', 'adios', ttl=transcription_cache.ttl_segundos('tiny'))
+    reloj.t += 2 * 86400
+    assert cache.get('a:base') is None
+    assert cache.get('b:tiny') == 'adios'
+    cache.borrar('b')
+    assert cache.get('b:tiny') is None
+
+
+def test_transcription_served_from_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'enable_transcription', True)
+    monkeypatch.setattr(settings, 'transcription_parallel_enabled', False)
+    monkeypatch.setattr(
+        transcription_cache, '_cache', SQLiteTranscriptionCache(str(tmp_path / 'c.sqlite'), 1 << 20)
+    )
+    llamadas = []
+    monkeypatch.setattr(audio_utils, '_whisper', lambda audio: llamadas.append(1) or 'hola')
+    pcm_path = tmp_path / 'clip.f32'
+    np.zeros(16000, dtype=np.float32).tofile(pcm_path)
+    hits = TRANSCRIPTION_CACHE_REQUESTS.labels('sqlite', 'hit')._value.get()
+    for _ in range(2):
+        assert audio_utils.transcribir_audio('x', pcm_path=str(pcm_path)) == 'hola'
+    assert llamadas == [1]
+    assert TRANSCRIPTION_CACHE_REQUESTS.labels('sqlite', 'hit')._value.get() == hits + 1
+    # Sin hash de ingesta la clave usa el sha256 del archivo (leído por bloques)
+    sha = hashlib.sha256(pcm_path.read_bytes()).hexdigest()
+    assert audio_utils._get_transcription_cache_key(str(pcm_path), 'base', 'auto') == \
+        transcription_cache.clave_transcripcion(sha, 'base', 'auto')
+
+
+def test_key_follows_effective_inference_params(tmp_path, monkeypatch):
+    from backend.app import whisper_registry
+
+    monkeypatch.setattr(settings, 'transcription_model', 'base')
+    monkeypatch.setattr(settings, 'transcription_compute_type', 'float32')
+    monkeypatch.setattr(settings, 'whisper_profile_path', str(tmp_path / 'no-existe.json'))
+    whisper_registry.vaciar()
+    try:
+        sin_perfil = transcription_cache.clave_transcripcion('abc', 'base', 'es')
+        assert (
+            sin_perfil
+            == f'abc:base:float32:b{settings.transcription_beam_size}:{audio_vad.firma()}:es'
+        )
+        # El perfil de autotune cambia compute_type y beam: entradas distintas
+        perfil = tmp_path / 'perfil.json'
+        perfil.write_text('{"model": "base", "compute_type": "int8", "beam_size": 5}')
+        monkeypatch.setattr(settings, 'whisper_profile_path', str(perfil))
+        whisper_registry.vaciar()
+        assert (
+            transcription_cache.clave_transcripcion('abc', 'base', 'es')
+            == f'abc:base:int8:b5:{audio_vad.firma()}:es'
+        )
+    finally:
+        whisper_registry.vaciar()
+
+
+def test_key_follows_vad_settings(monkeypatch):
+    claves = {transcription_cache.clave_transcripcion('abc', 'base', 'es')}
+    for nombre, valor in [
+        ('vad_margin_db', 14.0),
+        ('vad_padding_ms', 50),
+        ('vad_min_speech_ms', 300),
+        ('vad_enabled', False),
+    ]:
+        monkeypatch.setattr(settings, nombre, valor)
+        claves.add(transcription_cache.clave_transcripcion('abc', 'base', 'es'))
+    assert len(claves) == 5
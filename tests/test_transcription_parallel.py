@@ -0,0 +1,55 @@
+import threading
+import time
+
+import numpy as np
+
+from backend.app import audio_utils
+from backend.app.settings import settings
+from backend.app.transcription_parallel import planificar
+
+SR = 16000
+
+
+def test_plan_cuts_only_between_regions_and_splits_long_ones():
+    y = np.zeros(SR * 100, dtype=np.float32)
+    segmentos = [(0, 12 * SR), (13 * SR, 25 * SR), (26 * SR, 40 * SR), (41 * SR, 95 * SR)]
+    trozos = planificar(y, segmentos, SR, objetivo_sec=30)
+    assert trozos[0] == [(0, 12 * SR), (13 * SR, 25 * SR)]
+    assert trozos[1] == [(26 * SR, 40 * SR)]
+    largos = [region for trozo in trozos[2:] for region in trozo]
+    assert largos[0][0] == 41 * SR and largos[-1][1] == 95 * SR
+    assert all(fin - inicio <= 30 * SR for inicio, fin in largos)
+    assert all(a[1] == b[0] for a, b in zip(largos, largos[1:]))  # sin huecos ni solapes
+
+
+def test_long_recording_is_transcribed_in_parallel_with_partials(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'enable_transcription', True)
+    monkeypatch.setattr(settings, 'transcription_cache_enabled', False)
+    monkeypatch.setattr(settings, 'transcription_parallel_workers', 3)
+    monkeypatch.setattr(settings, 'transcription_parallel_min_sec', 60)
+    pcm = np.zeros(SR * 120, dtype=np.float32)
+    segmentos = [[i * 10 * SR, (i * 10 + 8) * SR] for i in range(12)]
+    pcm_path = tmp_path / 'largo.f32'
+    pcm.tofile(pcm_path)
+
+    activos, maximo, lock = [0], [0], threading.Lock()
+
+    def fake_whisper(audio):
+        with lock:
+            activos[0] += 1
+            maximo[0] = max(maximo[0], activos[0])
+        time.sleep(0.05)
+        with lock:
+            activos[0] -= 1
+        return f'{len(audio) // SR}s'
+
+    monkeypatch.setattr(audio_utils, '_whisper', fake_whisper)
+    parciales = []
+    texto = audio_utils.transcribir_audio('x', pcm_path=str(pcm_path), segmentos=segmentos,
+                                          al_segmento=lambda *args: parciales.append(args))
+    # 12 regiones de 8 s -> 4 trozos de 3 regiones (24 s de voz cada uno)
+    assert texto == '24s 24s 24s 24s'
+    assert sorted(p[0] for p in parciales) == [0, 1, 2, 3]
+    assert all(p[1] == 4 for p in parciales)
+    assert sorted((p[2], p[3]) for p in parciales)[0] == (0.0, 28.0)
+    assert maximo[0] > 1
@@ -0,0 +1,190 @@
+import hashlib
+import io
+import os
+import tempfile
+import wave
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import select
+
+from backend.app import storage as storage_module
+from backend.app.db import session_scope
+from backend.app.main import app
+from backend.app.models import Response, UploadSession
+from backend.app.settings import settings
+from backend.app.storage import LocalShardedStorage
+from backend.app.upload_sessions import expirar_sesiones
+
+client = TestClient(app)
+
+
+def _wav(seconds=0.5, rate=16000):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(b'\x01\x00' * int(rate * seconds))
+    return buf.getvalue()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    backend = LocalShardedStorage(tempfile.mkdtemp())
+    monkeypatch.setattr(storage_module, '_storage', backend)
+    return backend
+
+
+def _parts(backend):
+    return [f for _, _, files in os.walk(os.path.join(backend.root, 'upload_parts')) for f in files]
+
+
+def test_resumable_upload_roundtrip(store):
+    body = _wav()
+    r = client.post(
+        '/api/uploads',
+        json={'filename': 'clip.wav', 'size': len(body), 'child_id': 'Resume', 'text': 'hola'},
+    )
+    assert r.status_code == 201, r.text
+    upload_id = r.json()['upload_id']
+    url = f'/api/uploads/{upload_id}'
+
+    first = client.patch(url, content=body[:5000], headers={'Upload-Offset': '0'})
+    assert first.status_code == 204
+    assert first.headers['upload-offset'] == '5000'
+    # Reintento con offset desfasado: 409 con el offset confirmado
+    stale = client.patch(url, content=body[:5000], headers={'Upload-Offset': '0'})
+    assert stale.status_code == 409
+    assert stale.json()['offset'] == 5000
+    assert client.get(url).json()['offset'] == 5000
+    # Finalizar antes de completar no es válido
+    assert client.post(f'{url}/finalize').status_code == 409
+
+    assert (
+        client.patch(url, content=body[5000:], headers={'Upload-Offset': '5000'}).status_code == 204
+    )
+    done = client.post(f'{url}/finalize')
+    assert done.status_code == 202, done.text
+    sha = hashlib.sha256(body).hexdigest()
+    with session_scope() as s:
+        row = s.get(Response, done.json()['response_id'])
+        assert row.audio_sha256 == sha
+        assert row.audio_path == f'audio/{sha}.wav'
+        up = s.get(UploadSession, upload_id)
+        assert up.status == 'finalized'
+        assert up.response_id == done.json()['response_id']
+    assert store.get_bytes(f'audio/{sha}.wav') == body
+    assert _parts(store) == []
+    assert client.get(url).json()['status'] == 'finalized'
+    # Ya finalizada no admite más partes
+    assert (
+        client.patch(url, content=b'x', headers={'Upload-Offset': str(len(body))}).status_code
+        == 409
+    )
+
+
+def test_finalize_is_idempotent(store):
+    body = _wav()
+    upload_id = client.post(
+        '/api/uploads', json={'filename': 'r.wav', 'size': len(body), 'child_id': 'Retry'}
+    ).json()['upload_id']
+    client.patch(f'/api/uploads/{upload_id}', content=body, headers={'Upload-Offset': '0'})
+    first = client.post(f'/api/uploads/{upload_id}/finalize')
+    retry = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert first.status_code == retry.status_code == 202
+    assert retry.json()['response_id'] == first.json()['response_id']
+    assert retry.json()['task_id'] == first.json()['task_id']
+    with session_scope() as s:
+        assert len(s.exec(select(Response).where(Response.child_name == 'Retry')).all()) == 1
+
+
+def test_concurrent_finalize_claims_once(store):
+    body = _wav()
+    upload_id = client.post(
+        '/api/uploads', json={'filename': 'c.wav', 'size': len(body)}
+    ).json()['upload_id']
+    client.patch(f'/api/uploads/{upload_id}', content=body, headers={'Upload-Offset': '0'})
+    # Otra petición ya reclamó la sesión y está ensamblando el audio
+    with session_scope() as s:
+        up = s.get(UploadSession, upload_id)
+        up.status = 'finalizing'
+        up.claimed_at = datetime.now(timezone.utc)
+        s.add(up)
+    r = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert r.status_code == 409
+    assert r.json()['detail'] == 'upload_finalizing'
+    assert len(_parts(store)) == 1
+
+
+def test_stale_finalize_claim_is_taken_over(store):
+    body = _wav()
+    upload_id = client.post(
+        '/api/uploads', json={'filename': 'c.wav', 'size': len(body)}
+    ).json()['upload_id']
+    client.patch(f'/api/uploads/{upload_id}', content=body, headers={'Upload-Offset': '0'})
+    # El proceso que reclamó la sesión cayó hace más que la concesión
+    with session_scope() as s:
+        up = s.get(UploadSession, upload_id)
+        up.status = 'finalizing'
+        up.claimed_at = datetime.now(timezone.utc) - timedelta(
+            seconds=settings.upload_finalize_lease_sec + 60
+        )
+        s.add(up)
+    r = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert r.status_code == 202
+    with session_scope() as s:
+        assert s.get(Response, r.json()['response_id']).task_id == r.json()['task_id']
+    assert client.get(f'/api/uploads/{upload_id}').json()['status'] == 'finalized'
+    assert _parts(store) == []
+
+
+def test_invalid_audio_rejected_on_finalize(store):
+    body = b'<html>' * 100
+    upload_id = client.post(
+        '/api/uploads', json={'filename': 'x.wav', 'size': len(body)}
+    ).json()['upload_id']
+    client.patch(f'/api/uploads/{upload_id}', content=body, headers={'Upload-Offset': '0'})
+    r = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert r.status_code == 400
+    assert _parts(store) == []
+
+
+def test_abandoned_sessions_expire(store):
+    body = _wav()
+    upload_id = client.post(
+        '/api/uploads', json={'filename': 'a.wav', 'size': len(body)}
+    ).json()['upload_id']
+    client.patch(f'/api/uploads/{upload_id}', content=body[:100], headers={'Upload-Offset': '0'})
+    with session_scope() as s:
+        up = s.get(UploadSession, upload_id)
+        up.expires_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+        s.add(up)
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 410
+    assert expirar_sesiones() >= 1
+    assert _parts(store) == []
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+
+
+def test_response_committed_before_enqueue(store, monkeypatch):
+    from backend.app import main
+
+    body = _wav()
+    upload_id = client.post(
+        '/api/uploads', json={'filename': 'e.wav', 'size': len(body)}
+    ).json()['upload_id']
+    client.patch(f'/api/uploads/{upload_id}', content=body, headers={'Upload-Offset': '0'})
+    visto = []
+
+    def encolar(payload, task_id=None):
+        # Lo que lee el worker: otra sesión
+        with session_scope() as s:
+            row = s.get(Response, payload['response_id'])
+            visto.append(row is not None and row.task_id == task_id)
+        return task_id
+
+    monkeypatch.setattr(main, 'enqueue_analysis_task', encolar)
+    r = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert r.status_code == 202
+    assert visto == [True]
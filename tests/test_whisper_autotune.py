@@ -0,0 +1,60 @@
+import json
+import time
+
+import numpy as np
+
+from backend.app import whisper_autotune, whisper_registry
+from backend.app.settings import settings
+from backend.app.whisper_autotune import Clip, autotune, combinaciones, escribir_perfil, wer
+
+TEXTO = 'el perro corre por el parque'
+
+
+class FakeModel:
+    # int8 rápido y exacto; int8_float32 rápido pero cambia una palabra; float32 lento
+    coste = {'int8': 0.002, 'int8_float32': 0.001, 'float32': 0.01}
+
+    def __init__(self, model, compute_type, cpu_threads, num_workers):
+        self.compute_type = compute_type
+
+    def transcribe(self, audio, beam_size=1, language=None):
+        class Seg:
+            text = TEXTO if self.compute_type != 'int8_float32' else TEXTO.replace('perro', 'gato')
+        time.sleep(self.coste[self.compute_type])
+        return iter([Seg()]), None
+
+
+def test_wer():
+    assert wer(TEXTO, TEXTO.upper() + '.') == 0
+    assert wer(TEXTO, TEXTO.replace('perro', 'gato')) == 1 / 6
+    assert wer(TEXTO, 'el perro corre') == 3 / 6
+
+
+def test_autotune_picks_fastest_within_wer_drift(tmp_path, monkeypatch):
+    clips = [Clip(f'c{i}.wav', np.zeros(16000, dtype=np.float32)) for i in range(4)]
+    combos = combinaciones(whisper_autotune.COMPUTE_TYPES, [1, 2], [1, 2], [1], presupuesto=2)
+    assert ('int8', 2, 2, 1) not in combos  # 4 hilos no caben en 2 núcleos
+    resultados, elegido = autotune(clips, combos, 'base', max_wer_drift=0.05, cargar=FakeModel)
+    assert (elegido.compute_type, elegido.wer_drift) == ('int8', 0.0)
+    assert all(r.wer_drift > 0.05 for r in resultados if r.compute_type == 'int8_float32')
+
+    # El registro aplica el perfil escrito al modelo configurado
+    path = escribir_perfil(elegido, str(tmp_path / 'perfil.json'), 'base')
+    assert json.load(open(path))['compute_type'] == 'int8'
+    monkeypatch.setattr(settings, 'whisper_profile_path', path)
+    monkeypatch.setattr(settings, 'transcription_model', 'base')
+    monkeypatch.setattr(settings, 'transcription_compute_type', 'float32')
+    whisper_registry.vaciar()
+    try:
+        assert whisper_registry.clave_modelo() == ('base', 'int8', elegido.cpu_threads)
+        assert whisper_registry.beam_size() == 1
+        # perfil de otro modelo: se ignora
+        monkeypatch.setattr(settings, 'transcription_model', 'small')
+        whisper_registry.vaciar()
+        assert whisper_registry.clave_modelo() == (
+            'small',
+            'float32',
+            settings.transcription_cpu_threads,
+        )
+    finally:
+        whisper_registry.vaciar()
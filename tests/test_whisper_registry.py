@@ -0,0 +1,46 @@
+import numpy as np
+
+from backend.app import audio_utils, whisper_registry
+from backend.app.settings import settings
+
+
+class FakeModel:
+    def __init__(self, clave):
+        self.clave = clave
+
+    def transcribe(self, source, **kwargs):
+        class Seg:
+            text = ' hola '
+        return iter([Seg()]), None
+
+
+def test_model_loaded_once_and_reused(monkeypatch):
+    cargas = []
+    monkeypatch.setattr(
+        whisper_registry, '_cargar', lambda clave: cargas.append(clave) or FakeModel(clave)
+    )
+    monkeypatch.setattr(settings, 'enable_transcription', True)
+    whisper_registry.vaciar()
+    try:
+        for _ in range(5):
+            assert audio_utils.transcribir_muestras(np.zeros(16000, dtype=np.float32)) == 'hola'
+        assert cargas == [whisper_registry.clave_modelo()]
+    finally:
+        whisper_registry.vaciar()
+
+
+def test_lru_eviction_under_memory_budget(monkeypatch):
+    rss = iter(range(0, 10 ** 10, 400 * 1024 * 1024))  # cada carga añade 400 MB
+    monkeypatch.setattr(whisper_registry, '_rss_bytes', lambda: next(rss))
+    monkeypatch.setattr(whisper_registry, '_cargar', FakeModel)
+    monkeypatch.setattr(settings, 'whisper_memory_budget_mb', 1000)
+    whisper_registry.vaciar()
+    try:
+        tiny = whisper_registry.obtener_modelo('tiny')
+        whisper_registry.obtener_modelo('base')
+        assert whisper_registry.obtener_modelo('tiny') is tiny  # uso reciente: 'base' es el LRU
+        whisper_registry.obtener_modelo('small')
+        claves = [c[0] for c in whisper_registry._modelos]
+        assert claves == ['tiny', 'small']
+    finally:
+        whisper_registry.vaciar()